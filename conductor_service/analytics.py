@@ -0,0 +1,62 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db.models import Case, Count, DecimalField, F, FilteredRelation, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from core.models import Booking
+
+# Bookings that count towards the figures: cash tickets and scanned online tickets.
+COUNTED = Q(created_by_conductor=True) | Q(created_online=True, verified_by_conductor=True)
+ONLINE = Q(created_online=True, verified_by_conductor=True)
+MANUAL = Q(created_by_conductor=True)
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+ZERO = Decimal('0.00')
+
+
+def _money(total):
+    return Coalesce(total, Value(ZERO), output_field=MONEY)
+
+
+# Every figure is one aggregate expression, so they are all computed in a single pass.
+METRICS = {
+    'total_bookings': Count('id'),
+    'total_seats': Coalesce(Sum('seats'), 0),
+    'total_fare': _money(Sum('fare')),
+    'online_count': Count('id', filter=ONLINE),
+    'manual_count': Count('id', filter=MANUAL),
+    'online_fare': _money(Sum('fare', filter=ONLINE)),
+    'manual_fare': _money(Sum('fare', filter=MANUAL)),
+}
+
+# Breakdown dimensions. A manual ticket belongs to the conductor who issued it,
+# an online ticket to the conductor whose scan accepted it.
+BREAKDOWNS = ('route', 'conductor')
+
+
+def counted_bookings(start, end):
+    """Counted bookings made from ``start`` to ``end`` (dates, inclusive)."""
+    tz = timezone.get_current_timezone()
+    return Booking.objects.filter(
+        COUNTED,
+        booking_time__gte=datetime.combine(start, time.min, tzinfo=tz),
+        booking_time__lt=datetime.combine(end + timedelta(days=1), time.min, tzinfo=tz),
+    )
+
+
+def with_conductor(bookings, name, field):
+    """
+    Annotate ``name`` with ``field`` of the conductor a booking counts for:
+    the issuer of a cash ticket, or the conductor whose scan accepted an
+    online ticket.
+    """
+    return bookings.annotate(
+        accepted_scan=FilteredRelation('qrvalidationlog', condition=Q(qrvalidationlog__is_valid=True)),
+        **{name: Case(
+            When(MANUAL, then=F(f'user__conductor_profile__{field}')),
+            default=F(f'accepted_scan__conductor__{field}'),
+        )},
+    )
+
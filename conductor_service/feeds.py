@@ -0,0 +1,54 @@
+"""
+Booking feed of the conductor dashboard, keyset-paginated on
+``(counted_at, id)`` with core.pagination.
+
+Bookings appear in the order they started counting: a cash ticket when it
+is issued, an online ticket when it is scanned, usually well after it was
+booked. So a poll with the last cursor also picks up online tickets
+scanned since, whenever they were booked.
+"""
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from core.models import Booking
+
+from .analytics import COUNTED, with_conductor
+
+FEED_FIELDS = (
+    'id', 'route', 'source', 'destination', 'seats', 'fare',
+    'created_by_conductor', 'booking_time', 'counted_at',
+)
+
+
+def booking_feed(day, conductor_id=None, route=None, schedule_id=None):
+    """
+    Bookings that started counting on ``day``, optionally only those
+    counted for a conductor, on a route or on a schedule.
+    """
+    tz = timezone.get_current_timezone()
+    bookings = Booking.objects.filter(
+        COUNTED,
+        counted_at__gte=datetime.combine(day, time.min, tzinfo=tz),
+        counted_at__lt=datetime.combine(day + timedelta(days=1), time.min, tzinfo=tz),
+    )
+    if conductor_id is not None:
+        bookings = with_conductor(bookings, 'conductor_key', 'id').filter(conductor_key=conductor_id)
+    if route:
+        bookings = bookings.filter(route=route)
+    if schedule_id is not None:
+        bookings = bookings.filter(schedule_id=schedule_id)
+    return bookings.values(*FEED_FIELDS)
+
+
+def feed_row(booking):
+    return {
+        'id': booking['id'],
+        'route': str(booking['route']),
+        'source': booking['source'],
+        'destination': booking['destination'],
+        'seats': booking['seats'],
+        'fare': booking['fare'],
+        'type': 'Manual' if booking['created_by_conductor'] else 'Online',
+        'time': booking['booking_time'].strftime("%H:%M:%S"),
+    }
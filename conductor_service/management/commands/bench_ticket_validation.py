@@ -0,0 +1,75 @@
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from conductor_service.models import QRValidationLog
+from conductor_service.validation import validate_ticket
+from core.models import Booking
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure ticket scans/sec with concurrent conductors, each ticket scanned "
+        "several times, and check every ticket was accepted exactly once. "
+        "Writes to the configured database and cleans up."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tickets', type=int, default=1000)
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--scans-per-ticket', type=int, default=2)
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user('bench_ticket_validation')
+        bookings = Booking.objects.bulk_create([
+            Booking(user=user, route='BENCH', source='A', destination='B', seats=1, fare=10)
+            for _ in range(options['tickets'])
+        ])
+        # Repeat scans of a ticket sit next to each other, so they land on different threads at once
+        ids = [b.id for b in bookings for _ in range(options['scans_per_ticket'])]
+        threads_n = options['threads']
+        counts, errors = {}, []
+        lock = threading.Lock()
+
+        def conductor(n):
+            local = {}
+            try:
+                for booking_id in ids[n::threads_n]:
+                    status, _ = validate_ticket(booking_id)
+                    local[status] = local.get(status, 0) + 1
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+            finally:
+                connection.close()
+                with lock:
+                    for status, count in local.items():
+                        counts[status] = counts.get(status, 0) + count
+
+        try:
+            threads = [threading.Thread(target=conductor, args=(n,)) for n in range(threads_n)]
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - start
+            accepted = QRValidationLog.objects.filter(booking__user=user, is_valid=True).count()
+            used = Booking.objects.filter(user=user, used=True).count()
+        finally:
+            user.delete()
+
+        scans = sum(counts.values())
+        self.stdout.write(
+            f"{scans} scans by {threads_n} threads in {elapsed:.2f}s: {scans / elapsed:.0f} scans/sec; "
+            f"valid {counts.get('valid', 0)}, already used {counts.get('used', 0)}"
+        )
+        if errors:
+            self.stderr.write(f"{len(errors)} threads failed, first error: {errors[0]!r}")
+        if counts.get('valid', 0) != options['tickets'] or accepted != options['tickets'] or used != options['tickets']:
+            self.stderr.write(self.style.ERROR("Some tickets were accepted more or less than once"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Every ticket accepted exactly once."))
@@ -0,0 +1,49 @@
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from conductor_service import rollups
+from core.models import Booking
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfill or repair the DailyReport rollups by recomputing them from "
+        "the bookings, one block of days per transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', help="First day (YYYY-MM-DD), default the first booking")
+        parser.add_argument('--to', dest='end', help="Last day (YYYY-MM-DD), default today")
+        parser.add_argument('--days', type=int, default=31, help="Days recomputed per transaction")
+
+    def handle(self, *args, **options):
+        end = self.parse(options['end']) if options['end'] else timezone.localdate()
+        if options['start']:
+            start = self.parse(options['start'])
+        else:
+            first = Booking.objects.aggregate(first=Min('booking_time'))['first']
+            start = timezone.localdate(first) if first else end
+        if end < start:
+            raise CommandError("--to is before --from")
+
+        rows, began = 0, time.perf_counter()
+        block_start = start
+        while block_start <= end:
+            block_end = min(block_start + timedelta(days=options['days'] - 1), end)
+            rows += rollups.rebuild(block_start, block_end)
+            block_start = block_end + timedelta(days=1)
+        self.stdout.write(
+            f"Rebuilt {(end - start).days + 1} days ({start} to {end}): "
+            f"{rows} report rows in {time.perf_counter() - began:.1f}s"
+        )
+
+    def parse(self, value):
+        parsed = parse_date(value)
+        if not isinstance(parsed, date):
+            raise CommandError(f"Not a date: {value}")
+        return parsed
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:09
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conductor_service', '0004_activetrip'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cashbooking',
+            name='client_id',
+            field=models.UUIDField(blank=True, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='qrvalidationlog',
+            name='client_id',
+            field=models.UUIDField(blank=True, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='cashbooking',
+            name='issued_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='qrvalidationlog',
+            name='validated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
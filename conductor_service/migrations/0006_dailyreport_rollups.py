@@ -0,0 +1,63 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:13
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conductor_service', '0005_sync_client_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailyreport',
+            name='manual_bookings',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dailyreport',
+            name='online_bookings',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dailyreport',
+            name='online_fare',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='dailyreport',
+            name='route',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='dailyreport',
+            name='total_bookings',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dailyreport',
+            name='total_fare',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AlterField(
+            model_name='dailyreport',
+            name='conductor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='conductor_service.conductorprofile'),
+        ),
+        migrations.AlterField(
+            model_name='dailyreport',
+            name='date',
+            field=models.DateField(default=django.utils.timezone.localdate),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailyreport',
+            unique_together={('conductor', 'date', 'route')},
+        ),
+        migrations.AddIndex(
+            model_name='dailyreport',
+            index=models.Index(fields=['date'], name='conductor_s_date_2e3a55_idx'),
+        ),
+    ]
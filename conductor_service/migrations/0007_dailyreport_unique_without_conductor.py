@@ -0,0 +1,44 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:03
+
+from django.db import migrations, models
+
+COUNTERS = (
+    'total_cash_collected', 'total_passengers', 'total_bookings', 'manual_bookings', 'online_bookings',
+    'total_fare', 'online_fare',
+)
+
+
+def merge_duplicate_reports(apps, schema_editor):
+    """Fold the duplicate no-conductor rows that concurrent first writes could create into one."""
+    DailyReport = apps.get_model('conductor_service', 'DailyReport')
+    rows = DailyReport.objects.filter(conductor__isnull=True)
+    duplicates = rows.values('date', 'route').annotate(n=models.Count('id')).filter(n__gt=1)
+    for group in duplicates:
+        reports = rows.filter(date=group['date'], route=group['route'])
+        totals = reports.aggregate(**{name: models.Sum(name) for name in COUNTERS})
+        keep = reports.order_by('id').first()
+        reports.exclude(id=keep.id).delete()
+        reports.update(**totals)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conductor_service', '0006_dailyreport_rollups'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='dailyreport',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyreport',
+            constraint=models.UniqueConstraint(fields=('conductor', 'date', 'route'), name='dailyreport_conductor_date_route'),
+        ),
+        migrations.RunPython(merge_duplicate_reports, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='dailyreport',
+            constraint=models.UniqueConstraint(condition=models.Q(('conductor__isnull', True)), fields=('date', 'route'), name='dailyreport_date_route_no_conductor'),
+        ),
+    ]
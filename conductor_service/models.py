@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 from core.models import Bus, Schedule, Booking
 
@@ -20,7 +21,9 @@ class CashBooking(models.Model):
     conductor = models.ForeignKey(ConductorProfile, on_delete=models.SET_NULL, null=True)
     booking = models.OneToOneField(Booking, on_delete=models.CASCADE)
     cash_received = models.DecimalField(max_digits=10, decimal_places=2)
-    issued_at = models.DateTimeField(auto_now_add=True)
+    issued_at = models.DateTimeField(default=timezone.now)
+    # Id generated by the conductor's device, so re-uploaded tickets are not issued twice
+    client_id = models.UUIDField(unique=True, null=True, blank=True)
 
     def __str__(self):
         return f"Cash Booking {self.booking.id} by {self.conductor}"
@@ -29,19 +32,43 @@ class CashBooking(models.Model):
 class QRValidationLog(models.Model):
     conductor = models.ForeignKey(ConductorProfile, on_delete=models.SET_NULL, null=True)
     booking = models.ForeignKey(Booking, on_delete=models.CASCADE)
-    validated_at = models.DateTimeField(auto_now_add=True)
+    validated_at = models.DateTimeField(default=timezone.now)
     is_valid = models.BooleanField(default=True)
     location = models.CharField(max_length=255, null=True, blank=True)  # optional GPS info
+    client_id = models.UUIDField(unique=True, null=True, blank=True)
 
     def __str__(self):
         return f"Validation of Booking {self.booking.id} by {self.conductor}"
 
 
 class DailyReport(models.Model):
-    conductor = models.ForeignKey(ConductorProfile, on_delete=models.CASCADE)
-    date = models.DateField(auto_now_add=True)
+    """
+    Booking counters per conductor, route and day, kept up to date as tickets
+    are sold and scanned (see conductor_service.rollups). Online tickets count
+    for the conductor who accepted them; the date is the booking date.
+    """
+    conductor = models.ForeignKey(ConductorProfile, on_delete=models.CASCADE, null=True, blank=True)
+    date = models.DateField(default=timezone.localdate)
+    route = models.CharField(max_length=100, blank=True, default='')
     total_cash_collected = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     total_passengers = models.IntegerField(default=0)
+    total_bookings = models.IntegerField(default=0)
+    manual_bookings = models.IntegerField(default=0)
+    online_bookings = models.IntegerField(default=0)
+    total_fare = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    online_fare = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['conductor', 'date', 'route'], name='dailyreport_conductor_date_route'),
+            # NULLs are distinct in the constraint above, so the rows of scans with
+            # no conductor need their own for rollups._increment's insert race
+            models.UniqueConstraint(
+                fields=['date', 'route'], condition=models.Q(conductor__isnull=True),
+                name='dailyreport_date_route_no_conductor',
+            ),
+        ]
+        indexes = [models.Index(fields=['date'])]
 
     def __str__(self):
         return f"Report: {self.conductor} - {self.date}"
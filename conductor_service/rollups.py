@@ -0,0 +1,112 @@
+"""
+Incrementally maintained DailyReport counters.
+
+Every path that sells a cash ticket or accepts an online ticket calls
+``record`` in the same transaction, so the rollups move with the bookings.
+``rebuild`` recomputes a date range from the raw bookings.
+"""
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .analytics import METRICS, ZERO, counted_bookings, with_conductor
+from .models import DailyReport
+
+# DailyReport column of every booking_analysis figure.
+FIELDS = {
+    'total_bookings': 'total_bookings',
+    'total_seats': 'total_passengers',
+    'total_fare': 'total_fare',
+    'online_count': 'online_bookings',
+    'manual_count': 'manual_bookings',
+    'online_fare': 'online_fare',
+    'manual_fare': 'total_cash_collected',
+}
+
+
+def _fare(value):
+    return Decimal(str(value)) if value is not None else ZERO
+
+
+def record(conductor_id, bookings, online):
+    """
+    Add bookings to the rollups. ``bookings`` are objects or dicts with
+    ``route``, ``seats``, ``fare`` and ``booking_time``; ``online`` tells
+    whether they are scanned online tickets or cash tickets.
+    """
+    deltas = {}
+    for booking in bookings:
+        get = booking.get if isinstance(booking, dict) else lambda name: getattr(booking, name)
+        key = (conductor_id, timezone.localdate(get('booking_time')), get('route') or '')
+        delta = deltas.setdefault(key, dict.fromkeys(FIELDS.values(), 0))
+        fare = _fare(get('fare'))
+        delta['total_bookings'] += 1
+        delta['total_passengers'] += get('seats')
+        delta['total_fare'] += fare
+        if online:
+            delta['online_bookings'] += 1
+            delta['online_fare'] += fare
+        else:
+            delta['manual_bookings'] += 1
+            delta['total_cash_collected'] += fare
+
+    for (conductor, date, route), delta in deltas.items():
+        _increment(conductor, date, route, {name: value for name, value in delta.items() if value})
+
+
+def _increment(conductor_id, date, route, delta):
+    rows = DailyReport.objects.filter(conductor_id=conductor_id, date=date, route=route)
+    changes = {name: F(name) + value for name, value in delta.items()}
+    if rows.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            DailyReport.objects.create(conductor_id=conductor_id, date=date, route=route, **delta)
+    except IntegrityError:
+        # Another transaction created the row first
+        rows.update(**changes)
+
+
+def rebuild(start, end):
+    """Recompute the rollups of ``start``..``end`` (inclusive) from the bookings. Returns rows written."""
+    tz = timezone.get_current_timezone()
+    groups = with_conductor(counted_bookings(start, end), 'conductor_key', 'id').annotate(
+        day=TruncDate('booking_time', tzinfo=tz)
+    ).values('conductor_key', 'day', 'route').annotate(**METRICS).order_by()
+
+    reports = [
+        DailyReport(
+            conductor_id=group['conductor_key'], date=group['day'], route=group['route'] or '',
+            **{column: group[metric] for metric, column in FIELDS.items()},
+        )
+        for group in groups
+    ]
+    with transaction.atomic():
+        DailyReport.objects.filter(date__range=(start, end)).delete()
+        DailyReport.objects.bulk_create(reports, batch_size=1000)
+    return len(reports)
+
+
+def summary(start, end, by=None):
+    """
+    booking_analysis figures read from the rollups: O(days) rows instead of
+    O(bookings). Returns (totals, rows): rows is None without ``by``, else
+    one dict of figures per route or conductor.
+    """
+    reports = DailyReport.objects.filter(date__range=(start, end))
+    sums = {metric: Sum(column) for metric, column in FIELDS.items()}
+    if by is None:
+        totals = reports.aggregate(**sums)
+        return {metric: value or (ZERO if metric.endswith('_fare') else 0) for metric, value in totals.items()}, None
+
+    key = 'route' if by == 'route' else 'conductor__employee_id'
+    rows = [
+        {by: row.pop(key), **row}
+        for row in reports.values(key).annotate(**sums).order_by(key)
+    ]
+    totals = {metric: sum((row[metric] for row in rows), ZERO if metric.endswith('_fare') else 0) for metric in FIELDS}
+    return totals, rows
+
@@ -0,0 +1,215 @@
+"""
+Batched upload of work a conductor's device did while offline.
+
+Every item carries a UUID generated on the device, so uploading the same
+batch twice (after a timeout, say) applies it once. Each item gets a status:
+``accepted``, ``duplicate`` (already uploaded), ``conflict`` (ticket was
+already used) or ``invalid``.
+"""
+import uuid
+from datetime import timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.history import record_bookings
+from core.models import Booking, Route, TripInstance
+from core.service import trip_for
+from core.tickets import TicketError, unsigned_tickets_accepted, verify_ticket_token
+
+from . import rollups
+from .models import CashBooking, QRValidationLog
+
+# Largest number of items accepted in one upload.
+MAX_BATCH = 500
+
+
+class SyncError(Exception):
+    """The upload as a whole is unusable."""
+
+
+def _client_id(item):
+    try:
+        return uuid.UUID(str(item['client_id']))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _when(item, key, now):
+    value = item.get(key)
+    parsed = parse_datetime(value) if isinstance(value, str) else None
+    if parsed is None:
+        return now
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    # A device clock ahead of the server cannot date work in the future
+    return min(parsed, now)
+
+
+def apply_sync(profile, payload):
+    """Apply an upload of ``validations`` and ``tickets``; returns per-item results."""
+    if not isinstance(payload, dict):
+        raise SyncError("Expected a JSON object")
+    validations = payload.get('validations') or []
+    tickets = payload.get('tickets') or []
+    if not isinstance(validations, list) or not isinstance(tickets, list):
+        raise SyncError("validations and tickets must be lists")
+    if len(validations) + len(tickets) > MAX_BATCH:
+        raise SyncError(f"At most {MAX_BATCH} items per upload")
+
+    now = timezone.now()
+    with transaction.atomic():
+        return {
+            'validations': sync_validations(profile, validations, now),
+            'tickets': sync_tickets(profile, tickets, now),
+        }
+
+
+def sync_validations(profile, items, now):
+    results = [None] * len(items)
+    pending = []  # (index, client_id, booking_id, scanned_at, location)
+    for index, item in enumerate(items):
+        client_id = _client_id(item) if isinstance(item, dict) else None
+        if client_id is None:
+            results[index] = {'status': 'invalid', 'message': "Missing client_id"}
+            continue
+        scanned_at = _when(item, 'scanned_at', now)
+        try:
+            if item.get('token'):
+                booking_id = verify_ticket_token(item['token'], now=scanned_at.timestamp())['booking_id']
+            elif unsigned_tickets_accepted(now):
+                booking_id = int(item['booking_id'])
+            else:
+                raise TicketError("Unsigned ticket")
+        except (TicketError, KeyError, TypeError, ValueError) as exc:
+            message = str(exc) if isinstance(exc, TicketError) else "Missing ticket"
+            results[index] = {'client_id': str(client_id), 'status': 'invalid', 'message': message}
+            continue
+        pending.append((index, client_id, booking_id, scanned_at, str(item.get('location') or '')[:255] or None))
+
+    seen = set(QRValidationLog.objects.filter(
+        client_id__in=[p[1] for p in pending]
+    ).values_list('client_id', flat=True))
+    fresh = []
+    for entry in pending:
+        if entry[1] in seen:
+            results[entry[0]] = {'client_id': str(entry[1]), 'status': 'duplicate'}
+        else:
+            seen.add(entry[1])
+            fresh.append(entry)
+
+    # Lock the unused bookings of this batch; the earliest scan of each one wins
+    booking_ids = {entry[2] for entry in fresh}
+    locked = {
+        booking['id']: booking
+        for booking in Booking.objects.select_for_update().filter(id__in=booking_ids).values(
+            'id', 'used', 'created_online', 'route', 'seats', 'fare', 'booking_time'
+        )
+    }
+    winners = set()
+    logs = []
+    for index, client_id, booking_id, scanned_at, location in sorted(fresh, key=lambda e: e[3]):
+        if booking_id not in locked:
+            results[index] = {'client_id': str(client_id), 'status': 'invalid', 'message': "Ticket not found"}
+            continue
+        valid = not locked[booking_id]['used'] and booking_id not in winners
+        if valid:
+            winners.add(booking_id)
+        results[index] = {
+            'client_id': str(client_id),
+            'booking_id': booking_id,
+            'status': 'accepted' if valid else 'conflict',
+        }
+        if not valid:
+            results[index]['message'] = "Ticket already used"
+        logs.append(QRValidationLog(
+            client_id=client_id, conductor=profile, booking_id=booking_id,
+            validated_at=scanned_at, is_valid=valid, location=location,
+        ))
+
+    Booking.objects.filter(id__in=winners).update(used=True, verified_by_conductor=True, counted_at=now)
+    QRValidationLog.objects.bulk_create(logs)
+    rollups.record(profile.id, [locked[i] for i in winners if locked[i]['created_online']], online=True)
+    return results
+
+
+def sync_tickets(profile, items, now):
+    results = [None] * len(items)
+    pending = []  # (index, client_id, item, seats)
+    for index, item in enumerate(items):
+        client_id = _client_id(item) if isinstance(item, dict) else None
+        try:
+            seats = int(item.get('seats', 1)) if client_id else 0
+        except (TypeError, ValueError):
+            seats = 0
+        if client_id is None or seats <= 0 or not item.get('route_no') or not item.get('from_stop') or not item.get('to_stop'):
+            results[index] = {
+                'client_id': str(client_id) if client_id else None,
+                'status': 'invalid',
+                'message': "client_id, route_no, from_stop, to_stop and positive seats are required",
+            }
+            continue
+        pending.append((index, client_id, item, seats))
+
+    seen = set(CashBooking.objects.filter(
+        client_id__in=[p[1] for p in pending]
+    ).values_list('client_id', flat=True))
+    distances = dict(Route.objects.filter(
+        route_no__in={p[2]['route_no'] for p in pending}
+    ).values_list('route_no', 'distance'))
+    schedule = profile.assigned_schedule
+
+    fresh = []
+    for index, client_id, item, seats in pending:
+        if client_id in seen:
+            results[index] = {'client_id': str(client_id), 'status': 'duplicate'}
+        elif item['route_no'] not in distances:
+            results[index] = {'client_id': str(client_id), 'status': 'invalid', 'message': "Unknown route"}
+        else:
+            seen.add(client_id)
+            fresh.append((index, client_id, item, seats))
+    if not fresh:
+        return results
+
+    # The tickets count against the seats of today's run of the conductor's schedule
+    trip = trip_for(schedule.id, timezone.localdate(now)) if schedule else None
+    bookings = []
+    for _, _, item, seats in fresh:
+        bookings.append(Booking(
+            user=profile.user,
+            route=item['route_no'],
+            source=item['from_stop'],
+            destination=item['to_stop'],
+            schedule=schedule,
+            trip=trip,
+            seats=seats,
+            fare=distances[item['route_no']] * 1.0 * seats,
+            created_by_conductor=True,
+        ))
+    bookings = Booking.objects.bulk_create(bookings)
+
+    cash = []
+    for (index, client_id, item, seats), booking in zip(fresh, bookings):
+        try:
+            received = Decimal(str(item.get('cash_received', booking.fare)))
+        except InvalidOperation:
+            received = Decimal(str(booking.fare))
+        cash.append(CashBooking(
+            client_id=client_id, conductor=profile, booking=booking,
+            cash_received=received, issued_at=_when(item, 'issued_at', now),
+        ))
+        results[index] = {'client_id': str(client_id), 'status': 'accepted', 'booking_id': booking.id}
+    CashBooking.objects.bulk_create(cash)
+    rollups.record(profile.id, bookings, online=False)
+    record_bookings(profile.user_id, bookings)
+
+    # The cash is already collected, so the tickets stand even if the bus is overfull
+    if trip is not None:
+        TripInstance.objects.filter(id=trip.id).update(
+            available_seats=Greatest(F('available_seats') - sum(f[3] for f in fresh), 0)
+        )
+    return results
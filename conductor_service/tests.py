@@ -1,3 +1,343 @@
-from django.test import TestCase
+import json
+import threading
+import uuid
+from io import StringIO
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import Booking, Bus, Route, Schedule
+from core.service import trip_for
+from core.tickets import sign_ticket
+
+from . import rollups
+from .models import CashBooking, ConductorProfile, DailyReport, QRValidationLog
+from .validation import validate_ticket
+
+
+class OfflineSyncTests(TestCase):
+    def setUp(self):
+        bus = Bus.objects.create(bus_id='B1', category='AC', capacity=40)
+        route = Route.objects.create(route_no='9', source='Vashi', destination='Belapur', distance=12)
+        self.schedule = Schedule.objects.create(bus=bus, route=route, departure_time='08:00', available_seats=40)
+        self.user = User.objects.create_user('cond', password='pw')
+        self.profile = ConductorProfile.objects.create(
+            user=self.user, employee_id='C1', assigned_bus=bus, assigned_schedule=self.schedule
+        )
+        rider = User.objects.create_user('rider', password='pw')
+        self.bookings = [
+            Booking.objects.create(user=rider, route='9', source='Vashi', destination='Belapur', seats=1, fare=12)
+            for _ in range(3)
+        ]
+        self.client.force_login(self.user)
+        self.url = reverse('sync_offline')
+
+    def post(self, payload):
+        return self.client.post(self.url, json.dumps(payload), content_type='application/json')
+
+    def scan(self, booking, **extra):
+        return {'client_id': str(uuid.uuid4()), 'token': sign_ticket(booking), **extra}
+
+    def test_validations_are_idempotent_and_detect_double_use(self):
+        first, second, third = self.bookings
+        batch = [
+            self.scan(first),
+            self.scan(second),
+            self.scan(second),
+            {'client_id': str(uuid.uuid4()), 'token': 'forged.token.x'},
+            {'client_id': str(uuid.uuid4()), 'booking_id': third.id},
+        ]
+        results = self.post({'validations': batch}).json()['validations']
+        self.assertEqual([r['status'] for r in results], ['accepted', 'accepted', 'conflict', 'invalid', 'invalid'])
+        self.assertEqual(results[4]['message'], 'Unsigned ticket')
+        self.assertEqual(QRValidationLog.objects.filter(is_valid=True).count(), 2)
+        self.assertEqual(QRValidationLog.objects.filter(is_valid=False).count(), 1)
+        self.assertTrue(Booking.objects.get(id=second.id).used)
+        self.assertFalse(Booking.objects.get(id=third.id).used)
+
+        # The same upload again changes nothing
+        results = self.post({'validations': batch}).json()['validations']
+        self.assertEqual([r['status'] for r in results], ['duplicate', 'duplicate', 'duplicate', 'invalid', 'invalid'])
+        self.assertEqual(QRValidationLog.objects.count(), 3)
+
+    def test_cash_tickets(self):
+        tickets = [
+            {'client_id': str(uuid.uuid4()), 'route_no': '9', 'from_stop': 'Vashi', 'to_stop': 'Belapur', 'seats': 2},
+            {'client_id': str(uuid.uuid4()), 'route_no': '9', 'from_stop': 'Vashi', 'to_stop': 'Belapur',
+             'cash_received': '10.00'},
+            {'client_id': str(uuid.uuid4()), 'route_no': 'missing', 'from_stop': 'A', 'to_stop': 'B'},
+        ]
+        results = self.post({'tickets': tickets}).json()['tickets']
+        self.assertEqual([r['status'] for r in results], ['accepted', 'accepted', 'invalid'])
+        booking = Booking.objects.get(id=results[0]['booking_id'])
+        self.assertEqual((booking.fare, booking.schedule_id, booking.created_by_conductor), (24, self.schedule.id, True))
+        self.assertEqual(CashBooking.objects.get(booking_id=results[1]['booking_id']).cash_received, 10)
+        # Seats come off today's run of the conductor's schedule
+        self.assertEqual(booking.trip.available_seats, 37)
+        self.assertEqual(booking.trip.service_date, timezone.localdate())
+
+        results = self.post({'tickets': tickets}).json()['tickets']
+        self.assertEqual([r['status'] for r in results], ['duplicate', 'duplicate', 'invalid'])
+        self.assertEqual(CashBooking.objects.count(), 2)
+
+    def test_query_count_does_not_grow_with_batch(self):
+        rider = User.objects.get(username='rider')
+        bookings = Booking.objects.bulk_create([
+            Booking(user=rider, route='9', source='Vashi', destination='Belapur', seats=1, fare=12) for _ in range(50)
+        ])
+        tickets = [
+            {'client_id': str(uuid.uuid4()), 'route_no': '9', 'from_stop': 'Vashi', 'to_stop': 'Belapur'}
+            for _ in range(50)
+        ]
+        payload = {'validations': [self.scan(b) for b in Booking.objects.filter(id__in=[b.id for b in bookings])],
+                   'tickets': tickets}
+        trip_for(self.schedule.id)
+        # Session/user/profile lookups, a fixed number of statements per kind of item,
+        # today's trip, then the rollup upsert (update, savepoint, insert, release) and
+        # the first RiderStats of the conductor's account (update, then a one-off rebuild)
+        with self.assertNumQueries(30):
+            response = self.post(payload)
+        self.assertEqual(response.status_code, 200)
+
+    def test_requires_conductor(self):
+        self.client.logout()
+        self.assertEqual(self.post({}).status_code, 403)
+        self.client.force_login(self.user)
+        self.assertEqual(self.post({'tickets': 'nope'}).status_code, 400)
+
+
+class VerifyTicketTests(TestCase):
+    def setUp(self):
+        rider = User.objects.create_user('rider', password='pw')
+        self.booking = Booking.objects.create(user=rider, route='9', source='Vashi', destination='Belapur',
+                                              seats=2, fare='24.50')
+        self.conductor = User.objects.create_user('cond', password='pw')
+        self.profile = ConductorProfile.objects.create(user=self.conductor, employee_id='C1')
+        self.client.force_login(self.conductor)
+        self.url = reverse('verify_ticket')
+
+    def test_valid_then_used_logs_both_scans(self):
+        data = self.client.get(self.url, {'data': sign_ticket(self.booking)}).json()
+        self.assertTrue(data['valid'])
+        self.assertEqual((data['booking_id'], data['seats'], data['fare']), (self.booking.id, 2, '24.50'))
+        data = self.client.get(self.url, {'data': sign_ticket(self.booking)}).json()
+        self.assertEqual(data, {'valid': False, 'message': 'Ticket already used'})
+
+        self.booking.refresh_from_db()
+        self.assertTrue(self.booking.used and self.booking.verified_by_conductor)
+        logs = QRValidationLog.objects.order_by('id')
+        self.assertEqual([(log.conductor_id, log.is_valid) for log in logs], [(self.profile.id, True), (self.profile.id, False)])
+
+    def test_unsigned_ticket_is_refused(self):
+        data = self.client.get(self.url, {'data': self.booking.id}).json()
+        self.assertEqual(data, {'valid': False, 'message': 'Unsigned ticket'})
+        self.assertFalse(QRValidationLog.objects.exists())
+
+    def test_unsigned_tickets_until_the_cutoff(self):
+        today = timezone.localdate()
+        with self.settings(UNSIGNED_TICKETS_UNTIL=today - timedelta(days=1)):
+            self.assertEqual(self.client.get(self.url, {'data': self.booking.id}).json()['message'], 'Unsigned ticket')
+        with self.settings(UNSIGNED_TICKETS_UNTIL=today):
+            self.assertTrue(self.client.get(self.url, {'data': self.booking.id}).json()['valid'])
+            for data in ('0', 'abc'):
+                self.assertEqual(self.client.get(self.url, {'data': data}).json()['message'], 'Ticket not found')
+
+
+class VerifyTicketConcurrencyTests(TransactionTestCase):
+    def test_one_scan_wins(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("needs a database that threads can share")
+        rider = User.objects.create_user('rider', password='pw')
+        booking = Booking.objects.create(user=rider, route='9', source='A', destination='B', seats=1, fare=10)
+        results = []
+        barrier = threading.Barrier(8)
+
+        def scanner():
+            try:
+                barrier.wait()
+                results.append(validate_ticket(booking.id)[0])
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=scanner) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sorted(results), ['used'] * 7 + ['valid'])
+        self.assertEqual(QRValidationLog.objects.filter(booking=booking, is_valid=True).count(), 1)
+
+
+class BookingAnalysisTests(TestCase):
+    def setUp(self):
+        self.conductor = User.objects.create_user('cond', password='pw')
+        self.profile = ConductorProfile.objects.create(user=self.conductor, employee_id='C1')
+        rider = User.objects.create_user('rider', password='pw')
+        Booking.objects.create(user=self.conductor, route='9', seats=2, fare=20, created_by_conductor=True)
+        Booking.objects.create(user=self.conductor, route='12', seats=1, fare=15, created_by_conductor=True)
+        scanned = Booking.objects.create(user=rider, route='9', seats=3, fare=30, created_online=True)
+        Booking.objects.create(user=rider, route='9', seats=5, fare=50, created_online=True)  # never scanned
+        validate_ticket(scanned.id, conductor=self.profile)
+        validate_ticket(scanned.id, conductor=self.profile)
+        # Bookings created directly skip the rollups; the backfill picks them up
+        call_command('rebuild_daily_reports', stdout=StringIO())
+        self.url = reverse('booking_analysis')
+
+    def test_totals_in_one_query(self):
+        with self.assertNumQueries(1):
+            data = self.client.get(self.url).json()
+        self.assertEqual(
+            (data['total_bookings'], data['total_seats'], data['online_count'], data['manual_count']), (3, 6, 1, 2)
+        )
+        self.assertEqual(Decimal(data['total_fare']), 65)
+        self.assertEqual(Decimal(data['manual_fare']), 35)
+
+    def test_breakdowns(self):
+        with self.assertNumQueries(1):
+            data = self.client.get(self.url, {'by': 'route'}).json()
+        self.assertEqual([(r['route'], r['total_bookings']) for r in data['breakdown']], [('12', 1), ('9', 2)])
+        self.assertEqual(data['total_seats'], 6)
+
+        data = self.client.get(self.url, {'by': 'conductor'}).json()
+        self.assertEqual([(r['conductor'], r['total_bookings'], r['online_count']) for r in data['breakdown']],
+                         [('C1', 3, 1)])
+
+    def test_date_range(self):
+        today = timezone.now().date()
+        data = self.client.get(self.url, {'from': str(today - timedelta(days=7)), 'to': str(today - timedelta(days=1))}).json()
+        self.assertEqual((data['total_bookings'], Decimal(data['total_fare'])), (0, 0))
+        self.assertEqual(self.client.get(self.url, {'from': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'from': '2026-02-30'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'by': 'bus'}).status_code, 400)
+
+
+class DailyReportRollupTests(TestCase):
+    def setUp(self):
+        bus = Bus.objects.create(bus_id='B1', category='AC', capacity=40)
+        route = Route.objects.create(route_no='9', source='Vashi', destination='Belapur', distance=12)
+        Route.objects.create(route_no='12', source='Vashi', destination='Nerul', distance=8)
+        schedule = Schedule.objects.create(bus=bus, route=route, departure_time='08:00', available_seats=40)
+        self.conductor = User.objects.create_user('cond', password='pw')
+        self.profile = ConductorProfile.objects.create(
+            user=self.conductor, employee_id='C1', assigned_bus=bus, assigned_schedule=schedule
+        )
+        self.client.force_login(self.conductor)
+
+    def snapshot(self):
+        return sorted(DailyReport.objects.values_list(
+            'conductor_id', 'date', 'route', 'total_bookings', 'total_passengers', 'total_fare',
+            'manual_bookings', 'online_bookings', 'total_cash_collected', 'online_fare',
+        ))
+
+    def test_one_row_for_scans_without_a_conductor(self):
+        today = timezone.localdate()
+        DailyReport.objects.create(conductor=None, date=today, route='9', total_bookings=1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            DailyReport.objects.create(conductor=None, date=today, route='9', total_bookings=1)
+        ticket = {'route': '9', 'seats': 2, 'fare': 10, 'booking_time': timezone.now()}
+        rollups.record(None, [ticket, ticket], online=True)
+        self.assertEqual(
+            list(DailyReport.objects.values_list('total_bookings', 'total_passengers', 'online_bookings')), [(3, 4, 2)],
+        )
+
+    def test_incremental_matches_rebuild(self):
+        self.client.post(reverse('manual_booking'), {'route_no': '9', 'from_stop': 'Vashi', 'to_stop': 'Belapur', 'seats': 2})
+        self.client.post(reverse('sync_offline'), json.dumps({'tickets': [
+            {'client_id': str(uuid.uuid4()), 'route_no': '12', 'from_stop': 'Vashi', 'to_stop': 'Nerul'},
+            {'client_id': str(uuid.uuid4()), 'route_no': '9', 'from_stop': 'Vashi', 'to_stop': 'Belapur'},
+        ]}), content_type='application/json')
+        rider = User.objects.create_user('rider', password='pw')
+        online = [Booking.objects.create(user=rider, route='9', seats=1, fare=12, created_online=True) for _ in range(2)]
+        validate_ticket(online[0].id, conductor=self.profile)
+        self.client.post(reverse('sync_offline'), json.dumps({'validations': [
+            {'client_id': str(uuid.uuid4()), 'token': sign_ticket(online[1])},
+        ]}), content_type='application/json')
+
+        incremental = self.snapshot()
+        self.assertEqual(len(incremental), 2)
+        self.assertEqual(sum(row[3] for row in incremental), 5)
+        call_command('rebuild_daily_reports', stdout=StringIO())
+        self.assertEqual(self.snapshot(), incremental)
+
+        with self.assertNumQueries(1):
+            data = self.client.get(reverse('booking_analysis'), {'by': 'conductor'}).json()
+        self.assertEqual((data['total_bookings'], data['manual_count'], data['online_count']), (5, 3, 2))
+        self.assertEqual(data['breakdown'][0]['conductor'], 'C1')
+
+
+class TodaysBookingsFeedTests(TestCase):
+    def setUp(self):
+        self.conductor = User.objects.create_user('cond', password='pw')
+        self.profile = ConductorProfile.objects.create(user=self.conductor, employee_id='C1')
+        other = ConductorProfile.objects.create(user=User.objects.create_user('other', password='pw'), employee_id='C2')
+        self.mine = [
+            Booking.objects.create(user=self.conductor, route='9' if i % 2 else '12', seats=1, fare=10,
+                                   created_by_conductor=True)
+            for i in range(7)
+        ]
+        Booking.objects.create(user=other.user, route='9', seats=1, fare=10, created_by_conductor=True)
+        self.client.force_login(self.conductor)
+        self.url = reverse('todays_bookings')
+
+    def test_pages_follow_the_cursor(self):
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 3, **({'after': cursor} if cursor else {})}
+            data = self.client.get(self.url, params).json()
+            seen += [b['id'] for b in data['bookings']]
+            cursor = data['next']
+            if not data['has_more']:
+                break
+        self.assertEqual(seen, [b.id for b in self.mine])
+
+        # Polling with the last cursor returns only bookings made since
+        self.assertEqual(self.client.get(self.url, {'after': cursor}).json()['bookings'], [])
+        new = Booking.objects.create(user=self.conductor, route='9', seats=2, fare=20, created_by_conductor=True)
+        data = self.client.get(self.url, {'after': cursor}).json()
+        self.assertEqual([b['id'] for b in data['bookings']], [new.id])
+
+    def test_poll_picks_up_scanned_online_tickets(self):
+        online = Booking.objects.create(user=self.conductor, route='9', seats=1, fare=10, created_online=True)
+        Booking.objects.filter(id=online.id).update(
+            booking_time=timezone.now() - timedelta(hours=3), counted_at=timezone.now() - timedelta(hours=3),
+        )
+        cursor = self.client.get(self.url, {'limit': 100}).json()['next']
+        # Scanned after the poll, three hours after it was booked
+        self.assertEqual(validate_ticket(online.id, conductor=self.profile)[0], 'valid')
+        data = self.client.get(self.url, {'after': cursor}).json()
+        self.assertEqual([(b['id'], b['type']) for b in data['bookings']], [(online.id, 'Online')])
+
+    def test_filters(self):
+        data = self.client.get(self.url, {'route': '9', 'limit': 100}).json()
+        self.assertEqual(len(data['bookings']), 3)
+        # Only ever the caller's own bookings
+        data = self.client.get(self.url, {'conductor': 'all', 'limit': 100}).json()
+        self.assertEqual(len(data['bookings']), 7)
+        for params in ({'after': 'garbage'}, {'trip': 'abc'}, {'date': '2026-02-30'}, {'date': 'soon'}):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'trip': 999}).status_code, 404)
+
+    def test_limit_is_clamped(self):
+        for limit in (-5, 0):
+            data = self.client.get(self.url, {'limit': limit}).json()
+            self.assertEqual((len(data['bookings']), data['has_more']), (1, True))
+        self.assertEqual(self.client.get(self.url, {'limit': 'many'}).status_code, 400)
+
+    def test_requires_a_conductor(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.client.force_login(User.objects.create_user('rider'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_csv_export_streams(self):
+        response = self.client.get(self.url, {'format': 'csv'})
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,route,source,destination,seats,fare,type,time')
+        self.assertEqual(len(lines), 8)
@@ -7,6 +7,8 @@ urlpatterns = [
     path('ticket-success/<int:booking_id>/', views.conductor_ticket_success, name='conductor_ticket_success'),
     path('scan-qr/', views.scan_qr, name='scan_qr'),  # This is the scanner UI page
     path('verify-ticket/', views.verify_ticket, name='verify_ticket'),
+    path('ticket-keys/', views.ticket_keys, name='ticket_keys'),
+    path('sync/', views.sync_offline, name='sync_offline'),
     path('todays-bookings/', views.todays_bookings, name='todays_bookings'),
 path('booking-analysis/', views.booking_analysis, name='booking_analysis'),
     path('signup/', views.conductor_signup, name='conductor_signup'),
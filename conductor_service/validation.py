@@ -0,0 +1,68 @@
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.models import Booking
+
+from . import rollups
+from .models import QRValidationLog
+
+# Columns returned to the scanner for a valid ticket.
+TICKET_FIELDS = ('id', 'route', 'source', 'destination', 'seats', 'fare', 'booking_time', 'created_online')
+
+
+def _claim(booking_id):
+    """
+    Mark an unused booking as used and return its ticket fields, or None if
+    it does not exist or was already used. One conditional UPDATE, so two
+    conductors scanning the same ticket at once cannot both succeed.
+    """
+    now = timezone.now()
+    if connection.features.can_return_columns_from_insert:
+        # Backends that support INSERT ... RETURNING (PostgreSQL, SQLite 3.35+) support it on UPDATE too
+        def column(name):
+            return connection.ops.quote_name(Booking._meta.get_field(name).column)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {connection.ops.quote_name(Booking._meta.db_table)} "
+                f"SET {column('used')} = %s, {column('verified_by_conductor')} = %s, {column('counted_at')} = %s "
+                f"WHERE {column('id')} = %s AND {column('used')} = %s "
+                f"RETURNING {', '.join(column(f) for f in TICKET_FIELDS)}",
+                [True, True, connection.ops.adapt_datetimefield_value(now), booking_id, False],
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        # Raw rows skip the backend's value conversion (SQLite returns text dates, floats for decimals)
+        ticket = {}
+        for name, value in zip(TICKET_FIELDS, row):
+            col = Booking._meta.get_field(name).get_col(Booking._meta.db_table)
+            for converter in connection.ops.get_db_converters(col) + col.get_db_converters(connection):
+                value = converter(value, col, connection)
+            ticket[name] = value
+        return ticket
+
+    if not Booking.objects.filter(id=booking_id, used=False).update(used=True, verified_by_conductor=True, counted_at=now):
+        return None
+    return Booking.objects.filter(id=booking_id).values(*TICKET_FIELDS).first()
+
+
+def validate_ticket(booking_id, conductor=None, location=None):
+    """
+    Use a ticket and log the scan in one transaction. Returns
+    ``(status, ticket)`` where status is ``valid``, ``used`` or ``missing``
+    and ticket holds the booking's fields when valid.
+    """
+    with transaction.atomic():
+        ticket = _claim(booking_id)
+        if ticket is None:
+            if not Booking.objects.filter(id=booking_id).exists():
+                return 'missing', None
+            QRValidationLog.objects.create(
+                booking_id=booking_id, conductor=conductor, is_valid=False, location=location
+            )
+            return 'used', None
+        QRValidationLog.objects.create(booking_id=booking_id, conductor=conductor, location=location)
+        if ticket['created_online']:
+            rollups.record(conductor.id if conductor else None, [ticket], online=True)
+        return 'valid', ticket
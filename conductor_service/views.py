@@ -2,10 +2,11 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Sum, Q
+from django.db import IntegrityError, transaction
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
@@ -13,9 +14,23 @@ from rest_framework.response import Response
 from core.models import (
     Bus, Schedule, Booking, Route, BusStop, RouteStop, Location
 )
+from core.inventory import SoldOut, reserve_seats
+from core.service import trip_for
+from core.pagination import CursorError, keyset_filter, keyset_page
+from core.tickets import (
+    TICKET_VALID_HOURS, TicketError, active_key_ids, ticket_key, unsigned_tickets_accepted, verify_ticket_token,
+)
 from .models import ConductorProfile, ActiveTrip, BusLocation
 from .forms import ConductorSignupForm, ConductorLoginForm
-
+from .sync import SyncError, apply_sync
+from .validation import validate_ticket
+from .analytics import BREAKDOWNS
+from .feeds import booking_feed, feed_row
+from . import rollups
+
+import base64
+import csv
+import io
 import json
 
 
@@ -205,20 +220,34 @@ def manual_booking(request):
         user = request.user if request.user.is_authenticated else None
         selected_route = Route.objects.filter(route_no=route_no).first()
 
+        # Cash tickets count against the seats of the conductor's current trip
+        profile = getattr(user, 'conductor_profile', None) if user else None
+        schedule = profile.assigned_schedule if profile else None
+        trip = trip_for(schedule.id) if schedule else None
+
         if from_stop and to_stop and selected_route:
             fare = selected_route.distance * 1.0 * seats
 
-            booking = Booking.objects.create(
-                user=user,
-                route=route_no,
-                source=from_stop,
-                destination=to_stop,
-                schedule=None,
-                seats=seats,
-                fare=fare,
-                created_by_conductor=True
-            )
-            return redirect('conductor_ticket_success', booking_id=booking.id)
+            try:
+                with transaction.atomic():
+                    if trip:
+                        reserve_seats(trip.id, seats)
+                    booking = Booking.objects.create(
+                        user=user,
+                        route=route_no,
+                        source=from_stop,
+                        destination=to_stop,
+                        schedule=schedule,
+                        trip=trip,
+                        seats=seats,
+                        fare=fare,
+                        created_by_conductor=True
+                    )
+                    rollups.record(profile.id if profile else None, [booking], online=False)
+            except SoldOut as e:
+                messages.error(request, str(e))
+            else:
+                return redirect('conductor_ticket_success', booking_id=booking.id)
 
     return render(request, 'home_dashboard.html', {
         'routes': routes,
@@ -235,80 +264,182 @@ def conductor_ticket_success(request, booking_id):
 
 @csrf_exempt
 def verify_ticket(request):
-    """Scan QR ticket and mark as used."""
-    qr_data = request.GET.get("data")
+    """
+    Scan QR ticket and mark as used. Accepts a signed ticket token, which is
+    checked without the database; a bare booking id from older tickets only
+    until UNSIGNED_TICKETS_UNTIL.
+    """
+    qr_data = request.GET.get("data", "")
+    if '.' in qr_data:
+        try:
+            ticket = verify_ticket_token(qr_data)
+        except TicketError as exc:
+            return JsonResponse({"valid": False, "message": str(exc)})
+        qr_data = ticket['booking_id']
+    elif not unsigned_tickets_accepted():
+        return JsonResponse({"valid": False, "message": "Unsigned ticket"})
     try:
-        booking = Booking.objects.get(id=qr_data)
-        if booking.used:
-            return JsonResponse({"valid": False, "message": "Ticket already used"})
-
-        booking.used = True
-        booking.verified_by_conductor = True
-        booking.save()
-
-        return JsonResponse({
-            "valid": True,
-            "booking_id": booking.id,
-            "route": booking.route,
-            "source": booking.source,
-            "destination": booking.destination,
-            "seats": booking.seats,
-            "fare": str(booking.fare),
-            "message": "Ticket valid and now marked as used"
-        })
-    except Booking.DoesNotExist:
+        booking_id = int(qr_data)
+    except ValueError:
+        return JsonResponse({"valid": False, "message": "Ticket not found"})
+
+    conductor = getattr(request.user, 'conductor_profile', None) if request.user.is_authenticated else None
+    status, ticket = validate_ticket(booking_id, conductor=conductor, location=request.GET.get("location"))
+    if status == 'missing':
         return JsonResponse({"valid": False, "message": "Ticket not found"})
+    if status == 'used':
+        return JsonResponse({"valid": False, "message": "Ticket already used"})
+
+    return JsonResponse({
+        "valid": True,
+        "booking_id": ticket['id'],
+        "route": ticket['route'],
+        "source": ticket['source'],
+        "destination": ticket['destination'],
+        "seats": ticket['seats'],
+        "fare": str(ticket['fare']),
+        "message": "Ticket valid and now marked as used"
+    })
+
+
+def ticket_keys(request):
+    """Ticket signing keys for offline validation on the conductor's device."""
+    if not hasattr(request.user, 'conductor_profile'):
+        return JsonResponse({"error": "Conductor login required"}, status=403)
+    keys = {str(key_id): base64.b64encode(ticket_key(key_id)).decode() for key_id in active_key_ids()}
+    response = JsonResponse({"keys": keys, "valid_hours": TICKET_VALID_HOURS})
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+def sync_offline(request):
+    """
+    Apply a batch of validations and cash tickets queued on the conductor's
+    device while offline. Safe to retry: items are keyed by client ids.
+    """
+    if request.method != 'POST':
+        return JsonResponse({"error": "POST required"}, status=405)
+    profile = getattr(request.user, 'conductor_profile', None) if request.user.is_authenticated else None
+    if profile is None:
+        return JsonResponse({"error": "Conductor login required"}, status=403)
+    try:
+        results = apply_sync(profile, json.loads(request.body))
+    except (ValueError, SyncError) as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    except IntegrityError:
+        # The same items were uploaded concurrently; a retry reports them as duplicates
+        return JsonResponse({"error": "Concurrent upload, retry"}, status=409)
+    return JsonResponse(results)
+
 
 def scan_qr(request):
     return render(request, 'home_dashboard.html')
 # -------------------- DAILY ANALYTICS --------------------
 
-def todays_bookings(request):
-    """Return today’s bookings for dashboard."""
-    today = timezone.now().date()
-    bookings = Booking.objects.filter(booking_time__date=today)
-
-    filtered = bookings.filter(Q(created_by_conductor=True) | Q(created_online=True, verified_by_conductor=True))
+# Rows per page of todays_bookings, and the most a client may ask for.
+FEED_PAGE_SIZE = 50
+FEED_MAX_PAGE_SIZE = 500
+EXPORT_CHUNK_SIZE = 2000
 
-    data = [{
-        'id': b.id,
-        'route': str(b.route),
-        'source': b.source,
-        'destination': b.destination,
-        'seats': b.seats,
-        'fare': b.fare,
-        'type': 'Manual' if b.created_by_conductor else 'Online',
-        'time': b.booking_time.strftime("%H:%M:%S"),
-    } for b in filtered]
+def todays_bookings(request):
+    """
+    Bookings the logged-in conductor counted today (or ?date=), in pages of
+    ?limit= rows, oldest first. Pass the returned ``next`` cursor as ?after=
+    for the following page, or later to fetch only bookings issued or
+    scanned since. ?route= and ?trip=<ActiveTrip id> narrow further.
+    ?format=csv streams every row.
+    """
+    profile = getattr(request.user, 'conductor_profile', None) if request.user.is_authenticated else None
+    if profile is None:
+        return JsonResponse({"error": "Conductor login required"}, status=403)
+    try:
+        # parse_date returns None for a malformed date and raises for an impossible one
+        day = parse_date(request.GET['date']) if request.GET.get('date') else timezone.now().date()
+    except ValueError:
+        day = None
+    if day is None:
+        return JsonResponse({'error': "date must be YYYY-MM-DD"}, status=400)
+    try:
+        limit = max(1, min(int(request.GET.get('limit', FEED_PAGE_SIZE)), FEED_MAX_PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({'error': "limit must be an integer"}, status=400)
+
+    schedule_id = None
+    if request.GET.get('trip'):
+        if not request.GET['trip'].isdigit():
+            return JsonResponse({'error': "trip must be a trip id"}, status=400)
+        trip = ActiveTrip.objects.filter(id=request.GET['trip'], conductor=profile).values('schedule_id').first()
+        if trip is None:
+            return JsonResponse({'error': "Unknown trip"}, status=404)
+        schedule_id = trip['schedule_id']
+
+    bookings = booking_feed(day, profile.id, request.GET.get('route'), schedule_id)
+    after = request.GET.get('after')
+
+    if request.GET.get('format') == 'csv':
+        try:
+            bookings = keyset_filter(bookings, after, 'counted_at')
+        except CursorError as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+
+        def rows():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(['id', 'route', 'source', 'destination', 'seats', 'fare', 'type', 'time'])
+            for booking in bookings.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+                writer.writerow(feed_row(booking).values())
+                if buffer.tell() > 64 * 1024:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+
+        response = StreamingHttpResponse(rows(), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="bookings-{day}.csv"'
+        return response
 
-    return JsonResponse({'bookings': data})
+    try:
+        page, next_cursor, has_more = keyset_page(bookings, after, limit, 'counted_at')
+    except CursorError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    return JsonResponse({
+        'bookings': [feed_row(b) for b in page],
+        'next': next_cursor,
+        'has_more': has_more,
+    })
 
 
 def booking_analysis(request):
-    """Aggregate today's booking and fare data."""
+    """
+    Booking and fare figures for today, or for ?from=&to= (YYYY-MM-DD), read
+    from the DailyReport rollups. ?by=route or ?by=conductor adds a breakdown
+    computed in the same query.
+    """
     today = timezone.now().date()
-    bookings = Booking.objects.filter(booking_time__date=today)
-    filtered = bookings.filter(Q(created_by_conductor=True) | Q(created_online=True, verified_by_conductor=True))
+    try:
+        start = parse_date(request.GET['from']) if request.GET.get('from') else today
+        end = parse_date(request.GET['to']) if request.GET.get('to') else start
+    except ValueError:
+        start = end = None
+    by = request.GET.get('by') or None
+    if start is None or end is None or end < start:
+        return JsonResponse({'error': "from and to must be dates (YYYY-MM-DD), from <= to"}, status=400)
+    if by is not None and by not in BREAKDOWNS:
+        return JsonResponse({'error': f"by must be one of {', '.join(BREAKDOWNS)}"}, status=400)
 
-    return JsonResponse({
-        'total_bookings': filtered.count(),
-        'total_seats': filtered.aggregate(Sum('seats'))['seats__sum'] or 0,
-        'total_fare': filtered.aggregate(Sum('fare'))['fare__sum'] or 0,
-        'online_count': filtered.filter(created_online=True, verified_by_conductor=True).count(),
-        'manual_count': filtered.filter(created_by_conductor=True).count(),
-        'date': str(today),
-    })
+    totals, breakdown = rollups.summary(start, end, by)
+    data = {**totals, 'date': str(start), 'from': str(start), 'to': str(end)}
+    if breakdown is not None:
+        data['by'] = by
+        data['breakdown'] = breakdown
+    return JsonResponse(data)
 
 
 
 
-from django.http import JsonResponse
-from core.models import Route, BusStop
+from core.reference import reference_response
 
 def api_routes(request):
-    routes = Route.objects.all().values('route_no', 'source', 'destination', 'distance')
-    return JsonResponse(list(routes), safe=False)
+    return reference_response(request, 'routes_with_distance')
 
 def api_stops(request):
-    stops = BusStop.objects.all().values('name')
-    return JsonResponse(list(stops), safe=False)
+    return reference_response(request, 'stop_names')
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import Bus, BusStop, RouteStop, Route, Schedule, Booking, LostAndFound, Location, LostAndFound, Complaint, ComplaintImage
+from .models import PaymentOrder, ServiceCalendar, ServiceException
 from django.contrib.auth.models import Group
 from django.utils.html import format_html
 
@@ -121,7 +122,24 @@ class RouteAdmin(admin.ModelAdmin):
 
 @admin.register(Schedule)
 class ScheduleAdmin(admin.ModelAdmin):
-    list_display = ('bus', 'route', 'departure_time', 'available_seats')
-    list_filter = ('bus', 'route')
+    list_display = ('bus', 'route', 'departure_time', 'available_seats', 'calendar')
+    list_filter = ('bus', 'route', 'calendar')
     search_fields = ('bus__bus_number', 'route__route_no')
-    ordering = ('bus', 'departure_time')
\ No newline at end of file
+    ordering = ('bus', 'departure_time')
+
+
+class ServiceExceptionInline(admin.TabularInline):
+    model = ServiceException
+    extra = 1
+
+
+@admin.register(ServiceCalendar)
+class ServiceCalendarAdmin(admin.ModelAdmin):
+    list_display = ('name', *ServiceCalendar.WEEKDAYS, 'start_date', 'end_date')
+    inlines = [ServiceExceptionInline]
+
+
+@admin.register(PaymentOrder)
+class PaymentOrderAdmin(admin.ModelAdmin):
+    list_display = ('order_id', 'user', 'amount', 'route', 'seats', 'created_at')
+    search_fields = ('order_id',)
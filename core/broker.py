@@ -0,0 +1,74 @@
+import asyncio
+import threading
+
+
+class Subscription:
+    """
+    One streaming client. Updates are coalesced per bus, so a slow client
+    only ever holds the newest position of each bus instead of a backlog.
+    """
+
+    def __init__(self, loop, bus_id=None):
+        self.loop = loop
+        self.bus_id = bus_id
+        self.pending = {}
+        self.ready = asyncio.Event()
+
+    def wants(self, position):
+        return self.bus_id is None or position['id'] == self.bus_id
+
+    def push(self, positions):
+        # Runs on the subscriber's event loop
+        for position in positions:
+            self.pending[position['id']] = position
+        self.ready.set()
+
+    async def next_batch(self, timeout):
+        """Wait up to ``timeout`` seconds and return the pending positions (possibly empty)."""
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self.ready.clear()
+        batch = list(self.pending.values())
+        self.pending.clear()
+        return batch
+
+
+class PositionBroker:
+    """
+    In-process fan-out of position updates to streaming clients.
+
+    ``publish`` may be called from any thread (sync views run in a worker
+    thread under ASGI); delivery is handed to each subscriber's event loop.
+    Only clients connected to the same process receive the updates.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+
+    def subscribe(self, bus_id=None):
+        subscription = Subscription(asyncio.get_running_loop(), bus_id)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, positions):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            wanted = [p for p in positions if subscription.wants(p)]
+            if wanted:
+                try:
+                    subscription.loop.call_soon_threadsafe(subscription.push, wanted)
+                except RuntimeError:
+                    # Event loop already closed; the stream is gone
+                    self.unsubscribe(subscription)
+
+
+position_broker = PositionBroker()
@@ -0,0 +1,14 @@
+from django.urls import reverse
+
+from .snapshot import network_snapshot
+
+
+def network(request):
+    """
+    ``network_snapshot_url`` of the current network snapshot. Templates call
+    it only where they use it, so other pages never touch the snapshot.
+    """
+    def network_snapshot_url():
+        return reverse('network_snapshot', args=[network_snapshot.get().digest])
+
+    return {'network_snapshot_url': network_snapshot_url}
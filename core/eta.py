@@ -0,0 +1,205 @@
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.utils import timezone
+
+from conductor_service.models import ActiveTrip
+
+from .journey import AVERAGE_SPEED_KMH
+from .locations import latest_fleet_version
+from .models import LatestLocation, Location, RouteStop
+from .network import CachedIndex
+
+# Fixes older than this (seconds) before the latest one are used to estimate speed.
+SPEED_WINDOW = 300
+# Estimated speeds are clamped to this range (km/h); a stopped bus still gets an ETA.
+MIN_SPEED_KMH, MAX_SPEED_KMH = 5, 60
+# Arrivals are recomputed when the fleet version changes or after this many seconds.
+ARRIVALS_MAX_AGE = 30
+
+EARTH_RADIUS_KM = 6371.0
+
+
+class RouteShapes:
+    """
+    Flat arrays of every route's stops and of the segments between them, so
+    that a whole fleet can be processed with one set of NumPy operations.
+    Route ``r`` owns ``stop_*[stop_start[r]:stop_start[r] + stop_count[r]]``
+    and ``seg_*[seg_start[r]:seg_start[r] + seg_count[r]]``.
+    """
+
+    def __init__(self, rows):
+        # rows: (route_id, stop_id, lat, lng, distance_from_start) ordered by route and stop_order
+        self.route_index = {}
+        stop_ids, lats, lngs, dists, routes = [], [], [], [], []
+        for route_id, stop_id, lat, lng, dist in rows:
+            routes.append(self.route_index.setdefault(route_id, len(self.route_index)))
+            stop_ids.append(stop_id)
+            lats.append(lat)
+            lngs.append(lng)
+            dists.append(dist)
+
+        self.stop_id = np.array(stop_ids, dtype=np.int64)
+        self.stop_lat = np.radians(np.array(lats, dtype=float))
+        self.stop_lng = np.radians(np.array(lngs, dtype=float))
+        self.stop_dist = np.array(dists, dtype=float)
+        route_of = np.array(routes, dtype=np.int64)
+
+        n_routes = len(self.route_index)
+        self.stop_count = np.bincount(route_of, minlength=n_routes)
+        self.stop_start = np.concatenate(([0], np.cumsum(self.stop_count)[:-1])).astype(np.int64)
+
+        # A segment joins stop i to stop i + 1 of the same route
+        same_route = route_of[:-1] == route_of[1:]
+        self.seg_from = np.flatnonzero(same_route)
+        self.seg_count = np.bincount(route_of[self.seg_from], minlength=n_routes)
+        self.seg_start = np.concatenate(([0], np.cumsum(self.seg_count)[:-1])).astype(np.int64)
+
+    @classmethod
+    def build(cls):
+        return cls(RouteStop.objects.order_by('route_id', 'stop_order').values_list(
+            'route_id', 'bus_stop_id', 'bus_stop__latitude', 'bus_stop__longitude', 'distance_from_start'
+        ))
+
+    def snap(self, routes, lat, lng):
+        """
+        Distance along its route (km) of each position, by projecting it onto
+        the nearest segment of the route. ``routes`` are route indexes and
+        ``lat``/``lng`` degrees, one entry per position.
+        """
+        counts = self.seg_count[routes]
+        progress = np.full(len(routes), np.nan)
+        has_segments = counts > 0
+        if not has_segments.any():
+            return progress
+
+        owner = np.repeat(np.arange(len(routes)), counts)
+        # Index of every (position, segment of its route) pair
+        offsets = np.repeat(self.seg_start[routes] - np.concatenate(([0], np.cumsum(counts)[:-1])), counts)
+        seg = self.seg_from[np.arange(len(owner)) + offsets]
+
+        # Local equirectangular plane around each position, in km
+        lat0 = np.radians(lat)[owner]
+        lng0 = np.radians(lng)[owner]
+        scale = np.cos(lat0)
+        ax = (self.stop_lng[seg] - lng0) * scale * EARTH_RADIUS_KM
+        ay = (self.stop_lat[seg] - lat0) * EARTH_RADIUS_KM
+        bx = (self.stop_lng[seg + 1] - lng0) * scale * EARTH_RADIUS_KM
+        by = (self.stop_lat[seg + 1] - lat0) * EARTH_RADIUS_KM
+        dx, dy = bx - ax, by - ay
+        length2 = dx * dx + dy * dy
+        t = np.clip(np.divide(-(ax * dx + ay * dy), length2, out=np.zeros_like(length2), where=length2 > 0), 0, 1)
+        off_route = np.hypot(ax + t * dx, ay + t * dy)
+
+        # Nearest segment per position: sort by (owner, distance) and take each owner's first
+        order = np.lexsort((off_route, owner))
+        first = order[np.concatenate(([True], owner[order][1:] != owner[order][:-1]))]
+        along = self.stop_dist[seg[first]] + t[first] * (self.stop_dist[seg[first] + 1] - self.stop_dist[seg[first]])
+        progress[owner[first]] = along
+        return progress
+
+
+route_shapes = CachedIndex(RouteShapes.build)
+
+
+def compute_arrivals(shapes, trips, latest, earlier, now):
+    """
+    ETAs of every active bus to every stop ahead of it on its route.
+
+    ``trips`` is ``[(bus_pk, bus_id, route_id, route_no)]``, ``latest`` and
+    ``earlier`` map bus_pk to a ``(timestamp, lat, lng)`` fix; ``earlier`` is
+    optional per bus and only used for speed. Returns
+    ``{stop_id: [(eta_seconds, bus_id, route_no, distance_km), ...]}`` sorted by ETA.
+    """
+    trips = [t for t in trips if t[2] in shapes.route_index and t[0] in latest]
+    if not trips:
+        return {}
+
+    routes = np.array([shapes.route_index[t[2]] for t in trips], dtype=np.int64)
+    fixes = [latest[t[0]] for t in trips]
+    lat = np.array([f[1] for f in fixes], dtype=float)
+    lng = np.array([f[2] for f in fixes], dtype=float)
+    age = np.array([(now - f[0]).total_seconds() for f in fixes], dtype=float)
+    progress = shapes.snap(routes, lat, lng)
+
+    # Speed from how far along the route the bus moved since an earlier fix
+    speed = np.full(len(trips), AVERAGE_SPEED_KMH, dtype=float)
+    with_earlier = [i for i, t in enumerate(trips) if t[0] in earlier]
+    if with_earlier:
+        idx = np.array(with_earlier)
+        before = [earlier[trips[i][0]] for i in with_earlier]
+        then = shapes.snap(
+            routes[idx],
+            np.array([f[1] for f in before], dtype=float),
+            np.array([f[2] for f in before], dtype=float),
+        )
+        hours = np.array([(fixes[i][0] - f[0]).total_seconds() for i, f in zip(with_earlier, before)]) / 3600
+        moved = np.divide(progress[idx] - then, hours, out=np.full(len(idx), np.nan), where=hours > 0)
+        speed[idx] = np.where(np.isfinite(moved), moved, AVERAGE_SPEED_KMH)
+    speed = np.clip(speed, MIN_SPEED_KMH, MAX_SPEED_KMH)
+
+    # Every (bus, stop of its route) pair in one flat array
+    counts = shapes.stop_count[routes]
+    owner = np.repeat(np.arange(len(trips)), counts)
+    offsets = np.repeat(shapes.stop_start[routes] - np.concatenate(([0], np.cumsum(counts)[:-1])), counts)
+    stop = np.arange(len(owner)) + offsets
+
+    remaining = shapes.stop_dist[stop] - progress[owner]
+    ahead = np.isfinite(remaining) & (remaining > 0)
+    owner, stop, remaining = owner[ahead], stop[ahead], remaining[ahead]
+    eta = np.maximum(remaining / speed[owner] * 3600 - age[owner], 0)
+
+    arrivals = {}
+    for i in np.argsort(eta, kind='stable'):
+        _, bus_id, _, route_no = trips[owner[i]]
+        arrivals.setdefault(int(shapes.stop_id[stop[i]]), []).append(
+            (int(eta[i]), bus_id, route_no, round(float(remaining[i]), 2))
+        )
+    return arrivals
+
+
+def fleet_arrivals():
+    """Load active trips and their fixes, then compute arrivals for the whole fleet."""
+    now = timezone.now()
+    trips = list(
+        ActiveTrip.objects.filter(is_active=True, schedule__isnull=False).values_list(
+            'bus_id', 'bus__bus_id', 'schedule__route_id', 'schedule__route__route_no'
+        )
+    )
+    bus_pks = [t[0] for t in trips]
+    latest = {
+        bus_pk: (ts, lat, lng)
+        for bus_pk, ts, lat, lng in LatestLocation.objects.filter(bus_id__in=bus_pks).values_list(
+            'bus_id', 'timestamp', 'latitude', 'longitude'
+        )
+    }
+
+    # Oldest fix inside the speed window, per bus
+    earlier = {}
+    window = Location.objects.filter(
+        bus_id__in=bus_pks, timestamp__gte=now - timedelta(seconds=SPEED_WINDOW)
+    ).order_by('bus_id', 'timestamp').values_list('bus_id', 'timestamp', 'latitude', 'longitude')
+    for bus_pk, ts, lat, lng in window:
+        if bus_pk not in earlier and bus_pk in latest and ts < latest[bus_pk][0]:
+            earlier[bus_pk] = (ts, lat, lng)
+
+    return compute_arrivals(route_shapes.get(), trips, latest, earlier, now)
+
+
+_lock = threading.Lock()
+_cached = (None, 0.0, {})
+
+
+def get_arrivals():
+    """Fleet arrivals, recomputed only after new positions or ``ARRIVALS_MAX_AGE`` seconds."""
+    global _cached
+    version = latest_fleet_version()
+    cached_version, computed_at, arrivals = _cached
+    if version != cached_version or time.monotonic() - computed_at > ARRIVALS_MAX_AGE:
+        with _lock:
+            if _cached[0] == cached_version and _cached[1] == computed_at:
+                _cached = (version, time.monotonic(), fleet_arrivals())
+            arrivals = _cached[2]
+    return arrivals
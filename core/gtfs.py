@@ -0,0 +1,411 @@
+"""
+GTFS import and export of the route network.
+
+Mapping between a feed and the models:
+
+- stops.txt → BusStop, matched by case-insensitive name, because riders
+  and bookings refer to stops by name. Stations (location_type 1) are skipped.
+- routes.txt → Route, matched by route_no (route_short_name, else route_id).
+  A route's stops are those of its longest trip in direction 0. source and
+  destination are the first and last of those stops, and the distances are
+  measured along them.
+- calendar.txt + calendar_dates.txt → ServiceCalendar named by service_id,
+  with the dates of calendar_dates.txt as its ServiceExceptions. Without
+  either file, schedules run daily.
+- trips.txt + stop_times.txt → Schedule, one per trip, leaving at the trip's
+  first departure, on the calendar of the trip's service_id. The trip's
+  block_id names its Bus. Trips without a block share one bus per route,
+  ``R<route_no>``. Schedules that already exist (Schedule.unique_together)
+  are left alone, so re-importing a feed keeps the seats already sold.
+  The upcoming dated trips of the imported routes are refreshed at the end
+  (core.service.refresh_trips), as the bulk writes send no signals.
+
+Files are read as streams, stop_times.txt in two passes. Each step commits
+on its own and writes in batches.
+"""
+import csv
+import io
+import os
+import zipfile
+from datetime import date, datetime, time
+
+from django.db import transaction
+
+from .journey import AVERAGE_SPEED_KMH, seconds_of
+from .models import Bus, BusStop, Route, RouteStop, Schedule, ServiceCalendar, ServiceException
+from .service import refresh_trips
+from .signals import invalidate_network_caches
+from .spatial import haversine
+
+BATCH_SIZE = 2000
+DEFAULT_CAPACITY = 40
+DEFAULT_CATEGORY = 'Non-AC'
+# service_id of the exported trips of schedules without a calendar, which run daily
+SERVICE_ID = 'DAILY'
+# Date range written for calendars without one
+ALWAYS = (date(2000, 1, 1), date(2099, 12, 31))
+
+
+class GTFSError(Exception):
+    """The feed can't be imported."""
+
+
+class Feed:
+    """Text files of a GTFS feed in a directory or a zip archive."""
+
+    def __init__(self, path):
+        self.path = path
+        self.zip = zipfile.ZipFile(path) if zipfile.is_zipfile(path) else None
+        if self.zip:
+            self.names = {os.path.basename(name): name for name in self.zip.namelist()}
+        elif os.path.isdir(path):
+            self.names = {name: os.path.join(path, name) for name in os.listdir(path)}
+        else:
+            raise GTFSError(f"{path} is neither a directory nor a zip file")
+
+    def open(self, name):
+        if self.zip:
+            return io.TextIOWrapper(self.zip.open(self.names[name]), encoding='utf-8-sig', newline='')
+        return open(self.names[name], encoding='utf-8-sig', newline='')
+
+    def rows(self, name, required, optional=()):
+        """
+        Stream ``name`` as tuples of the ``required`` then ``optional``
+        columns; a missing optional column reads as ''.
+        """
+        if name not in self.names:
+            raise GTFSError(f"{name} is missing")
+        with self.open(name) as f:
+            reader = csv.reader(f)
+            header = [column.strip() for column in next(reader, [])]
+            missing = [column for column in required if column not in header]
+            if missing:
+                raise GTFSError(f"{name} lacks {', '.join(missing)}")
+            positions = [header.index(c) if c in header else None for c in (*required, *optional)]
+            width = len(header)
+            for row in reader:
+                if not row:
+                    continue
+                if len(row) < width:
+                    row += [''] * (width - len(row))
+                yield tuple(row[p].strip() if p is not None else '' for p in positions)
+
+
+def parse_time(value):
+    """GTFS HH:MM:SS, which may run past 24:00:00, as seconds after midnight."""
+    try:
+        hours, minutes, seconds = value.split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+    except ValueError:
+        raise GTFSError(f"Bad time {value!r}") from None
+
+
+def parse_sequence(value):
+    """A stop_times.txt stop_sequence: a non-negative integer."""
+    try:
+        sequence = int(value)
+    except ValueError:
+        sequence = -1
+    if sequence < 0:
+        raise GTFSError(f"stop_times.txt: bad stop_sequence {value!r}")
+    return sequence
+
+
+def format_time(seconds):
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def parse_date(value):
+    """GTFS YYYYMMDD as a date."""
+    try:
+        return datetime.strptime(value, '%Y%m%d').date()
+    except ValueError:
+        raise GTFSError(f"Bad date {value!r}") from None
+
+
+def import_feed(path, capacity=DEFAULT_CAPACITY, category=DEFAULT_CATEGORY):
+    """Import a feed from a directory or zip. Returns counts of what was written."""
+    feed = Feed(path)
+    counts = {}
+    stops = import_stops(feed, counts)
+    calendars = import_calendars(feed, counts)
+    trips = read_trips(feed)
+    routes = import_routes(feed, stops, trips, counts)
+    import_schedules(trips, routes, calendars, capacity, category, counts)
+    # Bulk writes send no signals
+    invalidate_network_caches()
+    refresh_trips({route_pk for route_pk, _ in routes.values()})
+    return counts
+
+
+def import_stops(feed, counts):
+    """Create or move stops. Returns {GTFS stop_id: (BusStop id, lat, lng)}."""
+    existing = {}
+    for stop_id, name, lat, lng in BusStop.objects.order_by('id').values_list('id', 'name', 'latitude', 'longitude'):
+        existing.setdefault(name.casefold(), [stop_id, lat, lng, False])
+
+    feed_stops = {}  # GTFS stop_id -> casefolded name
+    new = {}
+    for stop_id, name, lat, lng, location_type in feed.rows(
+        'stops.txt', ('stop_id', 'stop_name', 'stop_lat', 'stop_lon'), ('location_type',)
+    ):
+        if location_type not in ('', '0'):
+            continue
+        try:
+            lat, lng = float(lat), float(lng)
+        except ValueError:
+            raise GTFSError(f"stops.txt: bad coordinates for stop {stop_id}") from None
+        key = name.casefold()
+        feed_stops[stop_id] = key
+        if key in existing:
+            current = existing[key]
+            if not current[3] and (current[1], current[2]) != (lat, lng):
+                current[1:] = [lat, lng, True]
+        elif key not in new:
+            new[key] = BusStop(name=name[:100], latitude=lat, longitude=lng)
+
+    with transaction.atomic():
+        BusStop.objects.bulk_create(new.values(), batch_size=BATCH_SIZE)
+        moved = [BusStop(id=s[0], latitude=s[1], longitude=s[2]) for s in existing.values() if s[3]]
+        BusStop.objects.bulk_update(moved, ['latitude', 'longitude'], batch_size=BATCH_SIZE)
+    counts.update(stops_created=len(new), stops_updated=len(moved))
+
+    for key, stop in new.items():
+        existing[key] = [stop.id, stop.latitude, stop.longitude, False]
+    return {stop_id: tuple(existing[key][:3]) for stop_id, key in feed_stops.items()}
+
+
+def import_calendars(feed, counts):
+    """Create or update a ServiceCalendar per service_id. Returns {service_id: ServiceCalendar id}."""
+    weekdays = ServiceCalendar.WEEKDAYS
+    calendars = {}
+    if 'calendar.txt' in feed.names:
+        for service_id, *days, start, end in feed.rows(
+            'calendar.txt', ('service_id', *weekdays, 'start_date', 'end_date')
+        ):
+            calendars[service_id] = dict(
+                zip(weekdays, (day == '1' for day in days)),
+                start_date=parse_date(start) if start else None, end_date=parse_date(end) if end else None,
+            )
+    exceptions = {}
+    if 'calendar_dates.txt' in feed.names:
+        for service_id, day, kind in feed.rows('calendar_dates.txt', ('service_id', 'date', 'exception_type')):
+            # A service defined only by its dates runs on none of the weekdays
+            calendars.setdefault(service_id, dict.fromkeys(weekdays, False))
+            exceptions.setdefault(service_id, {})[parse_date(day)] = kind == '1'
+    if not calendars:
+        return {}
+    if any(len(service_id) > ServiceCalendar._meta.get_field('name').max_length for service_id in calendars):
+        raise GTFSError("calendar.txt: a service_id is too long")
+
+    with transaction.atomic():
+        existing = dict(ServiceCalendar.objects.filter(name__in=calendars).values_list('name', 'id'))
+        rows = [ServiceCalendar(id=existing.get(name), name=name, **fields) for name, fields in calendars.items()]
+        ServiceCalendar.objects.bulk_update(
+            [row for row in rows if row.id], [*weekdays, 'start_date', 'end_date'], batch_size=BATCH_SIZE,
+        )
+        ServiceCalendar.objects.bulk_create([row for row in rows if not row.id], batch_size=BATCH_SIZE)
+        ids = {row.name: row.id for row in rows}
+        # A calendar's exceptions are replaced as a whole
+        ServiceException.objects.filter(calendar_id__in=ids.values()).delete()
+        ServiceException.objects.bulk_create([
+            ServiceException(calendar_id=ids[service_id], date=day, runs=runs)
+            for service_id, dates in exceptions.items() for day, runs in dates.items()
+        ], batch_size=BATCH_SIZE)
+    counts.update(calendars=len(ids), service_exceptions=sum(len(dates) for dates in exceptions.values()))
+    return ids
+
+
+def read_trips(feed):
+    """
+    {trip_id: [route_id, block_id, direction_id, stop count, first stop_sequence, first departure, service_id]}
+    from trips.txt and a first pass over stop_times.txt.
+    """
+    trips = {
+        trip_id: [route_id, block_id, direction_id, 0, None, None, service_id]
+        for route_id, trip_id, block_id, direction_id, service_id
+        in feed.rows('trips.txt', ('route_id', 'trip_id'), ('block_id', 'direction_id', 'service_id'))
+    }
+    for trip_id, sequence, departure, arrival in feed.rows(
+        'stop_times.txt', ('trip_id', 'stop_sequence'), ('departure_time', 'arrival_time')
+    ):
+        trip = trips.get(trip_id)
+        if trip is None:
+            continue
+        trip[3] += 1
+        sequence = parse_sequence(sequence)
+        if trip[4] is None or sequence < trip[4]:
+            trip[4], trip[5] = sequence, departure or arrival
+    return trips
+
+
+def import_routes(feed, stops, trips, counts):
+    """Create or update routes and replace their stops. Returns {GTFS route_id: (Route id, route_no)}."""
+    feed_routes = {}
+    for route_id, short_name in feed.rows('routes.txt', ('route_id',), ('route_short_name',)):
+        route_no = short_name or route_id
+        if len(route_no) > Route._meta.get_field('route_no').max_length:
+            raise GTFSError(f"routes.txt: route number {route_no!r} is too long")
+        feed_routes[route_id] = route_no
+
+    # The longest trip of each route, preferring direction 0, gives its stops
+    best = {}
+    for trip_id, (route_id, _, direction, count, _, _, _) in trips.items():
+        rank = (direction in ('', '0'), count)
+        if route_id in feed_routes and count > 1 and rank > best.get(route_id, ((False, 0), None))[0]:
+            best[route_id] = (rank, trip_id)
+    patterns = {trip_id: [] for _, trip_id in best.values()}
+    for trip_id, sequence, stop_id in feed.rows('stop_times.txt', ('trip_id', 'stop_sequence', 'stop_id')):
+        if trip_id in patterns:
+            if stop_id not in stops:
+                raise GTFSError(f"stop_times.txt: trip {trip_id} calls at unknown stop {stop_id}")
+            patterns[trip_id].append((parse_sequence(sequence), stops[stop_id]))
+
+    existing = {}
+    for route_pk, route_no in Route.objects.order_by('id').values_list('id', 'route_no'):
+        existing.setdefault(route_no, route_pk)
+    names = dict(BusStop.objects.filter(
+        id__in={stop[0] for pattern in patterns.values() for _, stop in pattern}
+    ).values_list('id', 'name'))
+
+    # GTFS routes sharing a route number (one per direction, say) become one Route
+    routes, route_stops, numbers = {}, {}, {}
+    for route_id, route_no in feed_routes.items():
+        if route_id not in best:
+            # No trip runs on it, so there is nothing to show for it
+            continue
+        numbers[route_id] = route_no
+        if route_no in routes:
+            continue
+        pattern = [stop for _, stop in sorted(patterns[best[route_id][1]])]
+        # A stop listed twice in a row (arrival and departure rows) is one call
+        pattern = [stop for n, stop in enumerate(pattern) if n == 0 or stop[0] != pattern[n - 1][0]]
+        distances = [0.0]
+        for (_, lat1, lng1), (_, lat2, lng2) in zip(pattern, pattern[1:]):
+            distances.append(distances[-1] + haversine(lat1, lng1, lat2, lng2) / 1000)
+        routes[route_no] = Route(
+            id=existing.get(route_no), route_no=route_no,
+            source=names[pattern[0][0]], destination=names[pattern[-1][0]],
+            distance=round(distances[-1], 2),
+        )
+        route_stops[route_no] = [(stop[0], round(d, 3)) for stop, d in zip(pattern, distances)]
+
+    with transaction.atomic():
+        fields = ['source', 'destination', 'distance']
+        Route.objects.bulk_update([r for r in routes.values() if r.id], fields, batch_size=BATCH_SIZE)
+        created = Route.objects.bulk_create([r for r in routes.values() if not r.id], batch_size=BATCH_SIZE)
+        # A route's stops are replaced as a whole
+        RouteStop.objects.filter(route_id__in=[r.id for r in routes.values()]).delete()
+        RouteStop.objects.bulk_create([
+            RouteStop(route_id=routes[route_no].id, bus_stop_id=stop_pk, stop_order=order, distance_from_start=d)
+            for route_no, pattern in route_stops.items()
+            for order, (stop_pk, d) in enumerate(pattern)
+        ], batch_size=BATCH_SIZE)
+    counts.update(
+        routes_created=len(created), routes_updated=len(routes) - len(created),
+        routes_skipped=len(feed_routes) - len(numbers), route_stops=sum(len(p) for p in route_stops.values()),
+    )
+    return {route_id: (routes[route_no].id, route_no) for route_id, route_no in numbers.items()}
+
+
+def import_schedules(trips, routes, calendars, capacity, category, counts):
+    """One Schedule per trip; existing (bus, route, departure_time) rows are kept as they are."""
+    wanted = {}
+    for route_id, block_id, _, _, _, departure, service_id in trips.values():
+        if route_id not in routes or not departure:
+            continue
+        route_pk, route_no = routes[route_id]
+        bus_id = (block_id or f'R{route_no}')[:Bus._meta.get_field('bus_id').max_length]
+        seconds = parse_time(departure) % 86400
+        wanted[(bus_id, route_pk, time(seconds // 3600, seconds // 60 % 60, seconds % 60))] = calendars.get(service_id)
+
+    with transaction.atomic():
+        Bus.objects.bulk_create(
+            [Bus(bus_id=bus_id, category=category, capacity=capacity) for bus_id in {key[0] for key in wanted}],
+            batch_size=BATCH_SIZE, ignore_conflicts=True,
+        )
+        buses = {
+            bus_id: (pk, seats)
+            for bus_id, pk, seats in Bus.objects.filter(bus_id__in={key[0] for key in wanted}).values_list(
+                'bus_id', 'id', 'capacity'
+            )
+        }
+        before = Schedule.objects.count()
+        Schedule.objects.bulk_create([
+            Schedule(bus_id=buses[bus_id][0], route_id=route_pk, departure_time=departure,
+                     available_seats=buses[bus_id][1], calendar_id=calendar_id)
+            for (bus_id, route_pk, departure), calendar_id in wanted.items()
+        ], batch_size=BATCH_SIZE, ignore_conflicts=True)
+        counts['schedules_created'] = Schedule.objects.count() - before
+    counts['schedules_existing'] = len(wanted) - counts['schedules_created']
+
+
+def export_feed(directory, speed_kmh=AVERAGE_SPEED_KMH):
+    """
+    Write the network as a GTFS feed into ``directory``. Stop times are
+    derived from distance_from_start at ``speed_kmh``, as the journey planner does.
+    Returns the number of rows written per file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    written = {}
+
+    def write(name, header, rows):
+        with open(os.path.join(directory, name), 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            count = 0
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        written[name] = count
+
+    write('agency.txt', ['agency_id', 'agency_name', 'agency_url', 'agency_timezone'],
+          [['NMMT', 'Navi Mumbai Municipal Transport', 'https://nmmt.in', 'Asia/Kolkata']])
+    calendars = {}
+    services = []
+    for calendar in ServiceCalendar.objects.order_by('id'):
+        calendars[calendar.id] = calendar.name
+        services.append([
+            calendar.name, *(int(getattr(calendar, day)) for day in ServiceCalendar.WEEKDAYS),
+            f'{calendar.start_date or ALWAYS[0]:%Y%m%d}', f'{calendar.end_date or ALWAYS[1]:%Y%m%d}',
+        ])
+    if SERVICE_ID not in calendars.values():
+        services.insert(0, [SERVICE_ID, 1, 1, 1, 1, 1, 1, 1, f'{ALWAYS[0]:%Y%m%d}', f'{ALWAYS[1]:%Y%m%d}'])
+    write('calendar.txt', ['service_id', *ServiceCalendar.WEEKDAYS, 'start_date', 'end_date'], services)
+    write('calendar_dates.txt', ['service_id', 'date', 'exception_type'], (
+        [name, f'{day:%Y%m%d}', 1 if runs else 2]
+        for name, day, runs in ServiceException.objects.order_by('calendar_id', 'date').values_list(
+            'calendar__name', 'date', 'runs'
+        )
+    ))
+    write('stops.txt', ['stop_id', 'stop_name', 'stop_lat', 'stop_lon'],
+          BusStop.objects.order_by('id').values_list('id', 'name', 'latitude', 'longitude').iterator(BATCH_SIZE))
+    write('routes.txt', ['route_id', 'agency_id', 'route_short_name', 'route_long_name', 'route_type'], (
+        [pk, 'NMMT', route_no, f'{source} - {destination}', 3]
+        for pk, route_no, source, destination
+        in Route.objects.order_by('id').values_list('id', 'route_no', 'source', 'destination').iterator(BATCH_SIZE)
+    ))
+
+    stops = {}
+    for route_id, stop_id, distance in RouteStop.objects.order_by('route_id', 'stop_order').values_list(
+        'route_id', 'bus_stop_id', 'distance_from_start'
+    ).iterator(BATCH_SIZE):
+        stops.setdefault(route_id, []).append((stop_id, distance))
+    schedules = Schedule.objects.filter(route_id__in=stops).order_by('route_id', 'departure_time', 'id')
+    write('trips.txt', ['route_id', 'service_id', 'trip_id', 'block_id'], (
+        [route_id, calendars.get(calendar_id, SERVICE_ID), pk, bus_id]
+        for pk, route_id, bus_id, calendar_id
+        in schedules.values_list('id', 'route_id', 'bus__bus_id', 'calendar_id').iterator(BATCH_SIZE)
+    ))
+
+    def stop_times():
+        for pk, route_id, departure in schedules.values_list('id', 'route_id', 'departure_time').iterator(BATCH_SIZE):
+            route_stops = stops[route_id]
+            start = seconds_of(departure)
+            for sequence, (stop_id, distance) in enumerate(route_stops):
+                at = format_time(start + round((distance - route_stops[0][1]) / speed_kmh * 3600))
+                yield [pk, at, at, stop_id, sequence, distance]
+
+    write('stop_times.txt', ['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence',
+                             'shape_dist_traveled'], stop_times())
+    return written
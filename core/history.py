@@ -0,0 +1,80 @@
+"""
+Riders' booking history: keyset pages of the displayed columns and the
+RiderStats totals shown above them.
+"""
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Min, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from .models import Booking, RiderStats
+from .pagination import keyset_page
+
+HISTORY_FIELDS = ('id', 'route', 'source', 'destination', 'seats', 'fare', 'booking_time')
+HISTORY_PAGE_SIZE = 20
+
+
+def history_page(user_id, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """Newest-first page of a user's bookings as dicts; see keyset_page."""
+    bookings = Booking.objects.filter(user_id=user_id).values(*HISTORY_FIELDS)
+    return keyset_page(bookings, cursor, limit, 'booking_time', descending=True)
+
+
+def record_bookings(user_id, bookings):
+    """Add bookings of one user, already saved, to their RiderStats."""
+    bookings = list(bookings)
+    if not bookings:
+        return
+    trips = len(bookings)
+    seats = sum(b.seats for b in bookings)
+    spend = sum((Decimal(str(b.fare)) for b in bookings if b.fare is not None), Decimal('0'))
+    first = min(b.booking_time for b in bookings)
+    last = max(b.booking_time for b in bookings)
+
+    stats = RiderStats.objects.filter(user_id=user_id)
+    changes = dict(
+        trips=F('trips') + trips,
+        seats=F('seats') + seats,
+        spend=F('spend') + spend,
+        # LEAST/GREATEST are NULL on SQLite if either side is, hence the Coalesce
+        first_booking=Coalesce(Least(F('first_booking'), Value(first)), Value(first)),
+        last_booking=Coalesce(Greatest(F('last_booking'), Value(last)), Value(last)),
+    )
+    if stats.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            # A user without a row yet may already have bookings from before RiderStats existed
+            rebuild_rider_stats(user_id)
+    except IntegrityError:
+        stats.update(**changes)
+
+
+def forget_booking(booking):
+    """Take a deleted booking out of its user's totals (first/last dates are left as they are)."""
+    RiderStats.objects.filter(user_id=booking.user_id).update(
+        trips=F('trips') - 1,
+        seats=F('seats') - booking.seats,
+        spend=F('spend') - (Decimal(str(booking.fare)) if booking.fare is not None else 0),
+    )
+
+
+def rebuild_rider_stats(user_id):
+    """Recompute one user's RiderStats from their bookings."""
+    totals = Booking.objects.filter(user_id=user_id).aggregate(
+        trips=Count('id'),
+        seats=Coalesce(Sum('seats'), 0),
+        spend=Sum('fare'),
+        first_booking=Min('booking_time'),
+        last_booking=Max('booking_time'),
+    )
+    totals['spend'] = totals['spend'] or 0
+    stats, _ = RiderStats.objects.update_or_create(user_id=user_id, defaults=totals)
+    return stats
+
+
+def rider_stats(user_id):
+    """A user's RiderStats, computed on first use."""
+    stats = RiderStats.objects.filter(user_id=user_id).first()
+    return stats if stats is not None else rebuild_rider_stats(user_id)
@@ -0,0 +1,88 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import SeatHold, TripInstance
+
+# Minutes a seat stays held between create_order and payment_success.
+HOLD_MINUTES = 10
+
+
+class SoldOut(Exception):
+    """Not enough seats left on the trip."""
+
+
+def reserve_seats(trip_id, seats):
+    """
+    Take ``seats`` from the dated trip in a single conditional UPDATE, so two
+    concurrent buyers can never both get the last seat. Expired holds on the
+    trip are returned first when the plain attempt fails.
+    """
+    if seats <= 0:
+        raise ValueError("seats must be positive")
+    for attempt in range(2):
+        taken = TripInstance.objects.filter(id=trip_id, available_seats__gte=seats).update(
+            available_seats=F('available_seats') - seats
+        )
+        if taken:
+            return
+        if attempt == 0 and not release_expired_holds(trip_id):
+            break
+    raise SoldOut(f"Fewer than {seats} seats left on this bus")
+
+
+def release_seats(trip_id, seats):
+    TripInstance.objects.filter(id=trip_id).update(available_seats=F('available_seats') + seats)
+
+
+def hold_seats(trip_id, seats, minutes=HOLD_MINUTES):
+    """Reserve seats for a pending payment; they come back if the hold expires."""
+    with transaction.atomic():
+        reserve_seats(trip_id, seats)
+        return SeatHold.objects.create(
+            trip_id=trip_id,
+            seats=seats,
+            expires_at=timezone.now() + timedelta(minutes=minutes),
+        )
+
+
+def confirm_hold(order_id):
+    """
+    Turn the hold of a paid order into a sale. Returns the hold, or None if
+    there is none. A hold that already expired is re-reserved if seats remain,
+    otherwise SoldOut is raised.
+    """
+    with transaction.atomic():
+        # Write first: the conditional UPDATE decides any race with release_hold
+        SeatHold.objects.filter(order_id=order_id, status=SeatHold.HELD).update(status=SeatHold.CONFIRMED)
+        hold = SeatHold.objects.filter(order_id=order_id).first()
+        if hold is not None and hold.status == SeatHold.RELEASED:
+            if SeatHold.objects.filter(id=hold.id, status=SeatHold.RELEASED).update(status=SeatHold.CONFIRMED):
+                if hold.trip_id is None:
+                    raise SoldOut("The hold predates dated trips and can't be renewed")
+                reserve_seats(hold.trip_id, hold.seats)
+            hold.status = SeatHold.CONFIRMED
+        return hold
+
+
+def release_hold(hold):
+    """
+    Give back the seats of a hold that will not be paid. Conditional on the
+    status, so racing with a confirm or another release frees seats at most once.
+    Returns True if this call released it.
+    """
+    with transaction.atomic():
+        released = SeatHold.objects.filter(id=hold.id, status=SeatHold.HELD).update(status=SeatHold.RELEASED)
+        if released:
+            release_seats(hold.trip_id, hold.seats)
+    return bool(released)
+
+
+def release_expired_holds(trip_id=None):
+    """Return the seats of every expired hold (of one trip, if given). Returns seats freed."""
+    expired = SeatHold.objects.filter(status=SeatHold.HELD, expires_at__lt=timezone.now())
+    if trip_id is not None:
+        expired = expired.filter(trip_id=trip_id)
+    return sum(hold.seats for hold in expired.only('id', 'trip_id', 'seats') if release_hold(hold))
@@ -0,0 +1,211 @@
+import bisect
+from array import array
+
+from django.db.models import Q
+
+from .models import BusStop, Route, RouteStop, Schedule, ServiceCalendar, ServiceException
+from .network import CachedIndex
+
+# Used to turn RouteStop.distance_from_start into a time offset from departure.
+AVERAGE_SPEED_KMH = 20
+# Seconds allowed to change buses at a stop.
+MIN_TRANSFER = 120
+
+INF = 1 << 30
+
+
+def seconds_of(t):
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+
+def clock(seconds):
+    seconds %= 86400
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}"
+
+
+def running_calendars(day):
+    """Ids of the ServiceCalendars that run on ``day``."""
+    exceptions = dict(ServiceException.objects.filter(date=day).values_list('calendar_id', 'runs'))
+    return {
+        calendar.id for calendar in ServiceCalendar.objects.all()
+        if calendar.runs_on(day, {day: exceptions[calendar.id]} if calendar.id in exceptions else {})
+    }
+
+
+class RouteTimetable:
+    """
+    Stops and trips of one route. All trips share the stop offsets, so the
+    trip serving a stop at a given time is found by bisecting ``departures``.
+    """
+
+    __slots__ = ('route_id', 'route_no', 'stops', 'offsets', 'departures', 'schedule_ids')
+
+    def __init__(self, route_id, route_no, stops, offsets, trips):
+        trips = sorted(trips)
+        self.route_id = route_id
+        self.route_no = route_no
+        self.stops = array('q', stops)
+        self.offsets = array('l', offsets)
+        self.departures = array('l', [departure for departure, _ in trips])
+        self.schedule_ids = [schedule_id for _, schedule_id in trips]
+
+    def earliest_trip(self, position, time):
+        """Index of the first trip at ``stops[position]`` at or after ``time``, or None."""
+        trip = bisect.bisect_left(self.departures, time - self.offsets[position])
+        return trip if trip < len(self.departures) else None
+
+    def time_at(self, trip, position):
+        return self.departures[trip] + self.offsets[position]
+
+
+class Timetable:
+    """Array-backed timetable of the whole network with a RAPTOR planner."""
+
+    def __init__(self, stop_names, routes):
+        self.stop_names = stop_names
+        self.routes = [route for route in routes if len(route.stops) > 1 and len(route.departures)]
+        self.stops_by_name = {}
+        for stop_id, name in stop_names.items():
+            self.stops_by_name.setdefault(name.casefold(), []).append(stop_id)
+        self.routes_by_stop = {}
+        for index, route in enumerate(self.routes):
+            for position, stop_id in enumerate(route.stops):
+                self.routes_by_stop.setdefault(stop_id, []).append((index, position))
+
+    @classmethod
+    def build(cls, day=None, speed_kmh=AVERAGE_SPEED_KMH):
+        """The network's timetable; with ``day``, only of the schedules running that day."""
+        stop_names = dict(BusStop.objects.values_list('id', 'name'))
+
+        stops = {}
+        rows = RouteStop.objects.order_by('route_id', 'stop_order').values_list(
+            'route_id', 'bus_stop_id', 'distance_from_start'
+        )
+        for route_id, stop_id, distance in rows:
+            stops.setdefault(route_id, []).append((stop_id, distance))
+
+        schedules = Schedule.objects.all()
+        if day is not None:
+            schedules = schedules.filter(Q(calendar__isnull=True) | Q(calendar_id__in=running_calendars(day)))
+        trips = {}
+        for route_id, schedule_id, departure in schedules.values_list('route_id', 'id', 'departure_time'):
+            trips.setdefault(route_id, []).append((seconds_of(departure), schedule_id))
+
+        routes = []
+        for route_id, route_no in Route.objects.values_list('id', 'route_no'):
+            route_stops = stops.get(route_id, [])
+            if not route_stops:
+                continue
+            start = route_stops[0][1]
+            offsets = [round((distance - start) / speed_kmh * 3600) for _, distance in route_stops]
+            routes.append(RouteTimetable(
+                route_id, route_no, [stop_id for stop_id, _ in route_stops], offsets, trips.get(route_id, [])
+            ))
+        return cls(stop_names, routes)
+
+    def resolve(self, stop):
+        """Stop ids for a stop id or (case-insensitive) stop name."""
+        if isinstance(stop, int) or stop.isdigit():
+            return [int(stop)] if int(stop) in self.stop_names else []
+        return self.stops_by_name.get(stop.casefold(), [])
+
+    def plan(self, origins, destinations, depart, max_transfers=2, min_transfer=MIN_TRANSFER):
+        """
+        Earliest-arrival journeys from any of ``origins`` to any of
+        ``destinations`` leaving at ``depart`` (seconds since midnight).
+
+        Runs one RAPTOR round per bus taken, so round ``k`` finds the best
+        arrival using ``k`` buses. Returns the Pareto set: one journey per
+        number of transfers that arrives strictly earlier than all journeys
+        with fewer transfers.
+        """
+        origins = set(origins)
+        destinations = set(destinations)
+        best = {stop: depart for stop in origins}
+        labels = [dict(best)]
+        parents = [{}]
+        marked = set(origins)
+        target = INF
+        journeys = []
+
+        for k in range(1, max_transfers + 2):
+            previous = labels[-1]
+            current, parent = dict(previous), {}
+
+            queue = {}
+            for stop in marked:
+                for route_index, position in self.routes_by_stop.get(stop, ()):
+                    if position < queue.get(route_index, INF):
+                        queue[route_index] = position
+            marked = set()
+
+            for route_index, start in queue.items():
+                route = self.routes[route_index]
+                trip = None
+                for position in range(start, len(route.stops)):
+                    stop = route.stops[position]
+                    if trip is not None:
+                        arrival = route.time_at(trip, position)
+                        if arrival < best.get(stop, INF) and arrival < target:
+                            current[stop] = best[stop] = arrival
+                            parent[stop] = (route_index, trip, board_stop, board_position, position)
+                            marked.add(stop)
+
+                    ready = previous.get(stop)
+                    if ready is None:
+                        continue
+                    if stop not in origins:
+                        ready += min_transfer
+                    if trip is None or ready <= route.time_at(trip, position):
+                        earlier = route.earliest_trip(position, ready)
+                        if earlier is not None and (trip is None or earlier < trip):
+                            trip, board_stop, board_position = earlier, stop, position
+
+            labels.append(current)
+            parents.append(parent)
+
+            reached = [(current[stop], stop) for stop in destinations if stop in parent]
+            if reached and min(reached)[0] < target:
+                target, stop = min(reached)
+                journeys.append(self._journey(parents, k, stop))
+            if not marked:
+                break
+
+        return journeys
+
+    def _journey(self, parents, k, stop):
+        legs = []
+        while k > 0:
+            # The label used in round k was set by the latest round <= k that touched the stop
+            j = next((j for j in range(k, 0, -1) if stop in parents[j]), None)
+            if j is None:
+                break
+            route_index, trip, board_stop, board_position, alight_position = parents[j][stop]
+            route = self.routes[route_index]
+            legs.append({
+                'route_no': route.route_no,
+                'schedule_id': route.schedule_ids[trip],
+                'from': self.stop_names.get(board_stop),
+                'to': self.stop_names.get(stop),
+                'departure': clock(route.time_at(trip, board_position)),
+                'arrival': clock(route.time_at(trip, alight_position)),
+            })
+            stop, k = board_stop, j - 1
+        legs.reverse()
+        return {
+            'arrival': legs[-1]['arrival'],
+            'transfers': len(legs) - 1,
+            'legs': legs,
+        }
+
+
+# {service date: Timetable of that day}, each built on first use
+timetables = CachedIndex(dict)
+
+
+def timetable_for(day):
+    """The timetable of the schedules running on ``day``."""
+    tables = timetables.get()
+    if day not in tables:
+        tables[day] = Timetable.build(day)
+    return tables[day]
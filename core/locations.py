@@ -0,0 +1,226 @@
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+
+from .broker import position_broker
+from .models import Bus, LatestLocation, Location
+
+# Rows per INSERT statement when writing a batch of fixes.
+INGEST_BATCH_SIZE = 500
+# Seconds the version handed to clients trails the clock (FLEET_VERSION_LAG setting)
+FLEET_VERSION_LAG = 2
+
+
+class FixError(ValueError):
+    """A single GPS fix that cannot be stored."""
+
+
+def parse_fixes(body, content_type=''):
+    """
+    Decode a batch upload into a list of fix dicts.
+
+    Accepts a JSON array, a JSON object with a ``fixes`` array, or NDJSON
+    (one JSON object per line). Blank NDJSON lines are skipped; a line that
+    is not valid JSON is returned as ``None`` so it gets reported per row.
+    """
+    text = body.decode('utf-8') if isinstance(body, bytes) else body
+
+    if 'ndjson' not in content_type:
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None
+        else:
+            if isinstance(data, dict):
+                data = data.get('fixes', [data])
+            if isinstance(data, list):
+                return data
+
+    fixes = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            fixes.append(json.loads(line))
+        except ValueError:
+            fixes.append(None)
+    return fixes
+
+
+def _coordinates(fix):
+    try:
+        lat = float(fix['latitude'])
+        lng = float(fix['longitude'])
+    except KeyError as e:
+        raise FixError(f"Missing field {e.args[0]!r}")
+    except (TypeError, ValueError):
+        raise FixError("Coordinates must be numbers")
+
+    if not -90 <= lat <= 90 or not -180 <= lng <= 180:
+        raise FixError("Coordinates out of range")
+    return lat, lng
+
+
+def _bus_id(fix):
+    """The fix's bus id as stored (a string), or None if it can't be one."""
+    bus_id = fix.get('bus_id') if isinstance(fix, dict) else None
+    if isinstance(bus_id, int) and not isinstance(bus_id, bool):
+        return str(bus_id)
+    return bus_id if isinstance(bus_id, str) else None
+
+
+def ingest_fixes(fixes):
+    """
+    Store a batch of fixes for any number of buses.
+
+    Bus ids are resolved with a single query and the valid rows are written
+    with ``bulk_create``. Returns ``(created, errors)`` where ``errors`` is a
+    list of ``{"index": i, "error": message}`` for the rejected rows.
+    """
+    bus_ids = {_bus_id(fix) for fix in fixes}
+    buses = {bus.bus_id: bus for bus in Bus.objects.filter(bus_id__in=bus_ids - {None})}
+
+    rows, errors = [], []
+    for index, fix in enumerate(fixes):
+        try:
+            if not isinstance(fix, dict):
+                raise FixError("Fix must be a JSON object")
+            if fix.get('bus_id') is not None and _bus_id(fix) is None:
+                raise FixError("bus_id must be a string")
+            bus = buses.get(_bus_id(fix))
+            if bus is None:
+                raise FixError(f"Unknown bus {fix.get('bus_id')!r}")
+            lat, lng = _coordinates(fix)
+        except FixError as e:
+            errors.append({'index': index, 'error': str(e)})
+            continue
+        rows.append(Location(bus=bus, latitude=lat, longitude=lng))
+
+    with transaction.atomic(savepoint=False):
+        created = Location.objects.bulk_create(rows, batch_size=INGEST_BATCH_SIZE)
+        update_latest(created)
+    return created, errors
+
+
+def update_latest(locations):
+    """
+    Upsert the latest-position row of every bus in ``locations``.
+
+    ``locations`` are Location/BusLocation-like objects; the newest one per
+    bus is written, in a single statement, unless the stored position is
+    newer still (a late or replayed fix).
+    """
+    latest, positions = {}, {}
+    for loc in locations:
+        timestamp = getattr(loc, 'timestamp', None) or loc.updated_at
+        if loc.bus_id in latest and timestamp < latest[loc.bus_id].timestamp:
+            continue
+        latest[loc.bus_id] = LatestLocation(
+            bus_id=loc.bus_id,
+            latitude=loc.latitude,
+            longitude=loc.longitude,
+            timestamp=timestamp,
+        )
+        positions[loc.bus_id] = {'id': loc.bus.bus_id, 'lat': float(loc.latitude), 'lng': float(loc.longitude)}
+    if latest:
+        version = next_fleet_version()
+        for row in latest.values():
+            row.version = version
+        written = _upsert_latest(list(latest.values()))
+        if written is not None:
+            positions = {bus_id: position for bus_id, position in positions.items() if bus_id in written}
+        # Streaming clients only hear about positions that were committed
+        transaction.on_commit(lambda: position_broker.publish(list(positions.values())))
+
+
+def _upsert_latest(rows):
+    """
+    INSERT ... ON CONFLICT DO UPDATE of LatestLocation rows that leaves a
+    stored position alone when it is newer than the row. Returns the ids of
+    the buses written, or None where the backend can't say which.
+    """
+    if not connection.features.supports_update_conflicts_with_target:
+        # No conditional upsert here: stale rows were at least dropped within the batch
+        LatestLocation.objects.bulk_create(
+            rows, update_conflicts=True, unique_fields=['bus'],
+            update_fields=['latitude', 'longitude', 'timestamp', 'version'],
+        )
+        return None
+
+    qn = connection.ops.quote_name
+    table = qn(LatestLocation._meta.db_table)
+    bus, latitude, longitude, timestamp, version = [
+        qn(LatestLocation._meta.get_field(name).column)
+        for name in ('bus', 'latitude', 'longitude', 'timestamp', 'version')
+    ]
+    updated = (latitude, longitude, timestamp, version)
+    returning = connection.features.can_return_columns_from_insert
+    written = set()
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), INGEST_BATCH_SIZE):
+            batch = rows[start:start + INGEST_BATCH_SIZE]
+            cursor.execute(
+                f"INSERT INTO {table} ({bus}, {', '.join(updated)}) "
+                f"VALUES {', '.join(['(%s, %s, %s, %s, %s)'] * len(batch))} "
+                f"ON CONFLICT ({bus}) DO UPDATE SET {', '.join(f'{column} = excluded.{column}' for column in updated)} "
+                f"WHERE excluded.{timestamp} >= {table}.{timestamp}"
+                + (f" RETURNING {bus}" if returning else ""),
+                [
+                    value
+                    for row in batch
+                    for value in (row.bus_id, row.latitude, row.longitude,
+                                  connection.ops.adapt_datetimefield_value(row.timestamp), row.version)
+                ],
+            )
+            if returning:
+                written.update(bus_id for bus_id, in cursor.fetchall())
+    return written if returning else None
+
+
+# Fleet versions are microseconds since the epoch at the time of the write,
+# so concurrent writers share no counter row and never wait on each other.
+# A write can commit after one stamped later; clients are therefore handed a
+# version that trails the clock by FLEET_VERSION_LAG, and resuming from it
+# resends the last few seconds of writes rather than skip a late commit.
+_last_version = 0
+_version_lock = threading.Lock()
+
+
+def next_fleet_version():
+    """Version for a position write: the clock, above any this process handed out."""
+    global _last_version
+    with _version_lock:
+        _last_version = max(_last_version + 1, time.time_ns() // 1000)
+        return _last_version
+
+
+def latest_fleet_version():
+    """Version of the newest committed position write (one index lookup)."""
+    return LatestLocation.objects.aggregate(version=Max('version'))['version'] or 0
+
+
+def current_fleet_version():
+    """
+    Version to resume from with ``since``: the newest write's, but no later
+    than FLEET_VERSION_LAG ago, where a write stamped earlier may still commit.
+    """
+    lag = getattr(settings, 'FLEET_VERSION_LAG', FLEET_VERSION_LAG)
+    return min(latest_fleet_version(), time.time_ns() // 1000 - int(lag * 1_000_000))
+
+
+def fleet_snapshot(bus_id=None, since=None):
+    """
+    Latest position of every bus that has reported one, in one query.
+    With ``since``, only buses written after that fleet version.
+    """
+    rows = LatestLocation.objects.values_list('bus__bus_id', 'latitude', 'longitude')
+    if bus_id is not None:
+        rows = rows.filter(bus__bus_id=bus_id)
+    if since is not None:
+        rows = rows.filter(version__gt=since)
+    return [{'id': bus_id, 'lat': lat, 'lng': lng} for bus_id, lat, lng in rows]
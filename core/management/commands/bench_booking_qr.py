@@ -0,0 +1,54 @@
+import statistics
+import tempfile
+import time
+from io import BytesIO
+
+import qrcode
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+
+from core.qr import render_qr
+
+
+class Command(BaseCommand):
+    help = "Compare QR generation of the old booking_confirmation path with the memoised renderer (no database needed)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bookings', type=int, default=200)
+        parser.add_argument('--views', type=int, default=3, help="Page views per booking")
+
+    def handle(self, *args, **options):
+        bookings = [str(100000 + i) for i in range(options['bookings'])]
+
+        # Old path: a PNG drawn with Pillow and written to media storage on the first view
+        with tempfile.TemporaryDirectory() as media:
+            storage = FileSystemStorage(location=media)
+            legacy = []
+            for payload in bookings:
+                start = time.perf_counter()
+                buffer = BytesIO()
+                qrcode.make(payload).save(buffer)
+                buffer.seek(0)
+                storage.save(f'booking_{payload}_qr.png', File(buffer))
+                legacy.append((time.perf_counter() - start) * 1000)
+        self.report("legacy png + storage", legacy)
+
+        render_qr.cache_clear()
+        for fmt in ('svg', 'png'):
+            cold, warm = [], []
+            for payload in bookings:
+                for view in range(options['views']):
+                    start = time.perf_counter()
+                    render_qr(payload, fmt)
+                    (warm if view else cold).append((time.perf_counter() - start) * 1000)
+            self.report(f"{fmt} first view", cold)
+            if warm:
+                self.report(f"{fmt} repeat view", warm)
+
+    def report(self, label, latencies):
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        self.stdout.write(
+            f"{label}: p50 {statistics.median(latencies):.3f} ms, p99 {p99:.3f} ms over {len(latencies)}"
+        )
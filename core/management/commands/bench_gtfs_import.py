@@ -0,0 +1,88 @@
+import csv
+import os
+import random
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.gtfs import export_feed, format_time, import_feed
+from core.signals import invalidate_network_caches
+
+
+class Command(BaseCommand):
+    help = (
+        "Time a GTFS import of a synthetic city-scale feed (and an export of the result). "
+        "Runs inside a transaction that is rolled back, so the database is left as it was."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stops', type=int, default=5000)
+        parser.add_argument('--routes', type=int, default=500)
+        parser.add_argument('--trips-per-route', type=int, default=60)
+        parser.add_argument('--stops-per-trip', type=int, default=35)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as feed, tempfile.TemporaryDirectory() as out:
+            stop_times = self.write_feed(feed, options)
+            with transaction.atomic():
+                start = time.perf_counter()
+                counts = import_feed(feed)
+                imported = time.perf_counter() - start
+                start = time.perf_counter()
+                written = export_feed(out)
+                exported = time.perf_counter() - start
+                transaction.set_rollback(True)
+            invalidate_network_caches()
+
+        self.stdout.write(", ".join(f"{name}: {count}" for name, count in counts.items()))
+        self.stdout.write(
+            f"imported {stop_times} stop_times in {imported:.1f}s ({stop_times / imported:.0f}/s); "
+            f"exported {written['stop_times.txt']} in {exported:.1f}s"
+        )
+
+    def write_feed(self, directory, options):
+        rng = random.Random(options['seed'])
+        n_stops = options['stops']
+
+        def write(name, header, rows):
+            with open(os.path.join(directory, name), 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(header)
+                writer.writerows(rows)
+
+        write('stops.txt', ['stop_id', 'stop_name', 'stop_lat', 'stop_lon'], (
+            [f'S{n}', f'Bench Stop {n}', 19 + rng.random() / 5, 73 + rng.random() / 5] for n in range(n_stops)
+        ))
+        write('routes.txt', ['route_id', 'route_short_name', 'route_type'], (
+            [f'R{n}', f'B{n}', 3] for n in range(options['routes'])
+        ))
+
+        patterns = []
+        for _ in range(options['routes']):
+            stop = rng.randrange(n_stops)
+            pattern = []
+            while len(pattern) < options['stops_per_trip']:
+                if stop not in pattern:
+                    pattern.append(stop)
+                stop = (stop + rng.randint(-50, 50)) % n_stops
+            patterns.append(pattern)
+        trips = [
+            (f'T{route}_{n}', route, 5 * 3600 + n * 900)
+            for route in range(options['routes']) for n in range(options['trips_per_route'])
+        ]
+        write('trips.txt', ['route_id', 'service_id', 'trip_id', 'block_id'], (
+            [f'R{route}', 'WEEK', trip_id, f'BB{route % 9999}'] for trip_id, route, _ in trips
+        ))
+        count = 0
+        with open(os.path.join(directory, 'stop_times.txt'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence'])
+            for trip_id, route, departure in trips:
+                for sequence, stop in enumerate(patterns[route]):
+                    at = format_time(departure + sequence * 120)
+                    writer.writerow([trip_id, at, at, f'S{stop}', sequence + 1])
+                    count += 1
+        return count
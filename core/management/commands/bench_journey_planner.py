@@ -0,0 +1,58 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.journey import RouteTimetable, Timetable
+
+
+class Command(BaseCommand):
+    help = "Measure journey planner latency on a synthetic network (no database needed)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--routes', type=int, default=300)
+        parser.add_argument('--stops', type=int, default=1000)
+        parser.add_argument('--stops-per-route', type=int, default=30)
+        parser.add_argument('--headway', type=int, default=15, help="Minutes between trips on a route")
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--max-transfers', type=int, default=2)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        n_stops = options['stops']
+
+        # Routes wander between neighbouring stop ids so that they overlap and allow transfers
+        routes = []
+        for route_id in range(options['routes']):
+            stop = rng.randrange(n_stops)
+            stops = []
+            while len(stops) < options['stops_per_route']:
+                if stop not in stops:
+                    stops.append(stop)
+                stop = (stop + rng.randint(-40, 40)) % n_stops
+            offsets = [i * rng.randint(90, 180) for i in range(len(stops))]
+            first = rng.randint(5 * 3600, 6 * 3600)
+            trips = [(t, None) for t in range(first, 23 * 3600, options['headway'] * 60)]
+            routes.append(RouteTimetable(route_id, str(route_id), stops, offsets, trips))
+
+        start = time.perf_counter()
+        network = Timetable({stop: f"Stop {stop}" for stop in range(n_stops)}, routes)
+        self.stdout.write(f"built timetable in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        latencies, found = [], 0
+        for _ in range(options['queries']):
+            origin, destination = rng.randrange(n_stops), rng.randrange(n_stops)
+            depart = rng.randint(6 * 3600, 20 * 3600)
+            start = time.perf_counter()
+            journeys = network.plan([origin], [destination], depart, options['max_transfers'])
+            latencies.append((time.perf_counter() - start) * 1000)
+            found += bool(journeys)
+
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        self.stdout.write(
+            f"{len(latencies)} queries, {found} with a journey: "
+            f"p50 {statistics.median(latencies):.2f} ms, p99 {p99:.2f} ms, max {latencies[-1]:.2f} ms"
+        )
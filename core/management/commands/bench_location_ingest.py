@@ -0,0 +1,53 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from core.models import Bus
+from core.views import update_location, update_locations_bulk
+
+
+class Command(BaseCommand):
+    help = "Compare fixes/sec of the single-fix and bulk GPS ingest endpoints."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buses', type=int, default=50)
+        parser.add_argument('--fixes', type=int, default=2000)
+        parser.add_argument('--batch', type=int, default=500, help="Fixes per bulk request")
+
+    def handle(self, *args, **options):
+        factory = RequestFactory()
+        buses = [
+            Bus.objects.create(bus_id=f"BENCH{i:04d}", category='Bench', capacity=40)
+            for i in range(options['buses'])
+        ]
+        fixes = [
+            {
+                'bus_id': random.choice(buses).bus_id,
+                'latitude': 19.0 + random.random(),
+                'longitude': 73.0 + random.random(),
+            }
+            for _ in range(options['fixes'])
+        ]
+
+        try:
+            start = time.perf_counter()
+            for fix in fixes:
+                request = factory.post('/api/update-location/', json.dumps(fix), content_type='application/json')
+                update_location(request)
+            single = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for i in range(0, len(fixes), options['batch']):
+                body = "\n".join(json.dumps(fix) for fix in fixes[i:i + options['batch']])
+                request = factory.post('/api/update-location/bulk/', body, content_type='application/x-ndjson')
+                update_locations_bulk(request)
+            bulk = time.perf_counter() - start
+        finally:
+            Bus.objects.filter(pk__in=[bus.pk for bus in buses]).delete()
+
+        self.stdout.write(f"single endpoint: {len(fixes) / single:10.0f} fixes/sec ({single:.2f}s)")
+        self.stdout.write(f"bulk endpoint:   {len(fixes) / bulk:10.0f} fixes/sec ({bulk:.2f}s)")
+        self.stdout.write(self.style.SUCCESS(f"speedup: {single / bulk:.1f}x"))
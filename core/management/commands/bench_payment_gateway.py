@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.payment_stub import StubGateway
+from core.payments import Gateway, GatewayError
+
+
+class Command(BaseCommand):
+    help = (
+        "Create orders against a local stub gateway with added latency and failures: "
+        "concurrently through the async path, then one at a time as a sync worker would."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=100)
+        parser.add_argument('--latency', type=float, default=0.2, help="Seconds the stub takes per response")
+        parser.add_argument('--failure-rate', type=float, default=0.05)
+        parser.add_argument('--pool-size', type=int, default=20)
+
+    def handle(self, *args, **options):
+        stub = StubGateway(latency=options['latency'], failure_rate=options['failure_rate']).start()
+        gateway = Gateway('bench', 'bench', base_url=stub.url, backoff=0.05, pool_size=options['pool_size'])
+        try:
+            async def one():
+                try:
+                    await gateway.acreate_order(1000)
+                    return True
+                except GatewayError:
+                    return False
+
+            async def run():
+                return await asyncio.gather(*(one() for _ in range(options['orders'])))
+
+            start = time.perf_counter()
+            results = asyncio.run(run())
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"async: {sum(results)}/{len(results)} orders in {elapsed:.2f}s "
+                f"({len(results) / elapsed:.0f}/s) over {stub.connections} connections, {stub.requests} requests"
+            )
+
+            sample = max(1, options['orders'] // 10)
+            start = time.perf_counter()
+            for _ in range(sample):
+                try:
+                    gateway.create_order(1000)
+                except GatewayError:
+                    pass
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"sync: {sample} orders in {elapsed:.2f}s ({sample / elapsed:.1f}/s per worker)")
+        finally:
+            gateway.executor.shutdown()
+            stub.stop()
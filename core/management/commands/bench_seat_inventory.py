@@ -0,0 +1,80 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.inventory import SoldOut, confirm_hold, hold_seats
+from core.models import Bus, Route, Schedule, SeatHold
+from core.service import trip_for
+
+
+class Command(BaseCommand):
+    help = (
+        "Hammer one departure with concurrent hold + confirm bookings and check "
+        "that no seat is sold twice. Writes to the configured database and cleans up."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seats', type=int, default=500)
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--per-booking', type=int, default=1)
+
+    def handle(self, *args, **options):
+        bus = Bus.objects.create(bus_id='BENCHSEAT', category='Bench', capacity=options['seats'])
+        route = Route.objects.create(route_no='BENCH', source='A', destination='B', distance=1)
+        schedule = Schedule.objects.create(bus=bus, route=route, departure_time='00:00',
+                                           available_seats=options['seats'])
+        trip = trip_for(schedule.id)
+        sold, rejected, errors = [], [], []
+        lock = threading.Lock()
+
+        def buyer(n):
+            try:
+                i = 0
+                while True:
+                    try:
+                        hold = hold_seats(trip.id, options['per_booking'])
+                    except SoldOut:
+                        with lock:
+                            rejected.append(n)
+                        return
+                    i += 1
+                    hold.order_id = f"bench_{n}_{i}"
+                    hold.save(update_fields=['order_id'])
+                    confirm_hold(hold.order_id)
+                    with lock:
+                        sold.append(options['per_booking'])
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+            finally:
+                connection.close()
+
+        try:
+            threads = [threading.Thread(target=buyer, args=(n,)) for n in range(options['threads'])]
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - start
+
+            trip.refresh_from_db()
+            confirmed = sum(SeatHold.objects.filter(trip=trip, status=SeatHold.CONFIRMED)
+                            .values_list('seats', flat=True))
+        finally:
+            bus.delete()
+            route.delete()
+
+        oversold = sum(sold) - options['seats']
+        self.stdout.write(
+            f"{len(sold)} bookings ({sum(sold)} seats) by {options['threads']} threads in {elapsed:.2f}s: "
+            f"{len(sold) / elapsed:.0f} bookings/sec; seats left {trip.available_seats}"
+        )
+        if errors:
+            self.stderr.write(f"{len(errors)} threads failed, first error: {errors[0]!r}")
+        if oversold > 0 or trip.available_seats < 0 or confirmed != sum(sold):
+            self.stderr.write(self.style.ERROR(f"OVERSOLD by {max(oversold, -trip.available_seats)} seats"))
+        else:
+            self.stdout.write(self.style.SUCCESS("No oversells."))
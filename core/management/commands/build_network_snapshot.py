@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from core.snapshot import NetworkSnapshot, network_snapshot, snapshot_root
+
+
+class Command(BaseCommand):
+    help = (
+        "Compile routes, stops and schedules into a gzipped, content-hashed network "
+        "snapshot file. The site also rebuilds it by itself after network changes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="Directory to write to (default: NETWORK_SNAPSHOT_ROOT or MEDIA_ROOT/network)")
+
+    def handle(self, *args, **options):
+        snapshot = NetworkSnapshot.build()
+        path = snapshot.write(options['output'] or snapshot_root())
+        network_snapshot.invalidate()
+        self.stdout.write(
+            f"{path}: {len(snapshot.body)} bytes of JSON, {len(snapshot.gzipped)} gzipped (digest {snapshot.digest})"
+        )
@@ -0,0 +1,85 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import Bus, Location, LocationTrack
+from core.retention import TRIP_GAP, downsample, encode_track, simplify, split_trips
+
+
+def read_fixes(queryset, batch):
+    """
+    ``(timestamp, lat, lng)`` of the fixes in time order, read ``batch`` at a
+    time by keyset, so no cursor is held open across the per-trip commits.
+    """
+    after = None
+    while True:
+        chunk = queryset.order_by('timestamp', 'id')
+        if after:
+            chunk = chunk.filter(Q(timestamp__gt=after[0]) | Q(timestamp=after[0], id__gt=after[1]))
+        rows = list(chunk.values_list('timestamp', 'id', 'latitude', 'longitude')[:batch])
+        for timestamp, _, lat, lng in rows:
+            yield timestamp, lat, lng
+        if len(rows) < batch:
+            return
+        after = rows[-1][:2]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compact raw GPS fixes older than the retention window into per-trip "
+        "LocationTrack rows, deleting each trip's raw rows as its track is written."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help="Days of raw fixes to keep")
+        parser.add_argument('--interval', type=int, default=30, help="Keep at most one point per N seconds")
+        parser.add_argument('--tolerance', type=float, default=5.0,
+                            help="Douglas-Peucker tolerance in metres (0 disables)")
+        parser.add_argument('--gap', type=int, default=TRIP_GAP, help="Seconds of silence that end a trip")
+        parser.add_argument('--batch', type=int, default=5000, help="Rows per read chunk")
+        parser.add_argument('--dry-run', action='store_true', help="Report what would happen, change nothing")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        batch = options['batch']
+        read = kept = tracks = deleted = 0
+        start = time.perf_counter()
+
+        bus_ids = Location.objects.filter(timestamp__lt=cutoff).values_list('bus_id', flat=True).distinct()
+        for bus in Bus.objects.filter(id__in=list(bus_ids)):
+            old = Location.objects.filter(bus=bus, timestamp__lt=cutoff)
+            trips = 0
+            for trip in split_trips(read_fixes(old, batch), options['gap']):
+                read += len(trip)
+                points = simplify(downsample(trip, options['interval']), options['tolerance'])
+                kept += len(points)
+                trips += 1
+                if options['dry_run']:
+                    continue
+
+                # One short transaction per trip: an interrupted run leaves
+                # every trip either compacted or untouched, and resumes.
+                with transaction.atomic():
+                    LocationTrack.objects.create(
+                        bus=bus,
+                        started_at=trip[0][0],
+                        ended_at=trip[-1][0],
+                        points=encode_track(points),
+                        raw_count=len(trip),
+                    )
+                    deleted += old.filter(timestamp__range=(trip[0][0], trip[-1][0])).delete()[0]
+            tracks += trips
+            self.stdout.write(f"{bus.bus_id}: {trips} trips")
+
+        elapsed = time.perf_counter() - start
+        ratio = read / kept if kept else 0
+        self.stdout.write(
+            f"read {read} fixes, kept {kept} points in {tracks} tracks ({ratio:.1f}x smaller), "
+            f"deleted {deleted} rows in {elapsed:.2f}s ({read / elapsed if elapsed else 0:.0f} fixes/sec)"
+        )
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING("Dry run: nothing was written or deleted."))
@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.service import TRIP_HORIZON_DAYS, expand_trips, prune_trips
+
+
+class Command(BaseCommand):
+    help = (
+        "Materialize the dated trips, with their stop times, of the coming days and "
+        "delete old unsold ones. Run nightly from cron; re-running is harmless."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=TRIP_HORIZON_DAYS, help="Service dates to expand, from today")
+        parser.add_argument('--keep-days', type=int, default=2, help="Days of past trips to keep")
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        created = expand_trips(today, today + timedelta(days=max(options['days'], 1) - 1))
+        # Yesterday's trips may still be running, so keep at least one past day
+        pruned = prune_trips(today - timedelta(days=max(options['keep_days'], 1)))
+        self.stdout.write(self.style.SUCCESS(f"Created {created} trips, pruned {pruned}."))
@@ -0,0 +1,183 @@
+import random
+import re
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.functions import Upper
+from django.utils import timezone
+
+from conductor_service.analytics import METRICS, counted_bookings
+from conductor_service.feeds import booking_feed
+from conductor_service.models import ConductorProfile, DailyReport
+from core.eta import SPEED_WINDOW
+from core.history import HISTORY_FIELDS
+from core.models import Booking, Bus, BusStop, Location, Route, RouteStop, StopDeparture
+from core.pagination import encode_cursor, keyset_filter
+
+# Plan lines that read a whole table: PostgreSQL's Seq Scan, SQLite's SCAN without an index
+FULL_SCAN = re.compile(r'Seq Scan on (\w+)|\bSCAN (\w+)(?! USING)(?!\w)')
+
+
+def hot_queries(sample):
+    """(name, queryset) of the queries behind the busiest views, with parameters taken from ``sample``."""
+    now = timezone.now()
+    today = timezone.localdate()
+    cursor = encode_cursor(sample['booking_time'], sample['id'])
+    return [
+        ('eta speed window', Location.objects.filter(
+            bus_id__in=sample['bus_ids'], timestamp__gte=now - timedelta(seconds=SPEED_WINDOW),
+        ).order_by('bus_id', 'timestamp').values_list('bus_id', 'timestamp', 'latitude', 'longitude')),
+        ('location retention sweep', Location.objects.filter(
+            timestamp__lt=now - timedelta(days=1),
+        ).values_list('bus_id', flat=True).distinct()),
+        ('booking history page', keyset_filter(
+            Booking.objects.filter(user_id=sample['user_id']).values(*HISTORY_FIELDS), None, 'booking_time', True,
+        )[:21]),
+        ('booking history next page', keyset_filter(
+            Booking.objects.filter(user_id=sample['user_id']).values(*HISTORY_FIELDS), cursor, 'booking_time', True,
+        )[:21]),
+        ('recent bookings', Booking.objects.filter(user_id=sample['user_id']).order_by('-booking_time')[:3]),
+        ('conductor feed', keyset_filter(booking_feed(today), None, 'counted_at')[:51]),
+        ('conductor feed of one conductor', keyset_filter(
+            booking_feed(today, conductor_id=sample['conductor_id']), None, 'counted_at',
+        )[:51]),
+        ('analysis by route (raw bookings)', counted_bookings(today - timedelta(days=6), today).values(
+            'route').annotate(**METRICS).order_by('route')),
+        ('analysis by route (rollups)', DailyReport.objects.filter(
+            date__range=(today - timedelta(days=6), today),
+        ).values('route').order_by('route')),
+        ('route stops', RouteStop.objects.filter(route__route_no=sample['route_no']).select_related('bus_stop')),
+        ('stop by name', BusStop.objects.annotate(upper_name=Upper('name')).filter(
+            upper_name=sample['stop_name'].upper(),
+        )),
+        ('next departures from a stop', StopDeparture.objects.filter(
+            service_date__in=[today - timedelta(days=1), today], stop_id__in=[sample['stop_id']], departs_at__gte=now,
+        ).order_by('departs_at').values_list('trip_id', 'departs_at', 'trip__available_seats')),
+    ]
+
+
+def _scatter(queryset, field, now, seconds, rng, groups=1000):
+    """
+    Set ``field`` of the rows to random times in the last ``seconds``. Rows
+    share one of ``groups`` times so it takes ``groups`` UPDATEs, not one per row.
+    """
+    ids = list(queryset.values_list('id', flat=True))
+    rng.shuffle(ids)
+    for n in range(groups):
+        when = now - timedelta(seconds=rng.randrange(seconds))
+        queryset.model.objects.filter(id__in=ids[n::groups]).update(**{field: when})
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAIN and time the queries of the hot views. By default seeds a synthetic "
+        "dataset first and rolls it back afterwards; --no-seed uses the existing data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-seed', action='store_true', help="Explain against the data already there")
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--bookings', type=int, default=50000)
+        parser.add_argument('--buses', type=int, default=100)
+        parser.add_argument('--fixes', type=int, default=100000, help="Location rows")
+        parser.add_argument('--repeat', type=int, default=20, help="Timed runs per query")
+        parser.add_argument('--analyze', action='store_true', help="EXPLAIN ANALYZE (PostgreSQL only)")
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if not options['no_seed']:
+                self.seed(options)
+            # Fresh statistics, so the planner sees the seeded row counts
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            sample = self.sample()
+            if sample is None:
+                self.stderr.write("No bookings to sample parameters from; run without --no-seed")
+            else:
+                self.report(hot_queries(sample), options)
+            transaction.set_rollback(not options['no_seed'])
+
+    def seed(self, options):
+        rng = random.Random(options['seed'])
+        now = timezone.now()
+        start = time.perf_counter()
+        buses = Bus.objects.bulk_create([
+            Bus(bus_id=f'EXPL{n}', category='AC', capacity=40) for n in range(options['buses'])
+        ])
+        routes = Route.objects.bulk_create([
+            Route(route_no=f'E{n}', source='A', destination='B', distance=10) for n in range(50)
+        ])
+        stops = BusStop.objects.bulk_create([
+            BusStop(name=f'Explain Stop {n}', latitude=19 + n / 1000, longitude=73) for n in range(1000)
+        ])
+        RouteStop.objects.bulk_create([
+            RouteStop(route=route, bus_stop=stop, stop_order=order, distance_from_start=order)
+            for route in routes for order, stop in enumerate(rng.sample(stops, 30))
+        ])
+        users = User.objects.bulk_create([User(username=f'explain{n}') for n in range(options['users'])])
+        # Most bookings are online and unscanned, as in production: the counted ones are a minority
+        Booking.objects.bulk_create([
+            Booking(
+                user=rng.choice(users), route=rng.choice(routes).route_no, seats=1, fare=10,
+                created_by_conductor=(kind := rng.random()) < 0.1, created_online=kind >= 0.1,
+                verified_by_conductor=0.1 <= kind < 0.2,
+            )
+            for _ in range(options['bookings'])
+        ], batch_size=2000)
+        # booking_time is auto_now_add; scatter it over the last 60 days
+        _scatter(Booking.objects.filter(user__in=users), 'booking_time', now, 60 * 86400, rng)
+        Booking.objects.filter(user__in=users).update(counted_at=F('booking_time'))
+        Location.objects.bulk_create([
+            Location(bus=rng.choice(buses), latitude=19, longitude=73) for _ in range(options['fixes'])
+        ], batch_size=2000)
+        _scatter(Location.objects.filter(bus__in=buses), 'timestamp', now, 3 * 86400, rng)
+        self.stdout.write(f"seeded in {time.perf_counter() - start:.1f}s")
+
+    def sample(self):
+        latest = Booking.objects.order_by('-id').values('user_id').first()
+        if latest is None:
+            return None
+        # A row a few entries into the rider's history, as the cursor of a second page
+        history = Booking.objects.filter(user_id=latest['user_id']).order_by('-booking_time', '-id')
+        page_end = (list(history.values('id', 'booking_time')[10:11]) or list(history.values('id', 'booking_time')[:1]))[0]
+        return {
+            'id': page_end['id'],
+            'booking_time': page_end['booking_time'],
+            'user_id': latest['user_id'],
+            'bus_ids': list(Bus.objects.values_list('id', flat=True)[:20]),
+            'conductor_id': ConductorProfile.objects.values_list('id', flat=True).first() or 0,
+            'route_no': Route.objects.values_list('route_no', flat=True).first() or '',
+            'stop_name': BusStop.objects.values_list('name', flat=True).first() or '',
+            'stop_id': BusStop.objects.values_list('id', flat=True).first() or 0,
+        }
+
+    def report(self, queries, options):
+        explain_options = {'analyze': True} if options['analyze'] and connection.vendor == 'postgresql' else {}
+        flagged = []
+        for name, queryset in queries:
+            plan = queryset.explain(**explain_options)
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - start) * 1000)
+            scans = sorted({a or b for a, b in FULL_SCAN.findall(plan)})
+            if scans:
+                flagged.append((name, scans))
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{name}: median {statistics.median(timings):.2f} ms, max {max(timings):.2f} ms"
+            ))
+            self.stdout.write(plan)
+            self.stdout.write("")
+
+        if flagged:
+            for name, tables in flagged:
+                self.stdout.write(self.style.WARNING(f"{name}: full scan of {', '.join(tables)}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Every hot query is served by an index."))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.gtfs import DEFAULT_CAPACITY, DEFAULT_CATEGORY, GTFSError, export_feed, import_feed
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a GTFS feed (directory or zip) into stops, routes, route stops and "
+        "schedules, or export the network as one. See core/gtfs.py for the mapping."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['import', 'export'])
+        parser.add_argument('path', help="Feed directory or zip to import; directory to export to")
+        parser.add_argument('--capacity', type=int, default=DEFAULT_CAPACITY, help="Seats of buses the import creates")
+        parser.add_argument('--category', default=DEFAULT_CATEGORY, help="Category of buses the import creates")
+
+    def handle(self, *args, **options):
+        try:
+            if options['action'] == 'import':
+                counts = import_feed(options['path'], options['capacity'], options['category'])
+            else:
+                counts = export_feed(options['path'])
+        except (GTFSError, OSError, ValueError) as exc:
+            raise CommandError(str(exc)) from exc
+        self.stdout.write(", ".join(f"{name}: {count}" for name, count in counts.items()))
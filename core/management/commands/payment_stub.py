@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from core.payment_stub import StubGateway
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a local stand-in for the Razorpay orders API. Set PAYMENT_GATEWAY_URL "
+        "to the printed address to send create_order there."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response")
+        parser.add_argument('--failure-rate', type=float, default=0.0, help="Share of requests answered with a 500")
+
+    def handle(self, *args, **options):
+        server = StubGateway(('127.0.0.1', options['port']), options['latency'], options['failure_rate'])
+        self.stdout.write(f"Stub gateway on {server.url} (Ctrl-C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Served {server.requests} requests on {server.connections} connections")
@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.orders import RECONCILE_BATCH, reconcile
+from core.payments import GatewayError, get_gateway
+
+
+class Command(BaseCommand):
+    help = (
+        "Book captured gateway payments that payment_success never recorded. "
+        "Run every few minutes from cron; payments already booked are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24, help="How far back to fetch payments")
+        parser.add_argument('--batch', type=int, default=RECONCILE_BATCH, help="Payments matched per query")
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(hours=options['hours'])
+        try:
+            counts, unbooked = reconcile(get_gateway().captured_payments(since), options['batch'])
+        except GatewayError as e:
+            raise CommandError(str(e))
+        self.stdout.write(", ".join(f"{name}: {count}" for name, count in counts.items()))
+        for order_id in unbooked:
+            self.stderr.write(self.style.WARNING(f"{order_id} was paid but could not be booked: refund it"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.inventory import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = "Return the seats of expired, unpaid seat holds. Run every few minutes from cron."
+
+    def handle(self, *args, **options):
+        freed = release_expired_holds()
+        self.stdout.write(self.style.SUCCESS(f"Released {freed} seats from expired holds."))
@@ -0,0 +1,52 @@
+"""
+Schema operations that leave busy tables writable while they run.
+
+On PostgreSQL indexes are built with CREATE INDEX CONCURRENTLY and dropped
+with DROP INDEX CONCURRENTLY, so location ingest and bookings carry on
+during the build instead of waiting on the table lock. Neither can run in
+a transaction: migrations using these operations set ``atomic = False``.
+Other databases, as used in development and tests, get the plain
+operations.
+"""
+from django.db import migrations
+
+
+def _postgres(schema_editor):
+    return schema_editor.connection.vendor == 'postgresql'
+
+
+class AddIndexConcurrently(migrations.AddIndex):
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if not _postgres(schema_editor):
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        from django.contrib.postgres.operations import AddIndexConcurrently
+        AddIndexConcurrently(self.model_name, self.index).database_forwards(
+            app_label, schema_editor, from_state, to_state
+        )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if not _postgres(schema_editor):
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        from django.contrib.postgres.operations import AddIndexConcurrently
+        AddIndexConcurrently(self.model_name, self.index).database_backwards(
+            app_label, schema_editor, from_state, to_state
+        )
+
+
+class DropFieldIndexConcurrently(migrations.AlterField):
+    """An AlterField that only turns ``db_index`` off: drops the field's own index concurrently."""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not _postgres(schema_editor):
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        column = model._meta.get_field(self.name).column
+        declared = {index.name for index in model._meta.indexes}
+        with schema_editor.connection.cursor() as cursor:
+            constraints = schema_editor.connection.introspection.get_constraints(cursor, model._meta.db_table)
+        for name, info in constraints.items():
+            if (info['index'] and info['columns'] == [column] and name not in declared
+                    and not info['unique'] and not info['primary_key']):
+                schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {schema_editor.quote_name(name)}")
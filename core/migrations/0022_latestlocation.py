@@ -0,0 +1,46 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_latest_locations(apps, schema_editor):
+    Bus = apps.get_model('core', 'Bus')
+    Location = apps.get_model('core', 'Location')
+    LatestLocation = apps.get_model('core', 'LatestLocation')
+    by_newest = Location.objects.order_by('bus_id', '-timestamp', '-id')
+    if schema_editor.connection.features.can_distinct_on_fields:
+        # One sorted pass: DISTINCT ON (bus_id) keeps each bus's newest fix
+        rows = by_newest.distinct('bus_id').iterator()
+    else:
+        # One indexed lookup per bus, never a subquery per Location row
+        rows = filter(None, (
+            by_newest.filter(bus_id=bus_id).first()
+            for bus_id in Bus.objects.values_list('id', flat=True).iterator()
+        ))
+    LatestLocation.objects.bulk_create(
+        [
+            LatestLocation(bus_id=loc.bus_id, latitude=loc.latitude, longitude=loc.longitude, timestamp=loc.timestamp)
+            for loc in rows
+        ],
+        batch_size=1000,
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_alter_booking_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestLocation',
+            fields=[
+                ('bus', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='latest_location', serialize=False, to='core.bus')),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('timestamp', models.DateTimeField()),
+            ],
+        ),
+        migrations.RunPython(backfill_latest_locations, migrations.RunPython.noop),
+    ]
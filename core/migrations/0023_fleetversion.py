@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:57
+
+from django.db import migrations, models
+
+
+def create_fleet_version(apps, schema_editor):
+    FleetVersion = apps.get_model('core', 'FleetVersion')
+    LatestLocation = apps.get_model('core', 'LatestLocation')
+    FleetVersion.objects.create(pk=1, value=1)
+    LatestLocation.objects.update(version=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_latestlocation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FleetVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='latestlocation',
+            name='version',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(create_fleet_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_fleetversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationTrack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('ended_at', models.DateTimeField()),
+                ('points', models.JSONField()),
+                ('raw_count', models.PositiveIntegerField()),
+                ('bus', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tracks', to='core.bus')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bus', 'started_at'], name='core_locati_bus_id_5334b1_idx')],
+            },
+        ),
+    ]
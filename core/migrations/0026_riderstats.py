@@ -0,0 +1,50 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_rider_stats(apps, schema_editor):
+    Booking = apps.get_model('core', 'Booking')
+    RiderStats = apps.get_model('core', 'RiderStats')
+    totals = Booking.objects.values('user_id').annotate(
+        trips=models.Count('id'),
+        seats=models.Sum('seats'),
+        spend=models.Sum('fare'),
+        first_booking=models.Min('booking_time'),
+        last_booking=models.Max('booking_time'),
+    ).order_by()
+    RiderStats.objects.bulk_create(
+        [
+            RiderStats(
+                user_id=row['user_id'], trips=row['trips'], seats=row['seats'] or 0, spend=row['spend'] or 0,
+                first_booking=row['first_booking'], last_booking=row['last_booking'],
+            )
+            for row in totals.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('core', '0025_seathold'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RiderStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rider_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('trips', models.IntegerField(default=0)),
+                ('seats', models.IntegerField(default=0)),
+                ('spend', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('first_booking', models.DateTimeField(blank=True, null=True)),
+                ('last_booking', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_rider_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:21
+
+import django.db.models.deletion
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+from core.migration_operations import AddIndexConcurrently, DropFieldIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # Concurrent index builds can't run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('core', '0026_riderstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='route',
+            name='route_no',
+            field=models.CharField(db_index=True, default='unknown', max_length=10),
+        ),
+        AddIndexConcurrently(
+            model_name='booking',
+            index=models.Index(fields=['user', 'booking_time', 'id'], name='booking_user_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('created_by_conductor', True), models.Q(('created_online', True), ('verified_by_conductor', True)), _connector='OR'), fields=['booking_time', 'id'], name='booking_counted_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='busstop',
+            index=models.Index(django.db.models.functions.text.Upper('name'), name='busstop_name_upper_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='location',
+            index=models.Index(fields=['bus', 'timestamp'], name='location_bus_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='location',
+            index=models.Index(fields=['timestamp'], name='location_time_idx'),
+        ),
+        # The composite indexes above lead with these columns, so the FK indexes go last,
+        # once the composite indexes are there to serve their queries
+        DropFieldIndexConcurrently(
+            model_name='booking',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        DropFieldIndexConcurrently(
+            model_name='location',
+            name='bus',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='core.bus'),
+        ),
+    ]
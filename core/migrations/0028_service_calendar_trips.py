@@ -0,0 +1,99 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceCalendar',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('monday', models.BooleanField(default=True)),
+                ('tuesday', models.BooleanField(default=True)),
+                ('wednesday', models.BooleanField(default=True)),
+                ('thursday', models.BooleanField(default=True)),
+                ('friday', models.BooleanField(default=True)),
+                ('saturday', models.BooleanField(default=True)),
+                ('sunday', models.BooleanField(default=True)),
+                ('start_date', models.DateField(blank=True, null=True)),
+                ('end_date', models.DateField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='seathold',
+            name='schedule',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='core.schedule'),
+        ),
+        migrations.AddField(
+            model_name='schedule',
+            name='calendar',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.servicecalendar'),
+        ),
+        migrations.CreateModel(
+            name='TripInstance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('service_date', models.DateField()),
+                ('departs_at', models.DateTimeField()),
+                ('available_seats', models.IntegerField()),
+                ('schedule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trips', to='core.schedule')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StopDeparture',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('service_date', models.DateField()),
+                ('stop_order', models.PositiveIntegerField()),
+                ('departs_at', models.DateTimeField()),
+                ('stop', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='core.busstop')),
+                ('trip', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='stop_departures', to='core.tripinstance')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='trip',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.tripinstance'),
+        ),
+        migrations.AddField(
+            model_name='seathold',
+            name='trip',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='core.tripinstance'),
+        ),
+        migrations.CreateModel(
+            name='ServiceException',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('runs', models.BooleanField(default=False)),
+                ('calendar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exceptions', to='core.servicecalendar')),
+            ],
+            options={
+                'unique_together': {('calendar', 'date')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='tripinstance',
+            index=models.Index(fields=['service_date', 'departs_at'], name='trip_date_departs_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='tripinstance',
+            unique_together={('schedule', 'service_date')},
+        ),
+        migrations.AddIndex(
+            model_name='stopdeparture',
+            index=models.Index(fields=['service_date', 'stop', 'departs_at'], name='departure_date_stop_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='stopdeparture',
+            unique_together={('trip', 'stop_order')},
+        ),
+    ]
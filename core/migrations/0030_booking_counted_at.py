@@ -0,0 +1,44 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:57
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+from core.migration_operations import AddIndexConcurrently
+
+
+def backfill_counted_at(apps, schema_editor):
+    Booking = apps.get_model('core', 'Booking')
+    QRValidationLog = apps.get_model('conductor_service', 'QRValidationLog')
+    Booking.objects.update(counted_at=models.F('booking_time'))
+    # Online tickets started counting at their accepted scan
+    Booking.objects.filter(created_online=True, verified_by_conductor=True).update(counted_at=Coalesce(
+        models.Subquery(QRValidationLog.objects.filter(booking=models.OuterRef('pk'), is_valid=True).order_by(
+            'validated_at').values('validated_at')[:1]),
+        models.F('booking_time'),
+    ))
+
+
+class Migration(migrations.Migration):
+    # The index on core_booking is built concurrently, outside a transaction
+    atomic = False
+
+    dependencies = [
+        ('core', '0029_payment_idempotency'),
+        ('conductor_service', '0006_dailyreport_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='counted_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_counted_at, migrations.RunPython.noop, atomic=True),
+        AddIndexConcurrently(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('created_by_conductor', True), models.Q(('created_online', True), ('verified_by_conductor', True)), _connector='OR'), fields=['counted_at', 'id'], name='booking_counted_at_idx'),
+        ),
+    ]
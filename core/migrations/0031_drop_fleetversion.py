@@ -0,0 +1,16 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:07
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0030_booking_counted_at'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='FleetVersion',
+        ),
+    ]
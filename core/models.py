@@ -1,5 +1,8 @@
 from django.db import models
+from django.db.models import Q
+from django.db.models.functions import Upper
 from django.contrib.auth.models import User
+from django.utils import timezone
 from datetime import datetime, timedelta
 
 class Bus(models.Model):
@@ -11,7 +14,7 @@ class Bus(models.Model):
         return self.bus_id
 
 class Route(models.Model):
-    route_no = models.CharField(max_length=10, default='unknown')
+    route_no = models.CharField(max_length=10, default='unknown', db_index=True)
     source = models.CharField(max_length=100)
     destination = models.CharField(max_length=100)
     distance = models.FloatField()
@@ -23,11 +26,53 @@ class Route(models.Model):
     def __str__(self):
         return f"{self.route_no}: {self.source} to {self.destination}"
 
+class ServiceCalendar(models.Model):
+    """Days a schedule runs: a weekly pattern within a date range, plus ServiceExceptions."""
+    name = models.CharField(max_length=50, unique=True)  # e.g. WEEKDAY, SUNDAY_HOLIDAY
+    monday = models.BooleanField(default=True)
+    tuesday = models.BooleanField(default=True)
+    wednesday = models.BooleanField(default=True)
+    thursday = models.BooleanField(default=True)
+    friday = models.BooleanField(default=True)
+    saturday = models.BooleanField(default=True)
+    sunday = models.BooleanField(default=True)
+    start_date = models.DateField(null=True, blank=True)
+    end_date = models.DateField(null=True, blank=True)
+
+    WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+    def __str__(self):
+        return self.name
+
+    def runs_on(self, day, exceptions=None):
+        """Whether service runs on ``day``; ``exceptions`` is ``{date: runs}``, read from the database if not given."""
+        if exceptions is None:
+            exceptions = dict(self.exceptions.values_list('date', 'runs'))
+        if day in exceptions:
+            return exceptions[day]
+        in_range = (self.start_date is None or day >= self.start_date) and (self.end_date is None or day <= self.end_date)
+        return in_range and getattr(self, self.WEEKDAYS[day.weekday()])
+
+
+class ServiceException(models.Model):
+    """A date on which a calendar runs (``runs``) or does not run whatever its weekly pattern says, e.g. a holiday."""
+    calendar = models.ForeignKey(ServiceCalendar, on_delete=models.CASCADE, related_name='exceptions')
+    date = models.DateField()
+    runs = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ('calendar', 'date')
+
+    def __str__(self):
+        return f"{self.calendar} {'runs' if self.runs else 'does not run'} on {self.date}"
+
+
 class Schedule(models.Model):
     bus = models.ForeignKey('Bus', on_delete=models.CASCADE)
     route = models.ForeignKey('Route', on_delete=models.CASCADE)
     departure_time = models.TimeField()
-    available_seats = models.IntegerField()
+    available_seats = models.IntegerField()  # Seats each dated TripInstance starts with
+    calendar = models.ForeignKey(ServiceCalendar, on_delete=models.SET_NULL, null=True, blank=True)  # None: daily
 
     class Meta:
         unique_together = ('bus', 'route', 'departure_time')  # avoid duplicates
@@ -36,16 +81,74 @@ class Schedule(models.Model):
         return f"{self.bus} - {self.route} at {self.departure_time}"
 
     def get_today_departure(self):
-        today = datetime.now().date()
-        return datetime.combine(today, self.departure_time)
+        return timezone.make_aware(datetime.combine(timezone.localdate(), self.departure_time))
+
+
+class TripInstance(models.Model):
+    """One run of a Schedule on a service date, with that day's seat inventory (see core.service)."""
+    schedule = models.ForeignKey(Schedule, on_delete=models.CASCADE, related_name='trips')
+    service_date = models.DateField()
+    departs_at = models.DateTimeField()
+    available_seats = models.IntegerField()
+
+    class Meta:
+        unique_together = ('schedule', 'service_date')
+        indexes = [models.Index(fields=['service_date', 'departs_at'], name='trip_date_departs_idx')]
+
+    def __str__(self):
+        return f"{self.schedule} on {self.service_date}"
+
+
+class StopDeparture(models.Model):
+    """When a TripInstance leaves each stop of its route."""
+    # Indexed by the unique (trip, stop_order)
+    trip = models.ForeignKey(TripInstance, on_delete=models.CASCADE, related_name='stop_departures', db_index=False)
+    service_date = models.DateField()  # Copied from the trip so the index below serves a whole query
+    stop = models.ForeignKey('BusStop', on_delete=models.CASCADE, db_index=False)
+    stop_order = models.PositiveIntegerField()
+    departs_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('trip', 'stop_order')
+        indexes = [models.Index(fields=['service_date', 'stop', 'departs_at'], name='departure_date_stop_idx')]
+
+    def __str__(self):
+        return f"{self.trip} at stop {self.stop_id} {self.departs_at:%H:%M}"
+
+
+class SeatHold(models.Model):
+    """Seats taken from a TripInstance between create_order and payment_success."""
+    HELD = 'held'
+    CONFIRMED = 'confirmed'
+    RELEASED = 'released'
+    STATUS_CHOICES = [
+        (HELD, 'Held'),
+        (CONFIRMED, 'Confirmed'),
+        (RELEASED, 'Released'),
+    ]
+
+    trip = models.ForeignKey(TripInstance, on_delete=models.CASCADE, related_name='holds', null=True)
+    schedule = models.ForeignKey(Schedule, on_delete=models.CASCADE, related_name='holds', null=True)  # Holds from before trips
+    seats = models.PositiveIntegerField()
+    order_id = models.CharField(max_length=64, unique=True, null=True, blank=True)  # Razorpay order id
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=HELD)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'expires_at'])]
+
+    def __str__(self):
+        return f"Hold {self.id}: {self.seats} seats on trip {self.trip_id} ({self.status})"
 
 
 class Booking(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)  # Covered by the history index
     route = models.CharField(max_length=100, null=True)
     source = models.CharField(max_length=100, null=True)
     destination = models.CharField(max_length=100, null=True)
     schedule = models.ForeignKey(Schedule, on_delete=models.CASCADE, null=True)
+    trip = models.ForeignKey(TripInstance, on_delete=models.SET_NULL, null=True, blank=True)
     seats = models.IntegerField()
     fare = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     booking_time = models.DateTimeField(auto_now_add=True)
@@ -54,6 +157,28 @@ class Booking(models.Model):
     created_online = models.BooleanField(default=False) 
     verified_by_conductor = models.BooleanField(default=False)
     used = models.BooleanField(default=False)
+    # When the booking last changed whether it counts: issued, or (online tickets) scanned.
+    # The conductor feed's cursor, so a poll picks up tickets scanned after their booking.
+    counted_at = models.DateTimeField(default=timezone.now)
+    # The gateway order and payment paid for an online booking; unique, so a payment books once
+    order_id = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    payment_id = models.CharField(max_length=64, unique=True, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # A rider's history, newest first (core.history)
+            models.Index(fields=['user', 'booking_time', 'id'], name='booking_user_time_idx'),
+            # Bookings counted by the conductor figures and feeds (conductor_service.analytics.COUNTED)
+            models.Index(
+                fields=['booking_time', 'id'], name='booking_counted_time_idx',
+                condition=Q(created_by_conductor=True) | Q(created_online=True, verified_by_conductor=True),
+            ),
+            # The conductor feed, in the order bookings started counting (conductor_service.feeds)
+            models.Index(
+                fields=['counted_at', 'id'], name='booking_counted_at_idx',
+                condition=Q(created_by_conductor=True) | Q(created_online=True, verified_by_conductor=True),
+            ),
+        ]
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
@@ -61,15 +186,75 @@ class Booking(models.Model):
     def __str__(self):
         return f"Booking {self.id} by {self.user}"
 
+class PaymentOrder(models.Model):
+    """What a gateway order pays for, as recorded by create_order (see core.orders)."""
+    order_id = models.CharField(max_length=64, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    amount = models.PositiveIntegerField()  # In paise, as sent to the gateway
+    route = models.CharField(max_length=100, null=True)
+    source = models.CharField(max_length=100, null=True)
+    destination = models.CharField(max_length=100, null=True)
+    trip = models.ForeignKey(TripInstance, on_delete=models.SET_NULL, null=True, blank=True)
+    seats = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Order {self.order_id}: {self.seats} seats for {self.user}"
+
+class RiderStats(models.Model):
+    """Booking totals of a user, kept current as bookings are added (see core.history)."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='rider_stats')
+    trips = models.IntegerField(default=0)
+    seats = models.IntegerField(default=0)
+    spend = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    first_booking = models.DateTimeField(null=True, blank=True)
+    last_booking = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.user}: {self.trips} trips"
+
 class Location(models.Model):
-    bus = models.ForeignKey(Bus, on_delete=models.CASCADE)
+    bus = models.ForeignKey(Bus, on_delete=models.CASCADE, db_index=False)  # Covered by (bus, timestamp)
     latitude = models.FloatField()
     longitude = models.FloatField()
     timestamp = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['bus', 'timestamp'], name='location_bus_time_idx'),
+            # Retention sweeps across all buses (compact_locations)
+            models.Index(fields=['timestamp'], name='location_time_idx'),
+        ]
+
     def __str__(self):
         return f"{self.bus} at ({self.latitude}, {self.longitude})"
 
+class LocationTrack(models.Model):
+    """Downsampled trajectory of one trip, replacing raw Location rows past retention."""
+    bus = models.ForeignKey(Bus, on_delete=models.CASCADE, related_name='tracks')
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField()
+    points = models.JSONField()  # [[seconds since started_at, lat, lng], ...]
+    raw_count = models.PositiveIntegerField()  # Fixes the track was built from
+
+    class Meta:
+        indexes = [models.Index(fields=['bus', 'started_at'])]
+
+    def __str__(self):
+        return f"{self.bus} track {self.started_at:%Y-%m-%d %H:%M} ({len(self.points)} points)"
+
+class LatestLocation(models.Model):
+    """Most recent position of each bus, kept current on every Location/BusLocation write."""
+    bus = models.OneToOneField(Bus, on_delete=models.CASCADE, primary_key=True, related_name='latest_location')
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    timestamp = models.DateTimeField()
+    version = models.BigIntegerField(default=0, db_index=True)  # core.locations.next_fleet_version of the write
+
+    def __str__(self):
+        return f"{self.bus} at ({self.latitude}, {self.longitude})"
+
+
 class Complaint(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)  # Link to passenger
     description = models.TextField()  # Renamed from issue
@@ -114,6 +299,10 @@ class BusStop(models.Model):
     latitude = models.FloatField()
     longitude = models.FloatField()
 
+    class Meta:
+        # Case-insensitive name lookups: filter on Upper('name'), or name__iexact on PostgreSQL
+        indexes = [models.Index(Upper('name'), name='busstop_name_upper_idx')]
+
     def __str__(self):
         return self.name
 
@@ -0,0 +1,111 @@
+import threading
+import time
+
+from .models import Route, RouteStop
+
+# Rebuild at least this often (seconds) so other worker processes, which do
+# not receive this process's invalidation signals, pick up admin edits.
+INDEX_MAX_AGE = 300
+
+
+class NetworkIndex:
+    """
+    Read-only snapshot of the route network.
+
+    ``route_stops[route_id]`` is the ordered list of ``(stop_id, stop_name)``
+    and ``stop_positions[key][route_id]`` is the first position of a stop on
+    that route, where ``key`` is either the stop id or its casefolded name.
+    ``stops_named[name]`` lists the ids of the stops with that casefolded name.
+    """
+
+    def __init__(self, routes, route_stops):
+        self.routes = routes
+        self.route_stops = route_stops
+        self.stop_positions = {}
+        self.stops_named = {}
+        for route_id, stops in route_stops.items():
+            for position, (stop_id, name) in enumerate(stops):
+                for key in (stop_id, name.casefold()):
+                    self.stop_positions.setdefault(key, {}).setdefault(route_id, position)
+                named = self.stops_named.setdefault(name.casefold(), [])
+                if stop_id not in named:
+                    named.append(stop_id)
+
+    @classmethod
+    def build(cls):
+        routes = {
+            route_id: {'route_no': route_no, 'source': source, 'destination': destination}
+            for route_id, route_no, source, destination
+            in Route.objects.values_list('id', 'route_no', 'source', 'destination')
+        }
+        route_stops = {route_id: [] for route_id in routes}
+        rows = RouteStop.objects.order_by('route_id', 'stop_order').values_list(
+            'route_id', 'bus_stop_id', 'bus_stop__name'
+        )
+        for route_id, stop_id, name in rows:
+            route_stops[route_id].append((stop_id, name))
+        return cls(routes, route_stops)
+
+    def positions(self, stop):
+        """Routes serving ``stop`` (an id or a name) as ``{route_id: position}``."""
+        key = stop if isinstance(stop, int) else stop.casefold()
+        return self.stop_positions.get(key, {})
+
+    def stop_ids(self, stop):
+        """Ids of the route stops matching ``stop``, an id or a name."""
+        if isinstance(stop, int):
+            return [stop] if stop in self.stop_positions else []
+        return self.stops_named.get(stop.casefold(), [])
+
+    def routes_between(self, from_stop, to_stop=None):
+        """Ids of routes that serve ``from_stop`` and, if given, reach ``to_stop`` after it."""
+        starts = self.positions(from_stop)
+        if to_stop is None:
+            return list(starts)
+        ends = self.positions(to_stop)
+        return [route_id for route_id, pos in starts.items() if route_id in ends and pos < ends[route_id]]
+
+
+class CachedIndex:
+    """
+    Process-local cache of an index built by ``builder()``: built on first use,
+    rebuilt after ``invalidate()`` or once older than ``max_age`` seconds.
+    """
+
+    def __init__(self, builder, max_age=INDEX_MAX_AGE):
+        self.builder = builder
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._value = None
+        self._built_at = 0.0
+        self._generation = 0
+
+    def get(self):
+        value = self._value
+        if value is None or time.monotonic() - self._built_at > self.max_age:
+            with self._lock:
+                if self._value is not value and self._value is not None:
+                    # Another thread rebuilt it while we waited
+                    return self._value
+                generation = self._generation
+                value = self.builder()
+                # Don't cache a build that raced with an invalidation
+                if generation == self._generation:
+                    self._value, self._built_at = value, time.monotonic()
+        return value
+
+    def invalidate(self):
+        self._generation += 1
+        self._value = None
+
+
+network_index = CachedIndex(NetworkIndex.build)
+
+
+def get_network_index():
+    """The current NetworkIndex, built on first use and after invalidation."""
+    return network_index.get()
+
+
+def invalidate_network_index():
+    network_index.invalidate()
@@ -0,0 +1,129 @@
+"""
+Paid gateway orders become bookings, exactly once.
+
+create_order records a PaymentOrder: what the order pays for, as the server
+saw it, with the amount priced here from the route's fare. Bookings are
+made from that record, never from what the browser posts, and only for a
+payment of exactly that amount. Booking.order_id is unique, so payment_success retries, a
+reconciliation run and a race between the two make one booking between
+them. ``reconcile`` books the captured payments the browser never reported
+(a closed tab, a dropped connection).
+"""
+from decimal import Decimal
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+
+from .inventory import SoldOut, confirm_hold
+from .models import Booking, PaymentOrder, TripInstance
+
+# Payments matched against bookings per query
+RECONCILE_BATCH = 100
+
+
+class PaymentMismatch(Exception):
+    """The payment is not for the order, or not of its amount."""
+
+
+def fare_for(trip_id):
+    """Fare of one seat on a trip, in rupees; None for an unknown trip."""
+    trip = TripInstance.objects.filter(id=trip_id).select_related('schedule__route').first()
+    return trip.schedule.route.get_fare() if trip else None
+
+
+def order_amount(hold):
+    """What the seats of a hold cost, in paise."""
+    return round(fare_for(hold.trip_id) * 100) * hold.seats
+
+
+def record_order(order_id, user, amount, data, hold):
+    """Remember what a new gateway order for ``hold`` pays for; ``data`` is the create_order request."""
+    with transaction.atomic():
+        hold.order_id = order_id
+        hold.save(update_fields=['order_id'])
+        return PaymentOrder.objects.create(
+            order_id=order_id,
+            user=user,
+            amount=amount,
+            route=data.get("route_no"),
+            source=data.get("from"),
+            destination=data.get("to"),
+            trip_id=hold.trip_id,
+            seats=hold.seats,
+        )
+
+
+def fulfil(order, payment):
+    """
+    Book a PaymentOrder paid by ``payment``, the gateway's payment dict.
+    Returns (booking, created): the booking already made for the order, if
+    any, with created False. Raises PaymentMismatch for a payment of another
+    order or amount, and SoldOut when the order's hold expired and the bus
+    has filled up since.
+    """
+    if payment.get('order_id') != order.order_id or payment.get('amount') != order.amount:
+        raise PaymentMismatch(f"Payment {payment.get('id')} does not pay for {order.order_id}")
+    payment_id = payment['id']
+    try:
+        with transaction.atomic():
+            hold = confirm_hold(order.order_id)
+            trip_id = hold.trip_id if hold else order.trip_id
+            schedule_id = TripInstance.objects.filter(id=trip_id).values_list('schedule_id', flat=True).first()
+            booking = Booking.objects.create(
+                user_id=order.user_id,
+                route=order.route,
+                source=order.source,
+                destination=order.destination,
+                schedule_id=schedule_id,
+                trip_id=trip_id,
+                seats=hold.seats if hold else order.seats,
+                fare=Decimal(order.amount) / 100,
+                created_online=True,
+                order_id=order.order_id,
+                payment_id=payment_id,
+            )
+        return booking, True
+    except IntegrityError:
+        # Booked meanwhile by a concurrent retry or reconciliation run
+        booking = Booking.objects.filter(order_id=order.order_id).first()
+        if booking is None:
+            raise
+        return booking, False
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def reconcile(payments, batch_size=RECONCILE_BATCH):
+    """
+    Book every captured payment in ``payments`` (gateway payment dicts)
+    that has no booking yet. Returns the counts of orders ``booked``,
+    ``matched`` (booked already), ``unknown`` (no PaymentOrder: not made by
+    create_order), ``sold_out`` and ``mismatched`` (not of the order's
+    amount), with the ids of the sold-out and mismatched orders, which were
+    paid for but not booked and need a refund.
+    """
+    counts = dict.fromkeys(('payments', 'booked', 'matched', 'unknown', 'sold_out', 'mismatched'), 0)
+    unbooked = []
+    for batch in _batches(payments, batch_size):
+        counts['payments'] += len(batch)
+        by_order = {payment['order_id']: payment for payment in batch if payment.get('order_id')}
+        booked = set(Booking.objects.filter(order_id__in=by_order).values_list('order_id', flat=True))
+        counts['matched'] += len(booked)
+        orders = list(PaymentOrder.objects.filter(order_id__in=by_order.keys() - booked))
+        counts['unknown'] += len(by_order) - len(booked) - len(orders)
+        for order in orders:
+            try:
+                _, created = fulfil(order, by_order[order.order_id])
+            except SoldOut:
+                counts['sold_out'] += 1
+                unbooked.append(order.order_id)
+            except PaymentMismatch:
+                counts['mismatched'] += 1
+                unbooked.append(order.order_id)
+            else:
+                counts['booked' if created else 'matched'] += 1
+    return counts, unbooked
@@ -0,0 +1,56 @@
+"""
+Keyset (cursor) pagination on ``(<timestamp field>, id)``.
+
+A page continues strictly after the key of the last row it returned, so
+every page costs one index range scan however deep it is, and rows added
+meanwhile neither shift nor duplicate later pages.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+
+class CursorError(ValueError):
+    """The cursor was not produced by encode_cursor."""
+
+
+def encode_cursor(value, pk):
+    return base64.urlsafe_b64encode(f"{value.isoformat()}|{pk}".encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        text = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        value, pk = text.split('|')
+        return datetime.fromisoformat(value), int(pk)
+    except ValueError as exc:
+        raise CursorError("Invalid cursor") from exc
+
+
+def keyset_filter(queryset, cursor, field, descending=False):
+    """Rows after ``cursor`` in ``(field, id)`` order, already ordered."""
+    op = 'lt' if descending else 'gt'
+    if cursor:
+        value, pk = decode_cursor(cursor)
+        # The redundant bound keeps the OR a single range scan of a (field, id) index
+        queryset = queryset.filter(
+            Q(**{f'{field}__{op}e': value}),
+            Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'id__{op}': pk}),
+        )
+    order = (f'-{field}', '-id') if descending else (field, 'id')
+    return queryset.order_by(*order)
+
+
+def keyset_page(queryset, cursor, limit, field, descending=False):
+    """
+    One page of a ``values()`` queryset. Returns ``(rows, next_cursor,
+    has_more)``; with no rows the given cursor is returned, so polling with
+    it later picks up rows added since.
+    """
+    # One extra row tells whether another page follows
+    rows = list(keyset_filter(queryset, cursor, field, descending)[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1][field], rows[-1]['id']) if rows else cursor
+    return rows, next_cursor, has_more
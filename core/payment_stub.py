@@ -0,0 +1,175 @@
+"""
+A local stand-in for the Razorpay orders API, for latency and failure tests.
+
+Serves ``POST /v1/orders``, ``GET /v1/orders`` (by ``receipt``),
+``GET /v1/orders/<id>``, ``GET /v1/payments`` and ``GET /v1/payments/<id>``
+with the gateway's JSON shapes and error format. Point PAYMENT_GATEWAY_URL at it (the payment_stub command runs
+one). A rider paying is simulated by ``pay(order_id)``, or
+``POST /stub/orders/<id>/pay``. ``latency`` delays every response,
+``failure_rate`` answers that share of requests with a 500,
+``fail_next`` fails the next N requests outright and ``drop_next`` carries
+out the next N but hangs up instead of answering.
+"""
+import json
+import random
+import re
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, as the real gateway
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data):
+        with self.server.lock:
+            drop = self.server.drop_next > 0
+            if drop:
+                self.server.drop_next -= 1
+        if drop:
+            self.close_connection = True
+            return
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def error(self, status, code, description):
+        self.send_json(status, {'error': {'code': code, 'description': description}})
+
+    def handle_request(self, method):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}') if length else {}
+        with server.lock:
+            server.requests += 1
+            fail = server.fail_next > 0 or random.random() < server.failure_rate
+            if server.fail_next > 0:
+                server.fail_next -= 1
+        if server.latency:
+            time.sleep(server.latency)
+        if fail:
+            return self.error(500, 'SERVER_ERROR', "Injected failure")
+
+        url = urlsplit(self.path)
+        if method == 'POST' and url.path == '/v1/orders':
+            if not isinstance(payload.get('amount'), int) or payload['amount'] < 100:
+                return self.error(400, 'BAD_REQUEST_ERROR', "The amount must be at least INR 1.00")
+            order = {
+                'id': f"order_{secrets.token_hex(7)}",
+                'entity': 'order',
+                'amount': payload['amount'],
+                'amount_paid': 0,
+                'amount_due': payload['amount'],
+                'currency': payload.get('currency', 'INR'),
+                'receipt': payload.get('receipt'),
+                'status': 'created',
+                'attempts': 0,
+                'created_at': int(time.time()),
+            }
+            with server.lock:
+                server.orders[order['id']] = order
+            return self.send_json(200, order)
+        if method == 'GET' and url.path == '/v1/orders':
+            receipt = parse_qs(url.query).get('receipt', [None])[0]
+            with server.lock:
+                items = [o for o in server.orders.values() if receipt is None or o['receipt'] == receipt]
+            return self.send_json(200, {'entity': 'collection', 'count': len(items), 'items': items})
+        match = re.fullmatch(r'/v1/orders/(\w+)', url.path)
+        if method == 'GET' and match:
+            order = server.orders.get(match[1])
+            if order is None:
+                return self.error(400, 'BAD_REQUEST_ERROR', "The id provided does not exist")
+            return self.send_json(200, order)
+        if method == 'GET' and url.path == '/v1/payments':
+            query = {key: int(values[0]) for key, values in parse_qs(url.query).items()}
+            count = min(query.get('count', 10), 100)
+            with server.lock:
+                # Newest first, as the gateway lists them
+                payments = sorted(server.payments, key=lambda p: p['created_at'], reverse=True)
+            payments = [p for p in payments if query.get('from', 0) <= p['created_at'] <= query.get('to', 2 ** 40)]
+            items = payments[query.get('skip', 0):query.get('skip', 0) + count]
+            return self.send_json(200, {'entity': 'collection', 'count': len(items), 'items': items})
+        match = re.fullmatch(r'/v1/payments/(\w+)', url.path)
+        if method == 'GET' and match:
+            with server.lock:
+                payment = next((p for p in server.payments if p['id'] == match[1]), None)
+            if payment is None:
+                return self.error(400, 'BAD_REQUEST_ERROR', "The id provided does not exist")
+            return self.send_json(200, payment)
+        match = re.fullmatch(r'/stub/orders/(\w+)/pay', url.path)
+        if method == 'POST' and match and match[1] in server.orders:
+            return self.send_json(200, server.pay(match[1]))
+        self.error(404, 'BAD_REQUEST_ERROR', "The requested URL was not found on the server.")
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+
+class StubGateway(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, failure_rate=0.0):
+        super().__init__(address, StubHandler)
+        self.lock = threading.Lock()
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.fail_next = 0
+        self.drop_next = 0
+        self.orders = {}
+        self.payments = []
+        self.requests = 0
+        self.connections = 0
+
+    def pay(self, order_id, status='captured'):
+        """Record a payment of the whole order, as the checkout would. Returns the payment."""
+        with self.lock:
+            order = self.orders[order_id]
+            payment = {
+                'id': f"pay_{secrets.token_hex(7)}",
+                'entity': 'payment',
+                'amount': order['amount'],
+                'currency': order['currency'],
+                'status': status,
+                'order_id': order_id,
+                'captured': status == 'captured',
+                'created_at': int(time.time()),
+            }
+            self.payments.append(payment)
+            if status == 'captured':
+                order.update(status='paid', amount_paid=order['amount'], amount_due=0)
+            order['attempts'] += 1
+        return payment
+
+    def handle_error(self, request, client_address):
+        # A client that timed out has hung up before the delayed answer
+        pass
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve on a background thread; returns self."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,179 @@
+"""
+Payment gateway access.
+
+One gateway object per process (``get_gateway``) keeps a pooled HTTPS
+session, so orders reuse open connections instead of a TLS handshake each.
+Every call has a timeout and transient failures (connection errors,
+timeouts, gateway 5xx) are retried with exponential backoff; a request the
+gateway rejects is not, and an order is only sent again once a lookup by
+its receipt shows the first attempt didn't create it. The ``a``-prefixed
+methods run the call on a bounded thread pool of their own, so an async
+view waiting on a slow gateway holds neither a worker nor Django's shared
+sync thread.
+
+Settings, all optional: PAYMENT_GATEWAY_URL (e.g. a stub from the
+payment_stub command), PAYMENT_GATEWAY_TIMEOUT (connect, read seconds),
+PAYMENT_GATEWAY_RETRIES, PAYMENT_GATEWAY_BACKOFF (seconds) and
+PAYMENT_GATEWAY_POOL_SIZE.
+"""
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache, partial
+from importlib.metadata import PackageNotFoundError, version
+
+import razorpay
+import requests
+from django.conf import settings
+from razorpay.errors import (
+    BadRequestError, GatewayError as RazorpayGatewayError, ServerError, SignatureVerificationError,
+)
+from requests.adapters import HTTPAdapter
+
+DEFAULT_TIMEOUT = (3.05, 10)
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.25
+# Connections kept open to the gateway, and calls in flight at once
+DEFAULT_POOL_SIZE = 20
+# Largest page of payments the gateway returns
+PAGE_SIZE = 100
+
+
+class GatewayError(Exception):
+    """The gateway could not be reached, or kept failing, within the retries."""
+
+
+class PaymentRejected(GatewayError):
+    """The gateway refused the request itself; retrying would not help."""
+
+
+class _Client(razorpay.Client):
+    # The SDK looks its version up through pkg_resources, a millisecond, on every request
+    @staticmethod
+    @cache
+    def _get_version():
+        try:
+            return version('razorpay')
+        except PackageNotFoundError:
+            return ''
+
+
+class Gateway:
+    def __init__(self, key_id, key_secret, base_url=None, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, pool_size=DEFAULT_POOL_SIZE):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        options = {'base_url': base_url} if base_url else {}
+        self.client = _Client(session=session, auth=(key_id, key_secret), **options)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='payment-gateway')
+
+    def call(self, method, *args, idempotent=True, recover=None):
+        """
+        ``method(*args)`` of the SDK client, with the timeout and retries.
+
+        A call that isn't ``idempotent`` (a POST) is sent again only when the
+        connection was never made, or when ``recover``, asked after a failure
+        that may have reached the gateway, finds no result of the first send
+        (it returns the result, or None).
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return method(*args, timeout=self.timeout)
+            except BadRequestError as e:
+                raise PaymentRejected(str(e)) from e
+            except (requests.RequestException, ServerError, RazorpayGatewayError, ValueError) as e:
+                # ValueError: a body that isn't JSON, as from a proxy error page
+                unsent = isinstance(e, requests.ConnectTimeout)
+                if attempt == self.retries or not (idempotent or unsent or recover):
+                    raise GatewayError(f"Payment gateway unavailable: {e}") from e
+            time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+            if not (idempotent or unsent):
+                result = recover()
+                if result is not None:
+                    return result
+
+    def create_order(self, amount, currency='INR', receipt=None):
+        data = {'amount': amount, 'currency': currency, 'payment_capture': 1}
+        if receipt:
+            data['receipt'] = receipt
+        # An order is found again by its receipt, so a send that may have gone through isn't repeated blindly
+        return self.call(
+            self.client.order.create, data, idempotent=False, recover=partial(self.find_order, receipt) if receipt else None,
+        )
+
+    def fetch_order(self, order_id):
+        return self.call(self.client.order.fetch, order_id)
+
+    def find_order(self, receipt):
+        """The order created with ``receipt``, or None."""
+        items = self.call(self.client.order.all, {'receipt': receipt}).get('items', [])
+        return items[0] if items else None
+
+    def fetch_payment(self, payment_id):
+        return self.call(self.client.payment.fetch, payment_id)
+
+    def verify_payment(self, order_id, payment_id, signature):
+        """Whether ``signature`` is the gateway's for this payment of this order; checked locally."""
+        try:
+            return self.client.utility.verify_payment_signature({
+                'razorpay_order_id': order_id, 'razorpay_payment_id': payment_id, 'razorpay_signature': signature,
+            })
+        except SignatureVerificationError:
+            return False
+
+    def captured_payments(self, since, until=None, page_size=PAGE_SIZE):
+        """Captured payments created from ``since`` (to ``until``), fetched a page at a time."""
+        params = {'from': int(since.timestamp()), 'count': page_size}
+        if until is not None:
+            params['to'] = int(until.timestamp())
+        skip = 0
+        while True:
+            items = self.call(self.client.payment.all, {**params, 'skip': skip}).get('items', [])
+            yield from (payment for payment in items if payment.get('status') == 'captured')
+            if len(items) < page_size:
+                return
+            skip += len(items)
+
+    async def run(self, method, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(method, *args))
+
+    async def acreate_order(self, amount, currency='INR', receipt=None):
+        return await self.run(self.create_order, amount, currency, receipt)
+
+
+_gateway = None
+_lock = threading.Lock()
+
+
+def get_gateway():
+    """The process-wide Gateway, built from settings on first use."""
+    global _gateway
+    if _gateway is None:
+        with _lock:
+            if _gateway is None:
+                _gateway = Gateway(
+                    settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET,
+                    base_url=getattr(settings, 'PAYMENT_GATEWAY_URL', None),
+                    timeout=getattr(settings, 'PAYMENT_GATEWAY_TIMEOUT', DEFAULT_TIMEOUT),
+                    retries=getattr(settings, 'PAYMENT_GATEWAY_RETRIES', DEFAULT_RETRIES),
+                    backoff=getattr(settings, 'PAYMENT_GATEWAY_BACKOFF', DEFAULT_BACKOFF),
+                    pool_size=getattr(settings, 'PAYMENT_GATEWAY_POOL_SIZE', DEFAULT_POOL_SIZE),
+                )
+    return _gateway
+
+
+def reset_gateway():
+    """Drop the process-wide Gateway, so the next use reads the settings again."""
+    global _gateway
+    with _lock:
+        if _gateway is not None:
+            _gateway.executor.shutdown(wait=False)
+            _gateway.client.session.close()
+        _gateway = None
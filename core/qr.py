@@ -0,0 +1,34 @@
+from functools import lru_cache
+from io import BytesIO
+
+import qrcode
+from qrcode.image.svg import SvgPathImage
+
+from .tickets import sign_ticket
+
+CONTENT_TYPES = {
+    'svg': 'image/svg+xml',
+    'png': 'image/png',
+}
+
+
+def qr_payload(booking):
+    """Text encoded in a booking's ticket QR code: a signed, self-verifying ticket."""
+    return sign_ticket(booking)
+
+
+@lru_cache(maxsize=2048)
+def render_qr(payload, fmt='svg'):
+    """
+    Render ``payload`` as a QR image and return the bytes. The result only
+    depends on the payload, so it is memoised; SVG output is small and needs
+    no imaging library.
+    """
+    if fmt not in CONTENT_TYPES:
+        raise ValueError(f"Unsupported QR format {fmt!r}")
+    buffer = BytesIO()
+    if fmt == 'svg':
+        qrcode.make(payload, image_factory=SvgPathImage).save(buffer)
+    else:
+        qrcode.make(payload).save(buffer)
+    return buffer.getvalue()
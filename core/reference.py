@@ -0,0 +1,86 @@
+"""
+Route and stop reference data served from memory.
+
+Every payload is serialized once per build and carries a strong ETag, the
+hash of its bytes, so all worker processes agree on it without talking to
+each other. ``version`` hashes all payloads together. The signals drop the
+cache when a Route, RouteStop or BusStop changes.
+"""
+import hashlib
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+
+from .models import BusStop, Route, RouteStop
+from .network import INDEX_MAX_AGE, CachedIndex
+
+# Clients may reuse a payload this long (seconds) before revalidating with
+# its ETag. Other processes rebuild within INDEX_MAX_AGE of an admin edit,
+# so a longer max-age would only stretch how long clients see stale data.
+REFERENCE_MAX_AGE = INDEX_MAX_AGE
+
+
+class Payload:
+    def __init__(self, data):
+        self.body = json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+        self.etag = f'"{hashlib.sha1(self.body).hexdigest()[:20]}"'
+
+
+class ReferenceData:
+    """
+    Serialized payloads of the reference endpoints: ``payloads[name]`` and
+    ``route_stops[route_no]`` are Payloads.
+    """
+
+    def __init__(self, payloads, route_stops):
+        self.payloads = {name: Payload(data) for name, data in payloads.items()}
+        self.route_stops = {route_no: Payload(stops) for route_no, stops in route_stops.items()}
+        self.no_stops = Payload([])
+        digest = hashlib.sha1()
+        for payload in [*self.payloads.values(), *self.route_stops.values()]:
+            digest.update(payload.etag.encode())
+        self.version = digest.hexdigest()[:12]
+
+    @classmethod
+    def build(cls):
+        routes = list(Route.objects.order_by('id').values('route_no', 'source', 'destination', 'distance'))
+        stops = list(BusStop.objects.order_by('id').values('id', 'name'))
+        route_stops = {}
+        rows = RouteStop.objects.order_by('stop_order', 'id').values_list(
+            'route__route_no', 'bus_stop_id', 'bus_stop__name'
+        )
+        for route_no, stop_id, name in rows:
+            route_stops.setdefault(route_no, []).append({'id': stop_id, 'name': name})
+        return cls({
+            'routes': [{k: r[k] for k in ('route_no', 'source', 'destination')} for r in routes],
+            'routes_with_distance': routes,
+            'stops': stops,
+            'stop_names': [{'name': s['name']} for s in stops],
+        }, route_stops)
+
+    def get(self, name, route_no=None):
+        if name == 'route_stops':
+            return self.route_stops.get(route_no, self.no_stops)
+        return self.payloads[name]
+
+
+reference_data = CachedIndex(ReferenceData.build)
+
+
+def reference_response(request, name, route_no=None):
+    """
+    A reference payload as a JSON response, or 304 when the client's
+    If-None-Match already names it. Costs no query once the cache is warm.
+    """
+    data = reference_data.get()
+    payload = data.get(name, route_no)
+    if payload.etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(payload.body, content_type='application/json')
+    response['ETag'] = payload.etag
+    response['X-Reference-Version'] = data.version
+    response['Cache-Control'] = f'public, max-age={REFERENCE_MAX_AGE}'
+    return response
@@ -0,0 +1,89 @@
+import math
+
+# Fixes further apart than this (seconds) belong to different trips.
+TRIP_GAP = 15 * 60
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def split_trips(fixes, gap=TRIP_GAP):
+    """
+    Split time-ordered ``(timestamp, lat, lng)`` fixes of one bus into trips
+    wherever two consecutive fixes are more than ``gap`` seconds apart.
+    Yields one list of fixes per trip; works on any iterator.
+    """
+    trip = []
+    for fix in fixes:
+        if trip and (fix[0] - trip[-1][0]).total_seconds() > gap:
+            yield trip
+            trip = []
+        trip.append(fix)
+    if trip:
+        yield trip
+
+
+def downsample(fixes, interval):
+    """Keep the first fix of every ``interval``-second window, plus the final fix."""
+    if interval <= 0 or len(fixes) < 3:
+        return list(fixes)
+    kept = [fixes[0]]
+    for fix in fixes[1:-1]:
+        if (fix[0] - kept[-1][0]).total_seconds() >= interval:
+            kept.append(fix)
+    kept.append(fixes[-1])
+    return kept
+
+
+def _to_metres(fixes):
+    # Equirectangular projection around the trip; accurate to well under a metre at city scale
+    lat0 = math.radians(fixes[0][1])
+    scale = math.cos(lat0)
+    return [
+        (math.radians(lng) * scale * EARTH_RADIUS_M, math.radians(lat) * EARTH_RADIUS_M)
+        for _, lat, lng in fixes
+    ]
+
+
+def _offset(p, a, b):
+    # Distance of p from segment a-b
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    if dx == 0 and dy == 0:
+        return math.hypot(p[0] - a[0], p[1] - a[1])
+    t = max(0.0, min(1.0, ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / (dx * dx + dy * dy)))
+    return math.hypot(p[0] - (a[0] + t * dx), p[1] - (a[1] + t * dy))
+
+
+def simplify(fixes, tolerance):
+    """
+    Douglas-Peucker simplification: drop fixes that lie within ``tolerance``
+    metres of the line between the fixes kept around them. Iterative, so long
+    trips do not hit the recursion limit.
+    """
+    if tolerance <= 0 or len(fixes) < 3:
+        return list(fixes)
+
+    points = _to_metres(fixes)
+    keep = [False] * len(fixes)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(fixes) - 1)]
+    while stack:
+        first, last = stack.pop()
+        worst, worst_index = 0.0, None
+        for i in range(first + 1, last):
+            d = _offset(points[i], points[first], points[last])
+            if d > worst:
+                worst, worst_index = d, i
+        if worst_index is not None and worst > tolerance:
+            keep[worst_index] = True
+            stack.append((first, worst_index))
+            stack.append((worst_index, last))
+    return [fix for fix, kept in zip(fixes, keep) if kept]
+
+
+def encode_track(fixes):
+    """Compact JSON form: ``[[seconds since first fix, lat, lng], ...]`` with 6-decimal coordinates."""
+    start = fixes[0][0]
+    return [
+        [round((ts - start).total_seconds()), round(lat, 6), round(lng, 6)]
+        for ts, lat, lng in fixes
+    ]
@@ -0,0 +1,191 @@
+"""
+Dated trips: every Schedule expanded over the days its ServiceCalendar runs.
+
+A TripInstance is one run of a schedule on a service date and carries the
+seats left on that run. Its StopDepartures give the time it leaves each
+stop, from distance_from_start at AVERAGE_SPEED_KMH as in the journey
+planner, and are indexed by (service_date, stop, departs_at) for "next
+buses from this stop".
+
+Trips are written in bulk and idempotently: the expand_trips command keeps
+TRIP_HORIZON_DAYS materialized, views fill in a missing day on first use
+(``ensure_trips``), and the signals call ``refresh_trips`` when a schedule,
+its calendar or its route's stops change.
+"""
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .journey import AVERAGE_SPEED_KMH
+from .models import (
+    Booking, RouteStop, Schedule, SeatHold, ServiceCalendar, ServiceException, StopDeparture, TripInstance,
+)
+from .network import CachedIndex
+
+BATCH_SIZE = 2000
+# Days ahead, today included, kept materialized
+TRIP_HORIZON_DAYS = 7
+
+
+def date_range(start, end):
+    return [start + timedelta(days=n) for n in range((end - start).days + 1)]
+
+
+def running_days(start, end):
+    """{calendar id: dates from ``start`` to ``end`` on which it runs}."""
+    exceptions = {}
+    for calendar_id, day, runs in ServiceException.objects.filter(date__range=(start, end)).values_list(
+        'calendar_id', 'date', 'runs'
+    ):
+        exceptions.setdefault(calendar_id, {})[day] = runs
+    days = date_range(start, end)
+    return {
+        calendar.id: {day for day in days if calendar.runs_on(day, exceptions.get(calendar.id, {}))}
+        for calendar in ServiceCalendar.objects.all()
+    }
+
+
+def stop_offsets(route_ids=None, speed_kmh=AVERAGE_SPEED_KMH):
+    """{route id: [(stop id, stop_order, seconds after leaving the first stop)]}."""
+    rows = RouteStop.objects.order_by('route_id', 'stop_order', 'id')
+    if route_ids is not None:
+        rows = rows.filter(route_id__in=route_ids)
+    stops = {}
+    for route_id, stop_id, order, distance in rows.values_list(
+        'route_id', 'bus_stop_id', 'stop_order', 'distance_from_start'
+    ):
+        stops.setdefault(route_id, []).append((stop_id, order, distance))
+    return {
+        route_id: [(stop_id, order, round((distance - route[0][2]) / speed_kmh * 3600))
+                   for stop_id, order, distance in route]
+        for route_id, route in stops.items()
+    }
+
+
+def departure_on(day, departure_time):
+    """Aware datetime of a schedule's departure on the service date ``day``."""
+    return timezone.make_aware(datetime.combine(day, departure_time))
+
+
+def add_stop_departures(trips, offsets):
+    """StopDepartures of ``trips``, given as (id, route id, service_date, departs_at)."""
+    StopDeparture.objects.bulk_create((
+        StopDeparture(trip_id=pk, service_date=day, stop_id=stop_id, stop_order=order,
+                      departs_at=leaves + timedelta(seconds=offset))
+        for pk, route_id, day, leaves in trips
+        for stop_id, order, offset in offsets.get(route_id, ())
+    ), batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def expand_trips(start, end, route_ids=None):
+    """
+    Create the missing TripInstances, with their StopDepartures, of the
+    schedules (of ``route_ids``, if given) for every service date from
+    ``start`` to ``end``. Returns the number of trips created.
+    """
+    running = running_days(start, end)
+    days = date_range(start, end)
+    schedules = Schedule.objects.all()
+    trips = TripInstance.objects.filter(service_date__range=(start, end))
+    if route_ids is not None:
+        schedules = schedules.filter(route_id__in=route_ids)
+        trips = trips.filter(schedule__route_id__in=route_ids)
+    existing = set(trips.values_list('schedule_id', 'service_date'))
+
+    new = []
+    for pk, departure, calendar_id, seats in schedules.values_list(
+        'id', 'departure_time', 'calendar_id', 'available_seats'
+    ).iterator(BATCH_SIZE):
+        for day in days:
+            if (pk, day) not in existing and (calendar_id is None or day in running[calendar_id]):
+                new.append(TripInstance(
+                    schedule_id=pk, service_date=day, departs_at=departure_on(day, departure), available_seats=seats,
+                ))
+    if not new:
+        return 0
+
+    with transaction.atomic():
+        # Another process may be expanding the same days; its rows win the
+        # conflicts, and StopDeparture's unique (trip, stop_order) keeps the
+        # stop times from being written twice.
+        TripInstance.objects.bulk_create(new, batch_size=BATCH_SIZE, ignore_conflicts=True)
+        created = {(trip.schedule_id, trip.service_date) for trip in new}
+        rows = trips.filter(schedule_id__in={pk for pk, _ in created}).values_list(
+            'id', 'schedule_id', 'schedule__route_id', 'service_date', 'departs_at',
+        )
+        add_stop_departures(
+            [(pk, route_id, day, leaves) for pk, schedule_id, route_id, day, leaves in rows
+             if (schedule_id, day) in created],
+            stop_offsets(route_ids),
+        )
+    return len(new)
+
+
+def refresh_trips(route_ids, today=None):
+    """
+    Bring the upcoming trips of ``route_ids`` in line with their schedules,
+    calendars and stops. Trips nothing was sold on are dropped and expanded
+    afresh; trips with bookings or holds keep their seats and only get new
+    times, even if their schedule no longer runs that day.
+    """
+    today = today or timezone.localdate()
+    upcoming = TripInstance.objects.filter(service_date__gte=today, schedule__route_id__in=route_ids)
+    sold = Q(Exists(Booking.objects.filter(trip=OuterRef('pk')))) | Q(
+        Exists(SeatHold.objects.filter(trip=OuterRef('pk')))
+    )
+    with transaction.atomic():
+        # Every sale takes seats off its trip's row first, so with the rows
+        # locked no hold or booking can land on a trip between the check and
+        # the delete; a sale waiting on the lock finds its trip gone (SoldOut).
+        list(upcoming.select_for_update(of=('self',)).values_list('id', flat=True))
+        upcoming.exclude(sold).delete()
+        kept = list(upcoming.select_related('schedule'))
+        sold_ids = [trip.id for trip in kept]
+        for trip in kept:
+            trip.departs_at = departure_on(trip.service_date, trip.schedule.departure_time)
+        TripInstance.objects.bulk_update(kept, ['departs_at'], batch_size=BATCH_SIZE)
+        StopDeparture.objects.filter(trip_id__in=sold_ids).delete()
+        add_stop_departures(
+            [(trip.id, trip.schedule.route_id, trip.service_date, trip.departs_at) for trip in kept],
+            stop_offsets(route_ids),
+        )
+        expand_trips(today, today + timedelta(days=TRIP_HORIZON_DAYS - 1), route_ids)
+    expanded.invalidate()
+
+
+def prune_trips(before):
+    """Delete trips of service dates before ``before`` that nothing was sold on. Returns how many."""
+    old = TripInstance.objects.filter(service_date__lt=before)
+    _, deleted = old.exclude(id__in=Booking.objects.filter(trip__isnull=False).values('trip_id')).exclude(
+        id__in=SeatHold.objects.filter(trip__isnull=False).values('trip_id')
+    ).delete()
+    # Departures of the trips kept for their bookings are of no use any more
+    StopDeparture.objects.filter(service_date__lt=before).delete()
+    return deleted.get(TripInstance._meta.label, 0)
+
+
+# (service date, route id) pairs known to be materialized by this process
+expanded = CachedIndex(set)
+
+
+def ensure_trips(day, route_ids):
+    """Expand ``day`` for those of ``route_ids`` not yet seen expanded; a no-op once warm."""
+    done = expanded.get()
+    missing = [route_id for route_id in route_ids if (day, route_id) not in done]
+    if missing:
+        expand_trips(day, day, missing)
+        done.update((day, route_id) for route_id in missing)
+
+
+def trip_for(schedule_id, day=None):
+    """The TripInstance of a schedule on ``day`` (default today), created if due; None if it doesn't run."""
+    day = day or timezone.localdate()
+    trip = TripInstance.objects.filter(schedule_id=schedule_id, service_date=day).first()
+    if trip is None:
+        route_id = Schedule.objects.filter(id=schedule_id).values_list('route_id', flat=True).first()
+        if route_id is not None:
+            expand_trips(day, day, [route_id])
+            trip = TripInstance.objects.filter(schedule_id=schedule_id, service_date=day).first()
+    return trip
@@ -1,7 +1,19 @@
-from django.db.models.signals import post_migrate
+from django.db import transaction
+from django.db.models.signals import post_migrate, post_save, post_delete, pre_delete
 from django.contrib.auth.models import Group
 from django.dispatch import receiver
 
+from .history import forget_booking, record_bookings
+from .locations import update_latest
+from .eta import route_shapes
+from .journey import timetables
+from .models import BusStop, Schedule, ServiceException
+from .network import invalidate_network_index, network_index
+from .reference import reference_data
+from .service import expanded, refresh_trips
+from .snapshot import network_snapshot
+from .spatial import stop_index
+
 @receiver(post_migrate)
 def create_default_groups(sender, **kwargs):
     """
@@ -10,3 +22,66 @@ def create_default_groups(sender, **kwargs):
     if sender.name == 'core':  # your app name here
         Group.objects.get_or_create(name='conductor')
         Group.objects.get_or_create(name='passenger')
+
+
+@receiver(post_save, sender='core.Location')
+@receiver(post_save, sender='conductor_service.BusLocation')
+def refresh_latest_location(sender, instance, **kwargs):
+    """
+    Keep LatestLocation in step with single-row position writes.
+    Bulk ingest bypasses signals and updates the store itself.
+    """
+    update_latest([instance])
+
+
+@receiver([post_save, post_delete], sender='core.Route')
+@receiver([post_save, post_delete], sender='core.RouteStop')
+@receiver([post_save, post_delete], sender='core.BusStop')
+@receiver([post_save, post_delete], sender='core.Schedule')
+def network_changed(sender, **kwargs):
+    """Drop the cached network indexes once the change is committed."""
+    transaction.on_commit(invalidate_network_index)
+    transaction.on_commit(timetables.invalidate)
+    transaction.on_commit(network_snapshot.invalidate)
+    if sender is BusStop:
+        transaction.on_commit(stop_index.invalidate)
+    if sender is not Schedule:
+        transaction.on_commit(route_shapes.invalidate)
+        transaction.on_commit(reference_data.invalidate)
+
+
+def invalidate_network_caches():
+    """Drop every cache built from the network; for bulk writes, which send no signals."""
+    for cache in (network_index, timetables, stop_index, route_shapes, reference_data, network_snapshot, expanded):
+        cache.invalidate()
+
+
+@receiver(post_save, sender='core.Schedule')
+@receiver([post_save, post_delete], sender='core.RouteStop')
+def route_trips_changed(sender, instance, **kwargs):
+    """Re-time and re-expand the route's upcoming dated trips once the change is committed."""
+    route_id = instance.route_id
+    transaction.on_commit(lambda: refresh_trips([route_id]))
+
+
+# pre_delete for calendars: by post_delete their schedules no longer point at them
+@receiver([post_save, pre_delete], sender='core.ServiceCalendar')
+@receiver([post_save, post_delete], sender='core.ServiceException')
+def calendar_changed(sender, instance, **kwargs):
+    calendar_id = instance.calendar_id if sender is ServiceException else instance.id
+    transaction.on_commit(timetables.invalidate)
+    route_ids = set(Schedule.objects.filter(calendar_id=calendar_id).values_list('route_id', flat=True))
+    if route_ids:
+        transaction.on_commit(lambda: refresh_trips(route_ids))
+
+
+@receiver(post_save, sender='core.Booking')
+def count_booking(sender, instance, created, **kwargs):
+    """Keep RiderStats in step; bulk-created bookings are recorded by their caller."""
+    if created and instance.user_id:
+        record_bookings(instance.user_id, [instance])
+
+
+@receiver(post_delete, sender='core.Booking')
+def uncount_booking(sender, instance, **kwargs):
+    forget_booking(instance)
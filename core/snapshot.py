@@ -0,0 +1,116 @@
+"""
+The whole route network as one precompressed, content-addressed file.
+
+Pages fetch ``network-<digest>.json`` once and the browser keeps it for
+good: a different network has a different digest, hence a different URL.
+Compact layout, with stops referenced by their position in ``stops``:
+
+    {"v": 1,
+     "stops": [[id, name, lat, lng], ...],
+     "routes": [[route_no, source, destination, distance, [stop, ...]], ...],
+     "schedules": [[route, bus_id, category, "HH:MM"], ...]}
+
+Seat counts change with every booking and stay out of the snapshot.
+"""
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+from django.conf import settings
+
+from .models import BusStop, Route, RouteStop, Schedule
+from .network import CachedIndex
+
+SNAPSHOT_VERSION = 1
+# Snapshot files kept on disk, so pages rendered just before a change still load theirs
+SNAPSHOTS_KEPT = 5
+
+
+def snapshot_root():
+    return getattr(settings, 'NETWORK_SNAPSHOT_ROOT', os.path.join(settings.MEDIA_ROOT, 'network'))
+
+
+class NetworkSnapshot:
+    def __init__(self, data):
+        self.body = json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode()
+        self.digest = hashlib.sha256(self.body).hexdigest()[:16]
+        # mtime=0 keeps the compressed bytes identical for identical content
+        self.gzipped = gzip.compress(self.body, compresslevel=9, mtime=0)
+
+    @property
+    def filename(self):
+        return f'network-{self.digest}.json.gz'
+
+    @classmethod
+    def build(cls):
+        stops = list(BusStop.objects.order_by('id').values_list('id', 'name', 'latitude', 'longitude'))
+        position = {stop[0]: n for n, stop in enumerate(stops)}
+        routes = list(Route.objects.order_by('id').values_list('id', 'route_no', 'source', 'destination', 'distance'))
+        route_position = {route[0]: n for n, route in enumerate(routes)}
+        route_stops = {route[0]: [] for route in routes}
+        for route_id, stop_id in RouteStop.objects.order_by('route_id', 'stop_order', 'id').values_list(
+            'route_id', 'bus_stop_id'
+        ):
+            route_stops[route_id].append(position[stop_id])
+        schedules = Schedule.objects.order_by('route_id', 'departure_time', 'id').values_list(
+            'route_id', 'bus__bus_id', 'bus__category', 'departure_time'
+        )
+        return cls({
+            'v': SNAPSHOT_VERSION,
+            'stops': [list(stop) for stop in stops],
+            'routes': [[*route[1:], route_stops[route[0]]] for route in routes],
+            'schedules': [
+                [route_position[route_id], bus_id, category, departure.strftime('%H:%M')]
+                for route_id, bus_id, category, departure in schedules
+            ],
+        })
+
+    def write(self, root=None):
+        """Write the gzipped file under ``root`` unless it is there already. Returns its path."""
+        root = root or snapshot_root()
+        path = os.path.join(root, self.filename)
+        if os.path.exists(path):
+            return path
+        os.makedirs(root, exist_ok=True)
+        # Write then rename, so a reader never sees half a file
+        fd, tmp = tempfile.mkstemp(dir=root, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.gzipped)
+        os.replace(tmp, path)
+        prune_snapshots(root)
+        return path
+
+
+def prune_snapshots(root=None, keep=SNAPSHOTS_KEPT):
+    root = root or snapshot_root()
+    files = sorted(
+        (entry for entry in os.scandir(root) if entry.name.startswith('network-') and entry.name.endswith('.json.gz')),
+        key=lambda entry: entry.stat().st_mtime, reverse=True,
+    )
+    for entry in files[keep:]:
+        os.remove(entry.path)
+
+
+def read_snapshot(digest, root=None):
+    """Gzipped bytes of an earlier snapshot still on disk, or None."""
+    try:
+        with open(os.path.join(root or snapshot_root(), f'network-{digest}.json.gz'), 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _build_and_write():
+    snapshot = NetworkSnapshot.build()
+    try:
+        snapshot.write()
+    except OSError:
+        # A read-only disk only costs the static copy; network_snapshot_file serves it from memory
+        pass
+    return snapshot
+
+
+# Rebuilt, and its file written, on first use after the network changes (see signals)
+network_snapshot = CachedIndex(_build_and_write)
@@ -0,0 +1,86 @@
+import heapq
+import math
+
+from .models import BusStop
+from .network import CachedIndex
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def unit_vector(lat, lng):
+    lat, lng = math.radians(lat), math.radians(lng)
+    return (math.cos(lat) * math.cos(lng), math.cos(lat) * math.sin(lng), math.sin(lat))
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Great-circle distance in metres."""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+class StopIndex:
+    """
+    k-d tree over bus stops. Stops are stored as 3-D unit vectors, where
+    straight-line (chord) distance orders points exactly like great-circle
+    distance, so there is no distortion near the poles or the date line.
+    """
+
+    def __init__(self, stops):
+        # stops: iterable of (id, name, lat, lng)
+        self.stops = list(stops)
+        self.points = [unit_vector(lat, lng) for _, _, lat, lng in self.stops]
+        # Implicit tree: node i holds (stop index, split axis, left node, right node)
+        self.nodes = []
+        self.root = self._build(list(range(len(self.stops))), 0)
+
+    @classmethod
+    def build(cls):
+        return cls(BusStop.objects.values_list('id', 'name', 'latitude', 'longitude'))
+
+    def _build(self, indices, depth):
+        if not indices:
+            return -1
+        axis = depth % 3
+        indices.sort(key=lambda i: self.points[i][axis])
+        middle = len(indices) // 2
+        node = len(self.nodes)
+        self.nodes.append(None)
+        left = self._build(indices[:middle], depth + 1)
+        right = self._build(indices[middle + 1:], depth + 1)
+        self.nodes[node] = (indices[middle], axis, left, right)
+        return node
+
+    def nearest(self, lat, lng, k=5):
+        """The ``k`` nearest stops as ``(distance_m, id, name, lat, lng)``, closest first."""
+        if k <= 0 or self.root < 0:
+            return []
+        target = unit_vector(lat, lng)
+        heap = []  # max-heap of (-squared chord, stop index)
+        stack = [(self.root, 0.0)]
+        while stack:
+            node, plane_d2 = stack.pop()
+            # Skip subtrees whose splitting plane is farther than the current k-th stop
+            if node < 0 or (len(heap) == k and plane_d2 >= -heap[0][0]):
+                continue
+            index, axis, left, right = self.nodes[node]
+            point = self.points[index]
+            d2 = sum((a - b) ** 2 for a, b in zip(point, target))
+            if len(heap) < k:
+                heapq.heappush(heap, (-d2, index))
+            elif d2 < -heap[0][0]:
+                heapq.heapreplace(heap, (-d2, index))
+
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            stack.append((far, max(plane_d2, diff * diff)))
+            stack.append((near, plane_d2))
+
+        results = []
+        for _, index in sorted(heap, reverse=True):
+            stop_id, name, stop_lat, stop_lng = self.stops[index]
+            results.append((haversine(lat, lng, stop_lat, stop_lng), stop_id, name, stop_lat, stop_lng))
+        return results
+
+
+stop_index = CachedIndex(StopIndex.build)
@@ -1,3 +1,1063 @@
-from django.test import TestCase
+import asyncio
+import base64
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from io import StringIO
+from datetime import datetime, time as clock_time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from conductor_service.models import ActiveTrip, ConductorProfile
+
+from .broker import PositionBroker
+from .models import (
+    Booking, Bus, BusStop, LatestLocation, Location, LocationTrack, RiderStats, Route, RouteStop, Schedule, SeatHold,
+    PaymentOrder, ServiceCalendar, ServiceException, StopDeparture, TripInstance,
+)
+from .history import history_page, rebuild_rider_stats
+from .gtfs import GTFSError, export_feed, import_feed
+from .journey import timetables
+from .network import invalidate_network_index
+from .locations import next_fleet_version, update_latest
+from .payment_stub import StubGateway
+from .orders import fulfil
+from .payments import Gateway, GatewayError, PaymentRejected, get_gateway, reset_gateway
+from .reference import REFERENCE_MAX_AGE, reference_data
+from .service import expand_trips, expanded, prune_trips, refresh_trips, trip_for
+from .snapshot import network_snapshot
+from .spatial import StopIndex, haversine, stop_index
+from .eta import RouteShapes, compute_arrivals, route_shapes
+from .inventory import SoldOut, confirm_hold, hold_seats, release_expired_holds, reserve_seats
+from .retention import downsample, simplify, split_trips
+from .tickets import TicketError, active_key_ids, sign_ticket, ticket_key, verify_ticket_token
+
+
+class BulkLocationIngestTests(TestCase):
+    def setUp(self):
+        Bus.objects.create(bus_id='B1', category='AC', capacity=40)
+        Bus.objects.create(bus_id='B2', category='Non-AC', capacity=50)
+        self.url = reverse('update_locations_bulk')
+
+    def test_json_array(self):
+        fixes = [
+            {'bus_id': 'B1', 'latitude': 19.03, 'longitude': 73.02},
+            {'bus_id': 'B2', 'latitude': 19.04, 'longitude': 73.03},
+        ]
+        # Bus lookup, history insert, latest upsert: no shared counter row to lock
+        with self.assertNumQueries(3):
+            response = self.client.post(self.url, json.dumps(fixes), content_type='application/json')
+        self.assertEqual(response.json()['created'], 2)
+        self.assertEqual(Location.objects.count(), 2)
+        self.assertEqual(LatestLocation.objects.count(), 2)
+
+    def test_latest_fix_per_bus_wins(self):
+        fixes = [
+            {'bus_id': 'B1', 'latitude': 19.03, 'longitude': 73.02},
+            {'bus_id': 'B1', 'latitude': 19.10, 'longitude': 73.10},
+        ]
+        self.client.post(self.url, json.dumps(fixes), content_type='application/json')
+        latest = LatestLocation.objects.get(bus__bus_id='B1')
+        self.assertEqual((latest.latitude, latest.longitude), (19.10, 73.10))
+
+    def test_ndjson_reports_row_errors(self):
+        body = "\n".join([
+            json.dumps({'bus_id': 'B1', 'latitude': 19.03, 'longitude': 73.02}),
+            json.dumps({'bus_id': 'NOPE', 'latitude': 19.03, 'longitude': 73.02}),
+            json.dumps({'bus_id': 'B2', 'latitude': 'x', 'longitude': 73.02}),
+            "not json",
+            json.dumps({'bus_id': 'B2', 'latitude': 19.05}),
+        ])
+        response = self.client.post(self.url, body, content_type='application/x-ndjson')
+        data = response.json()
+        self.assertEqual(data['status'], 'partial')
+        self.assertEqual(data['created'], 1)
+        self.assertEqual([e['index'] for e in data['errors']], [1, 2, 3, 4])
+        self.assertEqual(Location.objects.count(), 1)
+
+    def test_bad_bus_id_is_a_row_error(self):
+        Bus.objects.create(bus_id='7', category='AC', capacity=40)
+        fixes = [
+            {'bus_id': ['B1'], 'latitude': 19.03, 'longitude': 73.02},
+            {'bus_id': {'id': 'B1'}, 'latitude': 19.03, 'longitude': 73.02},
+            {'bus_id': 7, 'latitude': 19.03, 'longitude': 73.02},
+        ]
+        data = self.client.post(self.url, json.dumps(fixes), content_type='application/json').json()
+        self.assertEqual((data['created'], [e['index'] for e in data['errors']]), (1, [0, 1]))
+        self.assertEqual(data['errors'][0]['error'], "bus_id must be a string")
+
+    def test_empty_body(self):
+        response = self.client.post(self.url, '[]', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class LatestLocationTests(TestCase):
+    def test_single_update_refreshes_store(self):
+        Bus.objects.create(bus_id='B1', category='AC', capacity=40)
+        for lat in (19.01, 19.02):
+            self.client.post(
+                reverse('update_location'),
+                json.dumps({'bus_id': 'B1', 'latitude': lat, 'longitude': 73.0}),
+                content_type='application/json',
+            )
+        response = self.client.get(reverse('bus_locations_api', args=['B1']))
+        self.assertEqual(response.json(), [{'lat': 19.02, 'lng': 73.0}])
+
+    def test_older_fix_does_not_overwrite_newer(self):
+        bus = Bus.objects.create(bus_id='B1', category='AC', capacity=40)
+        newer = timezone.now() + timedelta(minutes=1)
+        LatestLocation.objects.create(bus=bus, latitude=19.5, longitude=73.5, timestamp=newer)
+        # A fix that arrives late, or replayed
+        Location.objects.create(bus=bus, latitude=19.0, longitude=73.0)
+        latest = LatestLocation.objects.get(bus=bus)
+        self.assertEqual((latest.latitude, latest.timestamp), (19.5, newer))
+        Location.objects.filter(bus=bus).update(timestamp=newer + timedelta(seconds=1))
+        update_latest(Location.objects.select_related('bus'))
+        self.assertEqual(LatestLocation.objects.get(bus=bus).latitude, 19.0)
+
+    def test_fleet_snapshot_query_count_is_constant(self):
+        now = timezone.now()
+        for size in (10, 100, 1000):
+            LatestLocation.objects.all().delete()
+            Bus.objects.all().delete()
+            buses = Bus.objects.bulk_create(
+                Bus(bus_id=f"B{i}", category='AC', capacity=40) for i in range(size)
+            )
+            LatestLocation.objects.bulk_create(
+                LatestLocation(bus=bus, latitude=19.0, longitude=73.0, timestamp=now) for bus in buses
+            )
+            # Version lookup + snapshot
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse('all_bus_locations'))
+            self.assertEqual(len(response.json()), size)
+
+
+@override_settings(FLEET_VERSION_LAG=0)
+class LocationDeltaTests(TestCase):
+    def setUp(self):
+        for bus_id in ('B1', 'B2', 'B3'):
+            Bus.objects.create(bus_id=bus_id, category='AC', capacity=40)
+        self.post([('B1', 19.0), ('B2', 19.0), ('B3', 19.0)])
+
+    def post(self, fixes):
+        self.client.post(
+            reverse('update_locations_bulk'),
+            json.dumps([{'bus_id': b, 'latitude': lat, 'longitude': 73.0} for b, lat in fixes]),
+            content_type='application/json',
+        )
+
+    def test_since_returns_only_moved_buses(self):
+        version = self.client.get(reverse('all_bus_locations'))['X-Location-Version']
+        self.post([('B2', 19.5)])
+        response = self.client.get(reverse('all_bus_locations'), {'since': version})
+        self.assertEqual(response.json(), [{'id': 'B2', 'lat': 19.5, 'lng': 73.0}])
+        self.assertGreater(int(response['X-Location-Version']), int(version))
+
+    @override_settings(FLEET_VERSION_LAG=5)
+    def test_write_committed_late_is_not_skipped(self):
+        version = self.client.get(reverse('all_bus_locations'))['X-Location-Version']
+        # Stamped a second before the poll, committed after it
+        LatestLocation.objects.filter(bus__bus_id='B3').update(latitude=19.9, version=next_fleet_version() - 1_000_000)
+        response = self.client.get(reverse('all_bus_locations'), {'since': version})
+        self.assertIn({'id': 'B3', 'lat': 19.9, 'lng': 73.0}, response.json())
+
+    def test_not_modified(self):
+        response = self.client.get(reverse('all_bus_locations'))
+        with self.assertNumQueries(1):
+            again = self.client.get(reverse('all_bus_locations'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        since = self.client.get(reverse('all_bus_locations'), {'since': response['X-Location-Version']})
+        self.assertEqual(since.status_code, 304)
+
+        self.post([('B1', 19.7)])
+        changed = self.client.get(reverse('all_bus_locations'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(len(changed.json()), 3)
+
+
+class PositionStreamTests(TestCase):
+    async def test_broker_delivers_from_other_threads(self):
+        broker = PositionBroker()
+        fleet = broker.subscribe()
+        one_bus = broker.subscribe('B2')
+        thread = threading.Thread(target=broker.publish, args=([
+            {'id': 'B1', 'lat': 19.0, 'lng': 73.0},
+            {'id': 'B1', 'lat': 19.1, 'lng': 73.1},
+            {'id': 'B2', 'lat': 19.2, 'lng': 73.2},
+        ],))
+        thread.start()
+        thread.join()
+        self.assertEqual(await fleet.next_batch(1), [
+            {'id': 'B1', 'lat': 19.1, 'lng': 73.1},
+            {'id': 'B2', 'lat': 19.2, 'lng': 73.2},
+        ])
+        self.assertEqual(await one_bus.next_batch(1), [{'id': 'B2', 'lat': 19.2, 'lng': 73.2}])
+        self.assertEqual(await one_bus.next_batch(0.01), [])
+
+    async def test_stream_starts_with_snapshot(self):
+        bus = await Bus.objects.acreate(bus_id='B1', category='AC', capacity=40)
+        await LatestLocation.objects.acreate(bus=bus, latitude=19.0, longitude=73.0, timestamp=timezone.now())
+        response = await self.async_client.get(reverse('bus_locations_stream'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        first = await anext(aiter(response.streaming_content))
+        self.assertEqual(first, b'data: [{"id": "B1", "lat": 19.0, "lng": 73.0}]\n\n')
+
+    def test_wsgi_request_is_refused(self):
+        response = self.client.get(reverse('bus_locations_stream'))
+        self.assertEqual(response.status_code, 503)
+
+
+class LocationRetentionTests(SimpleTestCase):
+    def fixes(self, *offsets, lat=19.0):
+        start = timezone.now()
+        return [(start + timedelta(seconds=s), lat + s * 1e-5, 73.0) for s in offsets]
+
+    def test_split_trips_on_gaps(self):
+        trips = list(split_trips(self.fixes(0, 10, 20, 2000, 2010), gap=600))
+        self.assertEqual([len(t) for t in trips], [3, 2])
+
+    def test_downsample_keeps_ends(self):
+        fixes = self.fixes(*range(0, 100, 5))
+        kept = downsample(fixes, 30)
+        self.assertEqual([f[0] for f in kept], [fixes[0][0], fixes[6][0], fixes[12][0], fixes[18][0], fixes[-1][0]])
+
+    def test_simplify_straight_line(self):
+        fixes = self.fixes(*range(50))
+        self.assertEqual(simplify(fixes, 1.0), [fixes[0], fixes[-1]])
+
+    def test_simplify_keeps_corner(self):
+        start = timezone.now()
+        fixes = [(start + timedelta(seconds=i), 19.0 + min(i, 10) * 1e-4, 73.0 + max(i - 10, 0) * 1e-4)
+                 for i in range(21)]
+        self.assertEqual(simplify(fixes, 1.0), [fixes[0], fixes[10], fixes[20]])
+
+
+class CompactLocationsCommandTests(TestCase):
+    def test_compacts_old_fixes_only(self):
+        bus = Bus.objects.create(bus_id='B1', category='AC', capacity=40)
+        Location.objects.bulk_create(
+            Location(bus=bus, latitude=19.0 + i * 1e-4, longitude=73.0) for i in range(130)
+        )
+        old_start = timezone.now() - timedelta(days=10)
+        ids = list(Location.objects.order_by('id').values_list('id', flat=True))
+        for n, pk in enumerate(ids[:120]):
+            # Two trips of 60 fixes, 5 s apart, with an hour between them
+            Location.objects.filter(pk=pk).update(
+                timestamp=old_start + timedelta(seconds=n * 5 + (3600 if n >= 60 else 0))
+            )
+
+        call_command('compact_locations', days=7, batch=50, stdout=StringIO())
+
+        self.assertEqual(Location.objects.count(), 10)
+        tracks = list(LocationTrack.objects.order_by('started_at'))
+        self.assertEqual([t.raw_count for t in tracks], [60, 60])
+        self.assertEqual(tracks[0].points[0], [0, 19.0, 73.0])
+        self.assertLess(len(tracks[0].points), 60)
+
+    def test_dry_run_changes_nothing(self):
+        bus = Bus.objects.create(bus_id='B1', category='AC', capacity=40)
+        Location.objects.create(bus=bus, latitude=19.0, longitude=73.0)
+        Location.objects.update(timestamp=timezone.now() - timedelta(days=30))
+        call_command('compact_locations', dry_run=True, stdout=StringIO())
+        self.assertEqual(Location.objects.count(), 1)
+        self.assertFalse(LocationTrack.objects.exists())
+
+
+class AvailableBusesTests(TestCase):
+    def setUp(self):
+        invalidate_network_index()
+        bus = Bus.objects.create(bus_id='B1', category='AC', capacity=40)
+        route = Route.objects.create(route_no='9', source='Vashi', destination='Belapur', distance=12)
+        for order, name in enumerate(['Vashi', 'Sanpada', 'Nerul', 'Belapur']):
+            stop = BusStop.objects.create(name=name, latitude=19.0, longitude=73.0)
+            RouteStop.objects.create(route=route, bus_stop=stop, stop_order=order, distance_from_start=order * 3)
+        expanded.invalidate()
+        # Midday, so the late bus is still to come whenever the suite runs
+        noon = timezone.make_aware(datetime.combine(timezone.localdate(), clock_time(12)))
+        patcher = mock.patch('django.utils.timezone.now', return_value=noon)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Reaches Sanpada, 3 km on, at 23:59
+        self.schedule = Schedule.objects.create(bus=bus, route=route, departure_time='23:50', available_seats=40)
+        self.route = route
+        self.url = '/api/available-buses/'
+
+    def test_direct_route(self):
+        data = self.client.get(self.url, {'from': 'sanpada', 'to': 'Belapur'}).json()
+        trip = TripInstance.objects.get(schedule=self.schedule, service_date=timezone.localdate())
+        self.assertEqual(data, [{'trip_id': trip.id, 'schedule_id': self.schedule.id, 'route_no': '9', 'from': 'sanpada',
+                                 'to': 'Belapur', 'type': 'AC', 'time': '11:59 PM', 'seats_left': 40}])
+        self.assertEqual(self.client.get(self.url, {'from': 'Nerul', 'to': 'Vashi'}).json(), [])
+        self.assertEqual(self.client.get(self.url, {'from': 'Nerul'}).json()[0]['to'], 'Belapur')
+
+    def test_warm_index_needs_one_query(self):
+        self.client.get(self.url, {'from': 'Vashi'})
+        with self.assertNumQueries(1):
+            self.client.get(self.url, {'from': 'Vashi', 'to': 'Nerul'})
+
+    def test_index_invalidated_on_change(self):
+        self.client.get(self.url, {'from': 'Vashi'})
+        stop = BusStop.objects.create(name='Kharghar', latitude=19.0, longitude=73.0)
+        with self.captureOnCommitCallbacks(execute=True):
+            RouteStop.objects.create(route=self.route, bus_stop=stop, stop_order=9, distance_from_start=20)
+        self.assertEqual(len(self.client.get(self.url, {'from': 'Vashi', 'to': 'Kharghar'}).json()), 1)
+
+
+class JourneyPlannerTests(TestCase):
+    def setUp(self):
+        timetables.invalidate()
+        bus = Bus.objects.create(bus_id='B1', category='AC', capacity=40)
+        stops = {name: BusStop.objects.create(name=name, latitude=19.0, longitude=73.0)
+                 for name in ['Vashi', 'Sanpada', 'Nerul', 'Belapur', 'Kharghar']}
+
+        def route(route_no, names, departures):
+            r = Route.objects.create(route_no=route_no, source=names[0], destination=names[-1], distance=10)
+            for order, name in enumerate(names):
+                # 20 km/h: 5 km per 15 minutes
+                RouteStop.objects.create(route=r, bus_stop=stops[name], stop_order=order, distance_from_start=order * 5)
+            for departure in departures:
+                Schedule.objects.create(bus=bus, route=r, departure_time=departure, available_seats=40)
+
+        route('1', ['Vashi', 'Sanpada', 'Nerul'], ['08:00', '09:00'])
+        route('2', ['Nerul', 'Belapur', 'Kharghar'], ['08:31', '08:40', '09:00'])
+        route('3', ['Vashi', 'Kharghar'], ['10:00'])
+
+    def plan(self, **params):
+        return self.client.get(reverse('plan_journey'), params).json()
+
+    def test_transfer_journey(self):
+        data = self.plan(**{'from': 'vashi', 'to': 'Kharghar', 'time': '07:50'})
+        # Direct bus at 10:00, or a faster change at Nerul
+        self.assertEqual([(j['transfers'], j['arrival']) for j in data['journeys']], [(0, '10:15'), (1, '09:10')])
+        journey = data['journeys'][1]
+        self.assertEqual(journey['arrival'], '09:10')
+        # 08:30 arrival at Nerul misses the 08:31 bus because of the transfer buffer
+        self.assertEqual([(leg['route_no'], leg['departure'], leg['arrival']) for leg in journey['legs']],
+                         [('1', '08:00', '08:30'), ('2', '08:40', '09:10')])
+
+    def test_direct_journey_preferred_when_faster(self):
+        data = self.plan(**{'from': 'Vashi', 'to': 'Kharghar', 'time': '09:30'})
+        self.assertEqual([(j['transfers'], j['arrival']) for j in data['journeys']], [(0, '10:15')])
+
+    def test_only_buses_running_that_day(self):
+        never = ServiceCalendar.objects.create(name='Never', **{day: False for day in ServiceCalendar.WEEKDAYS})
+        Schedule.objects.filter(route__route_no='3').update(calendar=never)
+        data = self.plan(**{'from': 'Vashi', 'to': 'Kharghar', 'time': '07:50'})
+        self.assertEqual([(j['transfers'], j['arrival']) for j in data['journeys']], [(1, '09:10')])
+        # An extra day of service is planned with as soon as it is saved
+        with self.captureOnCommitCallbacks(execute=True):
+            ServiceException.objects.create(calendar=never, date=timezone.localdate(), runs=True)
+        data = self.plan(**{'from': 'Vashi', 'to': 'Kharghar', 'time': '07:50'})
+        self.assertEqual([(j['transfers'], j['arrival']) for j in data['journeys']], [(0, '10:15'), (1, '09:10')])
+
+    def test_transfer_limit(self):
+        data = self.plan(**{'from': 'Vashi', 'to': 'Kharghar', 'time': '07:50', 'max_transfers': 0})
+        self.assertEqual(data['journeys'][0]['arrival'], '10:15')
+
+    def test_errors(self):
+        self.assertEqual(self.client.get(reverse('plan_journey'), {'from': 'Vashi'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('plan_journey'), {'from': 'Vashi', 'to': 'Nowhere'}).status_code, 404)
+
+
+class NearbyStopsTests(TestCase):
+    def test_matches_brute_force(self):
+        rng = random.Random(7)
+        stops = [(i, f"S{i}", 18.9 + rng.random() * 0.3, 72.9 + rng.random() * 0.3) for i in range(500)]
+        index = StopIndex(stops)
+        for _ in range(50):
+            lat, lng = 18.9 + rng.random() * 0.3, 72.9 + rng.random() * 0.3
+            expected = sorted(stops, key=lambda s: haversine(lat, lng, s[2], s[3]))[:7]
+            self.assertEqual([r[1] for r in index.nearest(lat, lng, 7)], [s[0] for s in expected])
+
+    def test_endpoint(self):
+        stop_index.invalidate()
+        BusStop.objects.create(name='Vashi', latitude=19.0771, longitude=72.9986)
+        BusStop.objects.create(name='Nerul', latitude=19.0330, longitude=73.0297)
+        data = self.client.get(reverse('nearby_stops'), {'lat': 19.034, 'lng': 73.03, 'k': 1}).json()
+        self.assertEqual(data[0]['name'], 'Nerul')
+        self.assertAlmostEqual(data[0]['distance_m'], 114, delta=5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            BusStop.objects.create(name='Seawoods', latitude=19.034, longitude=73.03)
+        data = self.client.get(reverse('nearby_stops'), {'lat': 19.034, 'lng': 73.03, 'k': 3}).json()
+        self.assertEqual([s['name'] for s in data], ['Seawoods', 'Nerul', 'Vashi'])
+        self.assertEqual(self.client.get(reverse('nearby_stops'), {'lat': 'x'}).status_code, 400)
+
+
+class ArrivalPredictionTests(TestCase):
+    # Four stops due north, 0.01 degrees (~1.11 km) apart
+    ROWS = [(1, 10 + i, 19.0 + i * 0.01, 73.0, i * 1.11) for i in range(4)]
+
+    def test_compute_arrivals(self):
+        shapes = RouteShapes(self.ROWS + [(2, 20, 19.0, 73.1, 0.0), (2, 21, 19.0, 73.2, 10.5)])
+        now = timezone.now()
+        latest = {7: (now, 19.005, 73.0005), 8: (now, 19.0, 73.15)}
+        earlier = {7: (now - timedelta(minutes=2), 19.0, 73.0)}
+        arrivals = compute_arrivals(shapes, [(7, 'B7', 1, '9'), (8, 'B8', 2, '5')], latest, earlier, now)
+
+        self.assertNotIn(10, arrivals)
+        # B7 moved 0.555 km in 2 minutes: 16.65 km/h, 0.555 km from stop 11
+        eta, bus_id, route_no, distance = arrivals[11][0]
+        self.assertEqual((bus_id, route_no, distance), ('B7', '9', 0.56))
+        self.assertAlmostEqual(eta, 120, delta=2)
+        self.assertAlmostEqual(arrivals[13][0][0], 600, delta=3)
+        # B8 has no earlier fix and runs at the default speed, 5.25 km to go
+        self.assertAlmostEqual(arrivals[21][0][0], 945, delta=3)
+
+    def test_stop_arrivals_endpoint(self):
+        route_shapes.invalidate()
+        bus = Bus.objects.create(bus_id='B1', category='AC', capacity=40)
+        route = Route.objects.create(route_no='9', source='A', destination='D', distance=3.33)
+        stops = []
+        for _, _, lat, lng, dist in self.ROWS:
+            stop = BusStop.objects.create(name=f"S{dist}", latitude=lat, longitude=lng)
+            RouteStop.objects.create(route=route, bus_stop=stop, stop_order=len(stops), distance_from_start=dist)
+            stops.append(stop)
+        schedule = Schedule.objects.create(bus=bus, route=route, departure_time='08:00', available_seats=40)
+        user = User.objects.create_user('conductor')
+        profile = ConductorProfile.objects.create(user=user, employee_id='C1001')
+        ActiveTrip.objects.create(conductor=profile, bus=bus, schedule=schedule)
+        Location.objects.create(bus=bus, latitude=19.015, longitude=73.0)
+
+        data = self.client.get(reverse('stop_arrivals', args=[stops[3].id])).json()
+        self.assertEqual([(a['bus_id'], a['route_no'], a['distance_km']) for a in data], [('B1', '9', 1.67)])
+        self.assertEqual(self.client.get(reverse('stop_arrivals', args=[stops[0].id])).json(), [])
+
+
+def make_trip(seats):
+    bus = Bus.objects.create(bus_id='B1', category='AC', capacity=seats)
+    route = Route.objects.create(route_no='9', source='A', destination='B', distance=10)
+    schedule = Schedule.objects.create(bus=bus, route=route, departure_time='08:00', available_seats=seats)
+    return trip_for(schedule.id)
+
+
+class SeatInventoryTests(TestCase):
+    def test_hold_confirm_and_sold_out(self):
+        trip = make_trip(3)
+        hold = hold_seats(trip.id, 2)
+        hold.order_id = 'order_1'
+        hold.save()
+        with self.assertRaises(SoldOut):
+            reserve_seats(trip.id, 2)
+        self.assertEqual(confirm_hold('order_1').status, SeatHold.CONFIRMED)
+        # Confirming twice does not take seats twice
+        confirm_hold('order_1')
+        trip.refresh_from_db()
+        self.assertEqual(trip.available_seats, 1)
+        # Other days of the schedule keep their own seats
+        tomorrow = trip_for(trip.schedule_id, trip.service_date + timedelta(days=1))
+        self.assertEqual(tomorrow.available_seats, 3)
+
+    def test_expired_hold_returns_seats(self):
+        trip = make_trip(2)
+        hold = hold_seats(trip.id, 2, minutes=-1)
+        hold.order_id = 'order_1'
+        hold.save()
+        # The sold-out attempt reclaims the expired hold
+        reserve_seats(trip.id, 1)
+        self.assertEqual(SeatHold.objects.get().status, SeatHold.RELEASED)
+        # Paying late re-reserves when seats are left, else fails
+        with self.assertRaises(SoldOut):
+            confirm_hold('order_1')
+        self.assertEqual(release_expired_holds(), 0)
+        # Released seats go back to the trip, never to the schedule new trips are made from
+        trip.schedule.refresh_from_db()
+        self.assertEqual(trip.schedule.available_seats, 2)
+
+    def test_create_order_rejects_sold_out(self):
+        trip = make_trip(1)
+        self.client.force_login(User.objects.create_user('rider'))
+        response = self.client.post(
+            reverse('create_order'),
+            json.dumps({'tickets': 2, 'schedule_id': trip.schedule_id}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 409)
+
+
+class SeatInventoryConcurrencyTests(TransactionTestCase):
+    def test_no_oversell_under_contention(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("needs a database that threads can share")
+        trip = make_trip(40)
+        sold = []
+
+        def buyer():
+            try:
+                for _ in range(10):
+                    try:
+                        reserve_seats(trip.id, 1)
+                        sold.append(1)
+                    except SoldOut:
+                        pass
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buyer) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        trip.refresh_from_db()
+        self.assertEqual(len(sold), 40)
+        self.assertEqual(trip.available_seats, 0)
+
+
+class ServiceTripTests(TestCase):
+    def setUp(self):
+        bus = Bus.objects.create(bus_id='B1', category='AC', capacity=40)
+        self.route = Route.objects.create(route_no='9', source='Vashi', destination='Nerul', distance=6)
+        for order, name in enumerate(['Vashi', 'Sanpada', 'Nerul']):
+            stop = BusStop.objects.create(name=name, latitude=19.0, longitude=73.0)
+            RouteStop.objects.create(route=self.route, bus_stop=stop, stop_order=order, distance_from_start=order * 3)
+        self.weekdays = ServiceCalendar.objects.create(name='WEEKDAY', saturday=False, sunday=False)
+        self.monday = timezone.localdate() - timedelta(days=timezone.localdate().weekday())
+        # A holiday on Wednesday
+        ServiceException.objects.create(calendar=self.weekdays, date=self.monday + timedelta(days=2), runs=False)
+        self.daily = Schedule.objects.create(bus=bus, route=self.route, departure_time='08:00', available_seats=40)
+        self.office = Schedule.objects.create(bus=bus, route=self.route, departure_time='09:00', available_seats=30,
+                                              calendar=self.weekdays)
+
+    def test_expand_follows_calendar(self):
+        self.assertEqual(expand_trips(self.monday, self.monday + timedelta(days=6)), 7 + 4)
+        self.assertEqual(expand_trips(self.monday, self.monday + timedelta(days=6)), 0)
+        days = TripInstance.objects.filter(schedule=self.office).values_list('service_date', flat=True)
+        self.assertEqual(sorted(day.weekday() for day in days), [0, 1, 3, 4])
+        trip = TripInstance.objects.get(schedule=self.office, service_date=self.monday)
+        self.assertEqual(trip.available_seats, 30)
+        # 3 km at 20 km/h between stops
+        self.assertEqual(
+            [timezone.localtime(d.departs_at).strftime('%H:%M') for d in trip.stop_departures.order_by('stop_order')],
+            ['09:00', '09:09', '09:18'],
+        )
+        self.assertEqual(StopDeparture.objects.count(), 3 * 11)
+
+    def test_refresh_keeps_sold_trips(self):
+        today = timezone.localdate()
+        sold = trip_for(self.daily.id, today)
+        hold = hold_seats(sold.id, 2)
+        booked = trip_for(self.daily.id, today + timedelta(days=2))
+        booking = Booking.objects.create(user=User.objects.create_user('rider'), route='9', trip=booked, seats=1, fare=10)
+        unsold = trip_for(self.daily.id, today + timedelta(days=1))
+        Schedule.objects.filter(id=self.daily.id).update(departure_time='08:30')
+        refresh_trips([self.route.id])
+
+        self.assertTrue(SeatHold.objects.filter(id=hold.id, trip=sold).exists())
+        booking.refresh_from_db()
+        self.assertEqual(booking.trip_id, booked.id)
+
+        sold.refresh_from_db()
+        self.assertEqual((timezone.localtime(sold.departs_at).strftime('%H:%M'), sold.available_seats), ('08:30', 38))
+        self.assertEqual(sold.stop_departures.count(), 3)
+        self.assertFalse(TripInstance.objects.filter(id=unsold.id).exists())
+        self.assertEqual(trip_for(self.daily.id, today + timedelta(days=1)).available_seats, 40)
+
+    def test_trip_for_day_off(self):
+        saturday = self.monday + timedelta(days=5)
+        self.assertIsNone(trip_for(self.office.id, saturday))
+        self.assertEqual(trip_for(self.daily.id, saturday).service_date, saturday)
+
+    def test_prune_keeps_booked_trips(self):
+        last_week = self.monday - timedelta(days=7)
+        expand_trips(last_week, last_week + timedelta(days=1))
+        booked = TripInstance.objects.filter(service_date=last_week).first()
+        Booking.objects.create(user=User.objects.create_user('rider'), route='9', trip=booked, seats=1, fare=10)
+        self.assertEqual(prune_trips(self.monday), 3)
+        self.assertEqual(list(TripInstance.objects.values_list('id', flat=True)), [booked.id])
+        self.assertFalse(StopDeparture.objects.exists())
+
+
+class PaymentGatewayTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = StubGateway().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stub.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.stub.latency, self.stub.fail_next, self.stub.drop_next, self.stub.requests = 0, 0, 0, 0
+
+    def gateway(self, **options):
+        gateway = Gateway('key', 'secret', base_url=self.stub.url, backoff=0, **options)
+        self.addCleanup(gateway.executor.shutdown)
+        return gateway
+
+    def test_retries_on_one_connection(self):
+        gateway = self.gateway(retries=2)
+        connections = self.stub.connections
+        self.stub.fail_next = 2
+        order = gateway.create_order(3000, receipt='hold_1')
+        self.assertEqual((order['amount'], order['receipt'], order['status']), (3000, 'hold_1', 'created'))
+        self.assertEqual(gateway.fetch_order(order['id'])['id'], order['id'])
+        # A failed order, a failed and a good lookup by receipt, the order, the fetch:
+        # all over one kept-alive connection
+        self.assertEqual((self.stub.requests, self.stub.connections - connections), (5, 1))
+
+    def test_lost_answer_does_not_create_a_second_order(self):
+        self.stub.drop_next = 1
+        order = self.gateway(retries=2).create_order(3000, receipt='hold_2')
+        self.assertEqual([o['id'] for o in self.stub.orders.values() if o['receipt'] == 'hold_2'], [order['id']])
+        self.assertEqual(self.stub.requests, 2)
+
+    def test_gives_up(self):
+        self.stub.fail_next = 5
+        with self.assertRaises(GatewayError):
+            self.gateway(retries=1).fetch_order('order_1')
+        self.assertEqual(self.stub.requests, 2)
+
+        # An order without a receipt can't be looked up, so it is never sent twice
+        self.stub.requests = 0
+        with self.assertRaises(GatewayError):
+            self.gateway(retries=1).create_order(3000)
+        self.assertEqual(self.stub.requests, 1)
+
+        self.stub.latency = 0.5
+        start = time.perf_counter()
+        with self.assertRaisesMessage(GatewayError, 'unavailable'):
+            self.gateway(retries=1, timeout=(1, 0.05)).create_order(3000)
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+    def test_rejection_is_not_retried(self):
+        with self.assertRaises(PaymentRejected):
+            self.gateway().create_order(50)
+        self.assertEqual(self.stub.requests, 1)
+
+    def test_async_calls_overlap(self):
+        self.stub.latency = 0.2
+        gateway = self.gateway(pool_size=10)
+
+        async def orders():
+            return await asyncio.gather(*(gateway.acreate_order(1000) for _ in range(10)))
+
+        start = time.perf_counter()
+        self.assertEqual(len({order['id'] for order in asyncio.run(orders())}), 10)
+        self.assertLess(time.perf_counter() - start, 1.0)
+
+
+class OnlinePaymentTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = StubGateway().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stub.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        settings_override = override_settings(PAYMENT_GATEWAY_URL=self.stub.url, PAYMENT_GATEWAY_BACKOFF=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        reset_gateway()
+        self.addCleanup(reset_gateway)
+        self.stub.fail_next = 0
+        self.stub.payments.clear()
+        self.trip = make_trip(5)
+        self.user = User.objects.create_user('rider')
+        self.client.force_login(self.user)
+
+    def order(self, **data):
+        return self.client.post(reverse('create_order'), json.dumps(data), content_type='application/json')
+
+    def paid_order(self, tickets=2):
+        order = self.order(tickets=tickets, trip_id=self.trip.id, route_no='9', **{'from': 'A', 'to': 'B'}).json()
+        return order['id'], self.stub.pay(order['id'])['id']
+
+    def report(self, order_id, payment_id, signature=None, **data):
+        if signature is None:
+            signature = hmac.new(settings.RAZORPAY_KEY_SECRET.encode(), f'{order_id}|{payment_id}'.encode(),
+                                 hashlib.sha256).hexdigest()
+        return self.client.post(reverse('payment_success'), json.dumps(
+            {'order_id': order_id, 'payment_id': payment_id, 'signature': signature, **data}
+        ), content_type='application/json')
+
+    def test_order_holds_seats(self):
+        # Priced at the route's fare, whatever the page says
+        response = self.order(amount=100, tickets=2, trip_id=self.trip.id)
+        self.assertEqual(response.status_code, 200)
+        hold = SeatHold.objects.get()
+        self.assertEqual((hold.order_id, hold.seats, response.json()['receipt']), (response.json()['id'], 2, f'hold_{hold.id}'))
+        self.assertEqual(response.json()['amount'], 2000)
+        self.assertEqual(PaymentOrder.objects.get().amount, 2000)
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.available_seats, 3)
+
+    def test_bad_order_is_rejected(self):
+        for body in ('not json', '[1]', json.dumps({'trip_id': 'x'}), json.dumps({'schedule_id': [1]}),
+                     json.dumps({'trip_id': self.trip.id, 'tickets': 'two'}),
+                     json.dumps({'trip_id': self.trip.id, 'tickets': -1})):
+            with self.subTest(body=body):
+                response = self.client.post(reverse('create_order'), body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(SeatHold.objects.exists())
+
+    def test_bad_payment_report_is_rejected(self):
+        for body in ('not json', '[1]', json.dumps({'order_id': ['o'], 'payment_id': 'p', 'signature': 's'})):
+            with self.subTest(body=body):
+                response = self.client.post(reverse('payment_success'), body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+
+    def test_gateway_down_releases_hold(self):
+        self.stub.fail_next = 10
+        response = self.order(tickets=1, schedule_id=self.trip.schedule_id)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(SeatHold.objects.get().status, SeatHold.RELEASED)
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.available_seats, 5)
+
+    def test_payment_success_is_idempotent(self):
+        order_id, payment_id = self.paid_order()
+        # The amount posted by the browser is ignored
+        first = self.report(order_id, payment_id, amount=1)
+        self.assertEqual(first.status_code, 200)
+        booking = Booking.objects.get()
+        self.assertEqual((booking.fare, booking.seats, booking.trip_id, booking.payment_id, booking.user),
+                         (20, 2, self.trip.id, payment_id, self.user))
+        with self.assertNumQueries(1):
+            retry = self.report(order_id, payment_id)
+        self.assertEqual(retry.json(), first.json())
+        # Knowing the order id is not enough to find the booking
+        self.assertEqual(self.report(order_id, payment_id, signature='forged').status_code, 400)
+        self.assertEqual(Booking.objects.count(), 1)
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.available_seats, 3)
+        # A racing request that missed the booking still gets it back
+        self.assertEqual(fulfil(PaymentOrder.objects.get(), get_gateway().fetch_payment(payment_id)), (booking, False))
+
+    def test_unverified_payment_is_refused(self):
+        order_id, payment_id = self.paid_order()
+        self.assertEqual(self.report(order_id, payment_id, signature='forged').status_code, 400)
+        self.assertEqual(self.report(order_id, '').status_code, 400)
+        self.stub.payments[-1]['amount'] = 100
+        self.assertEqual(self.report(order_id, payment_id).status_code, 400)
+        self.assertFalse(Booking.objects.exists())
+
+    def test_reconcile_books_unreported_payments(self):
+        reported = self.paid_order(1)
+        self.report(*reported)
+        self.paid_order(1)
+        self.paid_order(1)
+        # Paid, but not an order of ours
+        self.stub.pay(get_gateway().create_order(1000)['id'])
+        # Paid short
+        underpaid, _ = self.paid_order(1)
+        self.stub.payments[-1]['amount'] = 100
+
+        out, err = StringIO(), StringIO()
+        call_command('reconcile_payments', batch=2, stdout=out, stderr=err)
+        self.assertIn('payments: 5, booked: 2, matched: 1, unknown: 1, sold_out: 0, mismatched: 1', out.getvalue())
+        self.assertIn(underpaid, err.getvalue())
+        self.assertEqual(Booking.objects.count(), 3)
+
+        call_command('reconcile_payments', stdout=out, stderr=err)
+        self.assertIn('payments: 5, booked: 0, matched: 3, unknown: 1', out.getvalue())
+        self.assertEqual(Booking.objects.count(), 3)
+
+
+class BookingQRTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('rider', password='pw')
+        self.booking = Booking.objects.create(
+            user=self.user, schedule=make_trip(10).schedule, source='Vashi', destination='Belapur', fare=20, seats=1
+        )
+        self.client.force_login(self.user)
+
+    def test_only_the_rider_and_staff_see_the_ticket(self):
+        url = reverse('booking_qr', args=[self.booking.id, 'svg'])
+        confirmation = reverse('booking_confirmation', args=[self.booking.id])
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_login(User.objects.create_user('someone'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(confirmation).status_code, 404)
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_confirmation_does_not_store_qr(self):
+        response = self.client.get(reverse('booking_confirmation', args=[self.booking.id]))
+        self.assertContains(response, reverse('booking_qr', args=[self.booking.id, 'svg']))
+        self.booking.refresh_from_db()
+        self.assertFalse(self.booking.qr_code)
+
+    def test_svg_and_png(self):
+        svg = self.client.get(reverse('booking_qr', args=[self.booking.id, 'svg']))
+        self.assertEqual(svg['Content-Type'], 'image/svg+xml')
+        self.assertIn(b'<svg', svg.content)
+        png = self.client.get(reverse('booking_qr', args=[self.booking.id, 'png']))
+        self.assertEqual(png['Content-Type'], 'image/png')
+        self.assertTrue(png.content.startswith(b'\x89PNG'))
+
+    def test_etag(self):
+        url = reverse('booking_qr', args=[self.booking.id, 'svg'])
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(reverse('booking_qr', args=[0, 'svg'])).status_code, 404)
+
+
+class TicketTokenTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('rider', password='pw')
+        self.booking = Booking.objects.create(
+            user=user, route='9', source='Vashi', destination='Belapur', fare=20, seats=2
+        )
+
+    def test_round_trip_without_queries(self):
+        token = sign_ticket(self.booking)
+        with self.assertNumQueries(0):
+            ticket = verify_ticket_token(token)
+        self.assertEqual(ticket['booking_id'], self.booking.id)
+        self.assertEqual((ticket['source'], ticket['destination'], ticket['seats']), ('Vashi', 'Belapur', 2))
+        self.assertEqual(ticket_key(int(token.split('.')[0])), ticket_key(active_key_ids()[-2]))
+
+    def test_rejects_tampering_and_expiry(self):
+        key_id, payload, signature = sign_ticket(self.booking).split('.')
+        forged = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        forged[5] = 9
+        forged = base64.urlsafe_b64encode(json.dumps(forged).encode()).rstrip(b'=').decode()
+        for token in (f'{key_id}.{forged}.{signature}', f'{int(key_id) + 1}.{payload}.{signature}', 'x.y', '1.2.3'):
+            with self.assertRaises(TicketError):
+                verify_ticket_token(token)
+        with self.assertRaisesMessage(TicketError, 'expired'):
+            verify_ticket_token(f'{key_id}.{payload}.{signature}', now=time.time() + 25 * 3600)
+
+    def test_verify_view_accepts_token_once(self):
+        url = reverse('verify_ticket')
+        token = sign_ticket(self.booking)
+        self.assertTrue(self.client.get(url, {'data': token}).json()['valid'])
+        self.assertEqual(self.client.get(url, {'data': token}).json()['message'], 'Ticket already used')
+        self.assertFalse(self.client.get(url, {'data': token[:-2] + 'AA'}).json()['valid'])
+
+    def test_keys_only_for_conductors(self):
+        self.assertEqual(self.client.get(reverse('ticket_keys')).status_code, 403)
+        user = User.objects.create_user('cond', password='pw')
+        ConductorProfile.objects.create(user=user, employee_id='C1')
+        self.client.force_login(user)
+        keys = self.client.get(reverse('ticket_keys')).json()['keys']
+        self.assertEqual(list(map(int, keys)), active_key_ids())
+
+
+class BookingHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('rider', password='pw')
+        self.bookings = [
+            Booking.objects.create(user=self.user, route='9', seats=1 + i % 2, fare=10 + i) for i in range(25)
+        ]
+        self.client.force_login(self.user)
+
+    def test_stats_follow_bookings(self):
+        stats = RiderStats.objects.get(user=self.user)
+        self.assertEqual((stats.trips, stats.seats, stats.spend), (25, 37, 550))
+        self.assertEqual(stats.first_booking, self.bookings[0].booking_time)
+        self.bookings[-1].delete()
+        stats.refresh_from_db()
+        self.assertEqual((stats.trips, stats.seats, stats.spend), (24, 36, 516))
+        self.assertEqual(rebuild_rider_stats(self.user.id).spend, 516)
+
+    def test_pages_cover_history_newest_first(self):
+        response = self.client.get(reverse('my_bookings'))
+        self.assertEqual(len(response.context['bookings']), 20)
+        self.assertContains(response, '₹550')
+        ids = [b['id'] for b in response.context['bookings']]
+        cursor = response.context['next_cursor']
+        while cursor:
+            data = self.client.get(reverse('my_bookings_api'), {'after': cursor}).json()
+            ids += [b['id'] for b in data['bookings']]
+            cursor = data['next']
+        self.assertEqual(ids, [b.id for b in reversed(self.bookings)])
+
+    def test_page_query_is_lean(self):
+        with CaptureQueriesContext(connection) as queries:
+            history_page(self.user.id)
+        self.assertNotIn('qr_code', queries[0]['sql'])
+        self.assertEqual(self.client.get(reverse('my_bookings_api'), {'after': 'x'}).status_code, 400)
+
+
+class HotQueryIndexTests(TestCase):
+    def test_hot_queries_use_indexes(self):
+        out = StringIO()
+        call_command('explain_hot_queries', users=20, bookings=2000, buses=5, fixes=2000, repeat=1, stdout=out)
+        self.assertIn("Every hot query is served by an index.", out.getvalue())
+        # The seeded rows are rolled back
+        self.assertFalse(Booking.objects.exists())
+
+
+class ReferenceDataTests(TestCase):
+    def setUp(self):
+        reference_data.invalidate()
+        self.route = Route.objects.create(route_no='9', source='Vashi', destination='Belapur', distance=12)
+        for order, name in enumerate(['Vashi', 'Nerul', 'Belapur']):
+            stop = BusStop.objects.create(name=name, latitude=19.0, longitude=73.0)
+            RouteStop.objects.create(route=self.route, bus_stop=stop, stop_order=order, distance_from_start=order * 4)
+
+    def test_payloads(self):
+        self.assertEqual(self.client.get('/api/routes/').json(),
+                         [{'route_no': '9', 'source': 'Vashi', 'destination': 'Belapur'}])
+        self.assertEqual([s['name'] for s in self.client.get('/api/stops/9/').json()], ['Vashi', 'Nerul', 'Belapur'])
+        self.assertEqual(self.client.get('/api/stops/404/').json(), [])
+        self.assertEqual(self.client.get('/conductor/api/stops/').json()[0], {'name': 'Vashi'})
+        self.assertEqual(self.client.get('/conductor/api/routes/').json()[0]['distance'], 12)
+
+    def test_warm_cache_needs_no_query(self):
+        first = self.client.get('/api/stops/')
+        self.assertEqual(first['Cache-Control'], f'public, max-age={REFERENCE_MAX_AGE}')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/stops/').content, first.content)
+            response = self.client.get('/api/stops/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_invalidated_on_change(self):
+        before = self.client.get('/api/stops/')
+        with self.captureOnCommitCallbacks(execute=True):
+            BusStop.objects.create(name='Kharghar', latitude=19.0, longitude=73.0)
+        after = self.client.get('/api/stops/', HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(after.status_code, 200)
+        self.assertEqual(len(after.json()), 4)
+        self.assertNotEqual(after['X-Reference-Version'], before['X-Reference-Version'])
+
+
+@override_settings(NETWORK_SNAPSHOT_ROOT=tempfile.mkdtemp())
+class NetworkSnapshotTests(TestCase):
+    def setUp(self):
+        network_snapshot.invalidate()
+        bus = Bus.objects.create(bus_id='B1', category='AC', capacity=40)
+        self.route = Route.objects.create(route_no='9', source='Vashi', destination='Belapur', distance=12)
+        for order, name in enumerate(['Vashi', 'Nerul', 'Belapur']):
+            stop = BusStop.objects.create(name=name, latitude=19.0, longitude=73.0)
+            RouteStop.objects.create(route=self.route, bus_stop=stop, stop_order=order, distance_from_start=order * 4)
+        Schedule.objects.create(bus=bus, route=self.route, departure_time='07:30', available_seats=40)
+        self.client.force_login(User.objects.create_user('rider', password='pw'))
+
+    def snapshot_url(self):
+        response = self.client.get(reverse('home'))
+        return re.search(r'fetch\("(/api/network/[0-9a-f]+\.json)"\)', response.content.decode()).group(1)
+
+    def test_page_links_snapshot(self):
+        url = self.snapshot_url()
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', response['Cache-Control'])
+        network = json.loads(gzip.decompress(response.content))
+        self.assertEqual(network['routes'], [['9', 'Vashi', 'Belapur', 12.0, [0, 1, 2]]])
+        self.assertEqual(network['schedules'], [[0, 'B1', 'AC', '07:30']])
+        self.assertEqual(self.client.get(url).json(), network)
+        digest = url.rsplit('/', 1)[1].removesuffix('.json')
+        self.assertTrue(os.path.exists(os.path.join(settings.NETWORK_SNAPSHOT_ROOT, f'network-{digest}.json.gz')))
+
+    def test_changes_get_a_new_url(self):
+        old_url = self.snapshot_url()
+        with self.captureOnCommitCallbacks(execute=True):
+            BusStop.objects.create(name='Kharghar', latitude=19.0, longitude=73.0)
+        new_url = self.snapshot_url()
+        self.assertNotEqual(new_url, old_url)
+        # Pages rendered before the change still load their snapshot from disk
+        self.assertEqual(len(self.client.get(old_url).json()['stops']), 3)
+        self.assertEqual(len(self.client.get(new_url).json()['stops']), 4)
+        self.assertEqual(self.client.get('/api/network/0123456789abcdef.json').status_code, 404)
+
+
+class GTFSTests(TestCase):
+    FEED = {
+        'stops.txt': "stop_id,stop_name,stop_lat,stop_lon,location_type\n"
+                     "ST,Vashi Station,19.07,73.00,1\nA,Vashi,19.07,73.00,0\nB,Nerul,19.03,73.02,\nC,Belapur,19.02,73.04,\n",
+        'routes.txt': "route_id,route_short_name,route_type\nr9,9,3\nr9b,9,3\nr10,10,3\n",
+        'trips.txt': "route_id,service_id,trip_id,block_id,direction_id\n"
+                     "r9,WK,t1,MH43,0\nr9,WK,t2,,0\nr9b,WK,t3,MH44,1\n",
+        'stop_times.txt': "trip_id,arrival_time,departure_time,stop_id,stop_sequence\n"
+                          "t1,07:00:00,07:00:00,A,1\nt1,07:10:00,07:10:00,B,2\nt1,07:20:00,07:20:00,C,3\n"
+                          "t2,25:30:00,25:30:00,A,1\nt2,25:45:00,25:45:00,C,2\n"
+                          "t3,08:00:00,08:00:00,C,1\nt3,08:20:00,08:20:00,A,2\n",
+        'calendar.txt': "service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date\n"
+                        "WK,1,1,1,1,1,0,0,20250101,20301231\n",
+        'calendar_dates.txt': "service_id,date,exception_type\nWK,20260126,2\n",
+    }
+
+    def setUp(self):
+        reference_data.invalidate()
+        self.feed = tempfile.mkdtemp()
+        for name, text in self.FEED.items():
+            with open(os.path.join(self.feed, name), 'w') as f:
+                f.write(text)
+        BusStop.objects.create(name='NERUL', latitude=0, longitude=0)
+
+    def test_import(self):
+        self.client.get('/api/routes/')
+        counts = import_feed(self.feed)
+        self.assertEqual((counts['stops_created'], counts['stops_updated']), (2, 1))
+        self.assertEqual((counts['routes_created'], counts['routes_skipped']), (1, 1))
+        route = Route.objects.get()
+        self.assertEqual((route.route_no, route.source, route.destination), ('9', 'Vashi', 'Belapur'))
+        self.assertEqual([rs.bus_stop.name for rs in route.route_stops.all()], ['Vashi', 'NERUL', 'Belapur'])
+        self.assertAlmostEqual(route.distance, route.route_stops.last().distance_from_start, places=2)
+        self.assertEqual(
+            sorted(Schedule.objects.values_list('bus__bus_id', 'departure_time')),
+            [('MH43', clock_time(7, 0)), ('MH44', clock_time(8, 0)), ('R9', clock_time(1, 30))],
+        )
+        calendar = ServiceCalendar.objects.get()
+        self.assertEqual((calendar.name, calendar.saturday, calendar.exceptions.get().runs), ('WK', False, False))
+        self.assertEqual(Schedule.objects.filter(calendar=calendar).count(), 3)
+        # Bulk writes still refresh the cached reference data
+        self.assertEqual(self.client.get('/api/routes/').json()[0]['route_no'], '9')
+
+    def test_reimport_keeps_schedules(self):
+        import_feed(self.feed)
+        Schedule.objects.update(available_seats=3)
+        counts = import_feed(self.feed)
+        self.assertEqual((counts['routes_updated'], counts['schedules_created'], counts['schedules_existing']), (1, 0, 3))
+        self.assertEqual(set(Schedule.objects.values_list('available_seats', flat=True)), {3})
+
+    def test_reimport_refreshes_trips(self):
+        import_feed(self.feed)
+        today = timezone.localdate()
+        expand_trips(today, today + timedelta(days=6))
+        with open(os.path.join(self.feed, 'stop_times.txt'), 'w') as f:
+            f.write(self.FEED['stop_times.txt'].replace('t1,07:00:00,07:00:00', 't1,07:05:00,07:05:00'))
+        import_feed(self.feed)
+        vashi = BusStop.objects.get(name='Vashi')
+        departures = {
+            timezone.localtime(departs_at).time()
+            for departs_at in StopDeparture.objects.filter(
+                stop=vashi, service_date__gte=today
+            ).values_list('departs_at', flat=True)
+        }
+        self.assertIn(clock_time(7, 5), departures)
+
+    def test_export_round_trip(self):
+        import_feed(self.feed)
+        out = tempfile.mkdtemp()
+        written = export_feed(out)
+        self.assertEqual((written['trips.txt'], written['stop_times.txt']), (3, 9))
+        self.assertEqual((written['calendar.txt'], written['calendar_dates.txt']), (2, 1))
+        counts = import_feed(out)
+        self.assertEqual((counts['stops_created'], counts['routes_created'], counts['schedules_created']), (0, 0, 0))
+
+    def test_bad_feed(self):
+        os.remove(os.path.join(self.feed, 'trips.txt'))
+        with self.assertRaisesMessage(GTFSError, 'trips.txt is missing'):
+            import_feed(self.feed)
+
+    def test_bad_stop_sequence(self):
+        with open(os.path.join(self.feed, 'stop_times.txt'), 'w') as f:
+            f.write(self.FEED['stop_times.txt'].replace('B,2', 'B,two'))
+        with self.assertRaisesMessage(GTFSError, "bad stop_sequence 'two'"):
+            import_feed(self.feed)
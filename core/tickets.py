@@ -0,0 +1,112 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+# Hours a ticket stays valid after it was booked.
+TICKET_VALID_HOURS = 24
+# Signatures are truncated to this many bytes to keep the QR code small.
+SIGNATURE_BYTES = 16
+TOKEN_VERSION = 1
+
+
+class TicketError(Exception):
+    """The token is malformed, forged or outside its validity window."""
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def ticket_key(key_id):
+    """
+    Signing key of one service day. Conductors download the keys of the days
+    they may see tickets from, so a leaked device only exposes those days.
+    """
+    secret = getattr(settings, 'TICKET_SIGNING_SECRET', settings.SECRET_KEY)
+    return hmac.new(secret.encode(), f'ticket-key:{key_id}'.encode(), hashlib.sha256).digest()
+
+
+def key_id_for(day):
+    return day.toordinal()
+
+
+def active_key_ids(today=None):
+    """
+    Key ids a conductor needs today: every day whose tickets can still be
+    valid, plus tomorrow for a device that stays offline past midnight.
+    """
+    today = today or timezone.now().date()
+    days = -(-TICKET_VALID_HOURS // 24)
+    return [key_id_for(today - timedelta(days=n)) for n in range(days, -2, -1)]
+
+
+def unsigned_tickets_accepted(now=None):
+    """
+    Whether a bare booking id, the QR of tickets issued before they were
+    signed, is still accepted. Anyone can print one, so only up to the
+    UNSIGNED_TICKETS_UNTIL setting (a date) while such tickets are in
+    circulation, and never when it is unset.
+    """
+    until = getattr(settings, 'UNSIGNED_TICKETS_UNTIL', None)
+    return until is not None and timezone.localdate(now) <= until
+
+
+def sign_ticket(booking):
+    """
+    Compact signed token ``<key id>.<payload>.<signature>`` for a booking.
+    The payload is a JSON array: version, booking id, route, source,
+    destination, seats, valid-from and valid-until (unix seconds).
+    """
+    issued = booking.booking_time
+    valid_from = int(issued.timestamp())
+    payload = [
+        TOKEN_VERSION, booking.id, booking.route or '', booking.source or '', booking.destination or '',
+        booking.seats, valid_from, valid_from + TICKET_VALID_HOURS * 3600,
+    ]
+    key_id = key_id_for(issued.date())
+    body = f"{key_id}.{_b64encode(json.dumps(payload, separators=(',', ':')).encode())}"
+    signature = hmac.new(ticket_key(key_id), body.encode(), hashlib.sha256).digest()[:SIGNATURE_BYTES]
+    return f"{body}.{_b64encode(signature)}"
+
+
+def verify_ticket_token(token, now=None):
+    """
+    Check a token's signature and validity window without touching the
+    database. Returns the ticket as a dict or raises TicketError.
+    """
+    try:
+        key_id, payload, signature = token.split('.')
+        body = f"{key_id}.{payload}"
+        expected = hmac.new(ticket_key(int(key_id)), body.encode(), hashlib.sha256).digest()[:SIGNATURE_BYTES]
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            raise TicketError("Invalid ticket signature")
+        version, booking_id, route, source, destination, seats, valid_from, valid_until = json.loads(_b64decode(payload))
+    except (ValueError, TypeError, UnicodeDecodeError) as exc:
+        raise TicketError("Malformed ticket") from exc
+    if version != TOKEN_VERSION:
+        raise TicketError("Unsupported ticket version")
+
+    now = time.time() if now is None else now
+    if now < valid_from - 300:
+        raise TicketError("Ticket not yet valid")
+    if now > valid_until:
+        raise TicketError("Ticket expired")
+    return {
+        'booking_id': booking_id,
+        'route': route,
+        'source': source,
+        'destination': destination,
+        'seats': seats,
+        'valid_from': valid_from,
+        'valid_until': valid_until,
+    }
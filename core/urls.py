@@ -1,4 +1,4 @@
-from django.urls import path
+from django.urls import path, re_path
 #from django.contrib.auth.views import LoginView, LogoutView
 from . import views
 from core.views import *
@@ -10,8 +10,11 @@ urlpatterns = [
     path('logout/', views.logout_view, name='logout'),
     path('book-ticket/', views.book_ticket_view, name='book_ticket'),
     path('booking-confirmation/<int:booking_id>/', views.booking_confirmation, name='booking_confirmation'),
+    re_path(r'^booking/(?P<booking_id>\d+)/qr\.(?P<fmt>svg|png)$', views.booking_qr, name='booking_qr'),
     path('track/<str:bus_id>/', views.track_bus, name='track_bus'),  # Add tracking view
     path('api/bus_locations/', views.all_bus_locations_api, name='all_bus_locations'),
+    path('api/bus_locations/stream/', views.bus_locations_stream, name='bus_locations_stream'),
+    path('api/bus_locations/<str:bus_id>/stream/', views.bus_locations_stream, name='bus_location_stream'),
     path('api/bus_locations/<str:bus_id>/', views.bus_locations_api, name='bus_locations_api'),  # API endpoint
     path('lost-and-found/report/', views.report_lost_item, name='report_lost_item'),
     path('lost-and-found/<int:lost_item_id>/', views.lost_and_found_confirmation, name='lost_and_found_confirmation'),
@@ -19,16 +22,22 @@ urlpatterns = [
     path('complaint/<int:complaint_id>/', views.complaint_confirmation, name='complaint_confirmation'),
     path('api/routes/', views.get_routes, name='get_routes'),
     path('api/stops/', views.get_all_stops, name='get_all_stops'),
+    path('api/stops/nearby/', views.nearby_stops, name='nearby_stops'),
+    path('api/stops/<int:stop_id>/arrivals/', views.stop_arrivals, name='stop_arrivals'),
     path('api/stops/<str:route_no>/', views.get_route_stops, name='get_route_stops'),
+    re_path(r'^api/network/(?P<digest>[0-9a-f]{16})\.json$', views.network_snapshot_file, name='network_snapshot'),
     path('api/available-buses/', views.available_buses_from_stop),
+    path('api/journeys/', views.plan_journey, name='plan_journey'),
     path('create-order/', views.create_order, name='create_order'),
     path('payment-success/', views.payment_success, name='payment_success'),
     path('my-bookings/', views.my_bookings, name='my_bookings'),
     path('api/recent-bookings/', views.get_recent_bookings, name='recent_bookings'),
+    path('api/my-bookings/', views.my_bookings_api, name='my_bookings_api'),
     path('profile/', views.profile, name='profile'),
     path('services/', views.services, name='services'),
     path('team/', views.team, name='team'),
 
     path('contact/', views.contact, name='contact'),
     path('api/update-location/', views.update_location, name='update_location'),
+    path('api/update-location/bulk/', views.update_locations_bulk, name='update_locations_bulk'),
 ]
\ No newline at end of file
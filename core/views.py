@@ -2,14 +2,22 @@ import json
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.urls import reverse
-from .models import Schedule, Booking, RouteStop, Bus, Location, LostAndFound, Route, Complaint, Booking
-import qrcode
-from io import BytesIO
+from .models import Schedule, Booking, RouteStop, Bus, BusStop, Location, LatestLocation, LostAndFound, Route, Complaint, Booking
+from .locations import fleet_snapshot, current_fleet_version
+from .spatial import stop_index
+from .eta import get_arrivals
+from .history import HISTORY_PAGE_SIZE, history_page, rider_stats
+from .orders import fare_for
+from .qr import CONTENT_TYPES as QR_CONTENT_TYPES, qr_payload, render_qr
+from .reference import reference_response
+from .snapshot import network_snapshot, read_snapshot
+import gzip
+import hashlib
 from django.conf import settings
-from django.core.files import File
 from django.db import transaction
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse, HttpResponse, HttpResponseNotModified
 from django.shortcuts import get_object_or_404
+from django.utils.http import parse_etags
 from .forms import LostAndFoundForm, ComplaintForm, ComplaintImageFormSet
 
 from django.contrib.auth.decorators import login_required
@@ -46,30 +54,60 @@ def book_ticket_view(request):
     from_stop = request.GET.get('from')
     to_stop = request.GET.get('to')
 
+    trip_id = request.GET.get('trip', '')
     context = {
+        'schedule_id': request.GET.get('schedule', ''),
+        'trip_id': trip_id,
         'route_no': route_no,
         'from_stop': from_stop,
         'to_stop': to_stop,
-        'base_fare': 30,  # static fare for now
+        # Per seat, as create_order prices it; the old flat fare for a page without a bus
+        'base_fare': (fare_for(trip_id) if trip_id.isdigit() else None) or 30,
         'razorpay_key_id': settings.RAZORPAY_KEY_ID
     }
     return render(request, 'book_ticket.html', context)
 
+def _own_booking(request, booking_id, bookings=None):
+    """
+    The booking, if the user may see its ticket: its rider, staff or a
+    conductor. Anyone else gets a 404, as for a booking that doesn't exist.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        raise Http404
+    bookings = Booking.objects.all() if bookings is None else bookings
+    if not (user.is_staff or hasattr(user, 'conductor_profile')):
+        bookings = bookings.filter(user=user)
+    return get_object_or_404(bookings, id=booking_id)
+
 def booking_confirmation(request, booking_id):
-    booking = Booking.objects.get(id=booking_id)
-    if not booking.qr_code:
-        qr = qrcode.make(str(booking.id))  # You can encode booking.id or any unique data
-        buffer = BytesIO()
-        qr.save(buffer)
-        buffer.seek(0)
-        filename = f'booking_{booking.id}_qr.png'
-        booking.qr_code.save(filename, File(buffer), save=True)
+    booking = _own_booking(request, booking_id)
+    # The QR image is served separately by booking_qr, so the page renders without generating it
     return render(request, 'booking_confirmation.html', {'booking': booking})
 
+# Ticket QR codes never change for a booking, so browsers may keep them for a day
+QR_MAX_AGE = 24 * 60 * 60
+
+def booking_qr(request, booking_id, fmt):
+    """Ticket QR code of a booking as SVG or PNG, rendered on demand and memoised."""
+    # The QR is a signed ticket: only for those who may see the booking
+    booking = _own_booking(request, booking_id, Booking.objects.only(
+        'id', 'user_id', 'route', 'source', 'destination', 'seats', 'booking_time',
+    ))
+    payload = qr_payload(booking)
+    etag = f'"{hashlib.sha1(payload.encode()).hexdigest()}"'
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(render_qr(payload, fmt), content_type=QR_CONTENT_TYPES[fmt])
+    response['ETag'] = etag
+    response['Cache-Control'] = f'private, max-age={QR_MAX_AGE}'
+    return response
+
 def bus_locations_api(request, bus_id):
     bus = get_object_or_404(Bus, bus_id=bus_id)  # Use bus_id field, not pk
-    # Get the latest location for the bus (or recent locations, if desired)
-    locations = Location.objects.filter(bus=bus).order_by('-timestamp')[:1]  # Latest location
+    # Latest location comes from the one-row-per-bus store
+    locations = LatestLocation.objects.filter(bus=bus)
     data = [
         {
             'lat': location.latitude,
@@ -84,20 +122,69 @@ def track_bus(request, bus_id):
 
 
 def all_bus_locations_api(request):
-    # For each bus, get the latest location
-    buses = Bus.objects.all()
-    data = []
-
-    for bus in buses:
-        latest_location = Location.objects.filter(bus=bus).order_by('-timestamp').first()
-        if latest_location:
-            data.append({
-                'id': bus.bus_id,
-                'lat': latest_location.latitude,
-                'lng': latest_location.longitude
-            })
+    """
+    Latest position of every bus. Supports ``?since=<version>`` to get only the
+    buses that moved after that version, and ETag/If-None-Match; both answer
+    304 when nothing changed. The current version is sent as X-Location-Version.
+    """
+    # Read the version before the rows so a concurrent write is resent, never skipped
+    version = current_fleet_version()
+    etag = f'"v{version}"'
+
+    since = request.GET.get('since')
+    try:
+        since = int(since) if since is not None else None
+    except ValueError:
+        return JsonResponse({"error": "'since' must be an integer"}, status=400)
 
-    return JsonResponse(data, safe=False)
+    if since == version or etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        # One query for the whole fleet, whatever its size
+        response = JsonResponse(fleet_snapshot(since=since), safe=False)
+
+    response['ETag'] = etag
+    response['X-Location-Version'] = str(version)
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from .broker import position_broker
+
+# Seconds between keep-alive comments on an idle stream
+STREAM_KEEPALIVE = 15
+
+
+async def bus_locations_stream(request, bus_id=None):
+    """
+    Server-Sent Events feed of bus positions, for the whole fleet or one bus.
+    Sends the current snapshot first, then every committed update.
+    """
+    if not isinstance(request, ASGIRequest):
+        # A never-ending response would pin a WSGI worker; clients fall back to polling
+        return JsonResponse({"error": "Streaming requires the ASGI server"}, status=503)
+
+    async def events():
+        subscription = position_broker.subscribe(bus_id)
+        try:
+            snapshot = await sync_to_async(fleet_snapshot)(bus_id)
+            yield f"data: {json.dumps(snapshot)}\n\n"
+            while True:
+                batch = await subscription.next_batch(STREAM_KEEPALIVE)
+                if batch:
+                    yield f"data: {json.dumps(batch)}\n\n"
+                else:
+                    yield ": keepalive\n\n"
+        finally:
+            position_broker.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 def report_lost_item(request):
@@ -150,29 +237,62 @@ def complaint_confirmation(request, complaint_id):
 
 
 def get_routes(request):
-    routes = Route.objects.all().values('route_no', 'source', 'destination')
-    return JsonResponse(list(routes), safe=False)
+    return reference_response(request, 'routes')
 
 def get_all_stops(request):
-    from .models import BusStop
-    stops = BusStop.objects.all().values('id', 'name')
-    return JsonResponse(list(stops), safe=False)
+    return reference_response(request, 'stops')
+
+def nearby_stops(request):
+    """The ``k`` stops nearest to ``lat``/``lng`` with their distance in metres."""
+    try:
+        lat = float(request.GET['lat'])
+        lng = float(request.GET['lng'])
+        k = max(1, min(int(request.GET.get('k', 5)), 50))
+    except (KeyError, ValueError):
+        return JsonResponse({"error": "Pass numeric 'lat' and 'lng' (and optionally 'k')"}, status=400)
 
-def get_route_stops(request, route_no):
-    from .models import RouteStop
-    route_stops = RouteStop.objects.filter(route__route_no=route_no).select_related('bus_stop')
-    
     data = [
-        {'id': rs.bus_stop.id, 'name': rs.bus_stop.name}
-        for rs in route_stops
+        {'id': stop_id, 'name': name, 'lat': stop_lat, 'lng': stop_lng, 'distance_m': round(distance, 1)}
+        for distance, stop_id, name, stop_lat, stop_lng in stop_index.get().nearest(lat, lng, k)
     ]
+    return JsonResponse(data, safe=False)
 
+def stop_arrivals(request, stop_id):
+    """Predicted arrivals of active buses at a stop, soonest first."""
+    get_object_or_404(BusStop, id=stop_id)
+    data = [
+        {'bus_id': bus_id, 'route_no': route_no, 'eta_seconds': eta, 'distance_km': distance}
+        for eta, bus_id, route_no, distance in get_arrivals().get(stop_id, [])
+    ]
     return JsonResponse(data, safe=False)
 
+def get_route_stops(request, route_no):
+    return reference_response(request, 'route_stops', route_no)
+
+
+def network_snapshot_file(request, digest):
+    """A network snapshot by digest; its content never changes, so it may be cached for good."""
+    snapshot = network_snapshot.get()
+    gzipped = snapshot.gzipped if digest == snapshot.digest else read_snapshot(digest)
+    if gzipped is None:
+        raise Http404("Unknown network snapshot")
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response = HttpResponse(gzipped, content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(gzip.decompress(gzipped), content_type='application/json')
+    response['ETag'] = f'"{digest}"'
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 
 from django.http import JsonResponse
-from datetime import datetime
-from .models import RouteStop, Schedule
+from datetime import datetime, timedelta
+from django.utils import timezone
+from .models import StopDeparture
+from .network import get_network_index
+from .service import ensure_trips
 
 def available_buses_from_stop(request):
     from_stop = request.GET.get('from')
@@ -181,106 +301,239 @@ def available_buses_from_stop(request):
     if not from_stop:
         return JsonResponse({"error": "Missing 'from' parameter"}, status=400)
 
-    # Find all routes that pass through the from_stop
-    matching_from_stops = RouteStop.objects.filter(bus_stop__name__iexact=from_stop)
-    route_ids = matching_from_stops.values_list('route_id', flat=True)
-
-    # Filter out buses that already departed today
-    now = datetime.now().time()
-    schedules = Schedule.objects.filter(route_id__in=route_ids, departure_time__gte=now)
+    # Routes that pass through from_stop (and reach to_stop after it) come from the in-memory index
+    network = get_network_index()
+    route_ids = network.routes_between(from_stop, to_stop or None)
+
+    # Trips still to leave from_stop: today's, and yesterday's running past midnight
+    now = timezone.now()
+    today = timezone.localdate(now)
+    service_dates = [today - timedelta(days=1), today]
+    for day in service_dates:
+        ensure_trips(day, route_ids)
+    departures = StopDeparture.objects.filter(
+        service_date__in=service_dates, stop_id__in=network.stop_ids(from_stop), departs_at__gte=now,
+        trip__schedule__route_id__in=route_ids,
+    ).order_by('departs_at').values_list(
+        'trip_id', 'trip__schedule_id', 'trip__schedule__route_id', 'departs_at', 'trip__schedule__bus__category',
+        'trip__available_seats',
+    )
 
     results = []
-    for sched in schedules:
-        route_stops = sched.route.route_stops.select_related('bus_stop').order_by('stop_order')
-        stop_names = [stop.bus_stop.name for stop in route_stops]
-
-        if from_stop in stop_names:
-            if to_stop:
-                if to_stop in stop_names:
-                    from_index = stop_names.index(from_stop)
-                    to_index = stop_names.index(to_stop)
-
-                    if from_index < to_index:
-                        results.append({
-                            "route_no": sched.route.route_no,
-                            "from": from_stop,
-                            "to": to_stop,
-                            "type": sched.bus.category,
-                            "time": sched.departure_time.strftime('%I:%M %p')
-                        })
-            else:
-                results.append({
-                    "route_no": sched.route.route_no,
-                    "from": from_stop,
-                    "to": sched.route.destination,
-                    "type": sched.bus.category,
-                    "time": sched.departure_time.strftime('%I:%M %p')
-                })
+    seen = set()
+    for trip_id, schedule_id, route_id, departs_at, category, seats_left in departures:
+        if trip_id in seen:
+            # A route passing the stop twice: the first call is the one to board
+            continue
+        seen.add(trip_id)
+        route = network.routes[route_id]
+        results.append({
+            "trip_id": trip_id,
+            "schedule_id": schedule_id,
+            "route_no": route['route_no'],
+            "from": from_stop,
+            "to": to_stop or route['destination'],
+            "type": category,
+            "time": timezone.localtime(departs_at).strftime('%I:%M %p'),
+            "seats_left": seats_left,
+        })
 
     return JsonResponse(results, safe=False)
 
 
+from .journey import timetable_for, seconds_of
+
+def plan_journey(request):
+    """Earliest-arrival itineraries between two stops, with up to ``max_transfers`` changes."""
+    from_stop = request.GET.get('from')
+    to_stop = request.GET.get('to')
+    if not from_stop or not to_stop:
+        return JsonResponse({"error": "Missing 'from' or 'to' parameter"}, status=400)
+
+    try:
+        depart = request.GET.get('time')
+        depart = datetime.strptime(depart, '%H:%M').time() if depart else timezone.localtime().time()
+        max_transfers = max(0, min(int(request.GET.get('max_transfers', 2)), 4))
+    except ValueError:
+        return JsonResponse({"error": "Use time=HH:MM and an integer max_transfers"}, status=400)
+
+    network = timetable_for(timezone.localdate())
+    origins = network.resolve(from_stop)
+    destinations = network.resolve(to_stop)
+    if not origins or not destinations:
+        return JsonResponse({"error": "Unknown stop"}, status=404)
+
+    journeys = network.plan(origins, destinations, seconds_of(depart), max_transfers)
+    return JsonResponse({'journeys': journeys})
+
+
 
 
-import razorpay
 from django.views.decorators.csrf import csrf_exempt
 
+from .inventory import SoldOut, hold_seats, release_hold
+from .models import PaymentOrder
+from .orders import PaymentMismatch, fulfil, order_amount, record_order
+from .payments import GatewayError, PaymentRejected, get_gateway
+from .service import trip_for
+
+
+def _json_object(body, what):
+    """A request body that must be a JSON object. Raises ValueError."""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        raise ValueError(f"Send the {what} as a JSON object")
+    return data
+
+
+def _order_request(body):
+    """
+    The create_order body, with trip_id, schedule_id and tickets as
+    integers (trip and schedule None when not sent). Raises ValueError.
+    """
+    data = _json_object(body, "order")
+    try:
+        for key in ("trip_id", "schedule_id"):
+            data[key] = int(data[key]) if data.get(key) else None
+        data["tickets"] = int(data.get("tickets") or 1)
+    except (TypeError, ValueError):
+        raise ValueError("trip_id, schedule_id and tickets must be integers") from None
+    if data["tickets"] <= 0:
+        raise ValueError("Book at least one ticket")
+    return data
+
+
+def _hold_for_order(data):
+    """
+    Hold the requested seats, if the order names a trip, and price them.
+    Returns (hold, amount in paise), or (None, None) if it doesn't. Raises SoldOut.
+    """
+    trip_id = data["trip_id"]
+    if not trip_id and data["schedule_id"]:
+        # Older pages send the schedule: that is today's run of it
+        trip = trip_for(data["schedule_id"])
+        if trip is None:
+            raise SoldOut("This bus does not run today")
+        trip_id = trip.id
+    if not trip_id:
+        return None, None
+    hold = hold_seats(trip_id, data["tickets"])
+    return hold, order_amount(hold)
+
+
 @csrf_exempt
-def create_order(request):
-    data = json.loads(request.body)
-    amount = int(data.get("amount", 0))
-    client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-    order = client.order.create({'amount': amount, 'currency': 'INR', 'payment_capture': 1})
+async def create_order(request):
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({"error": "Log in to book a ticket"}, status=403)
+    try:
+        data = _order_request(request.body)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    # Hold the seats until the payment completes (or the hold expires).
+    # The price is the route's fare for them: an amount the page posts is ignored.
+    try:
+        hold, amount = await sync_to_async(_hold_for_order)(data)
+    except SoldOut as e:
+        return JsonResponse({"error": str(e)}, status=409)
+    if hold is None:
+        return JsonResponse({"error": "Choose a bus to book"}, status=400)
+
+    # Awaited on the gateway's own threads: a slow gateway holds no worker
+    try:
+        order = await get_gateway().acreate_order(amount, receipt=f"hold_{hold.id}")
+    except GatewayError as e:
+        await sync_to_async(release_hold)(hold)
+        return JsonResponse({"error": str(e)}, status=400 if isinstance(e, PaymentRejected) else 503)
+
+    await sync_to_async(record_order)(order['id'], user, amount, data, hold)
     return JsonResponse(order)
 
 
-from django.contrib.auth.models import User
-#user = User.objects.first()
+def _confirmed(booking_id):
+    return JsonResponse({
+        "message": "Booking confirmed",
+        "redirect_url": reverse('booking_confirmation', kwargs={'booking_id': booking_id})
+    })
 
 
 @csrf_exempt
 def payment_success(request):
-    if request.method == "POST":
-        data = json.loads(request.body)
-
-        route_no = data.get("route_no")
-        from_stop = data.get("from")
-        to_stop = data.get("to")
-        seats = int(data.get("seats") or 1)
-        fare = int(data.get("amount", 0))
-
-        user = request.user if request.user.is_authenticated else None
-
-        booking = Booking.objects.create(
-            user=user,  # ✅ Link the booking to the logged-in user
-            route=route_no,
-            source=from_stop,
-            destination=to_stop,
-            seats=seats,
-            fare=fare,
-            created_online=True,
-        )
-
-        return JsonResponse({
-            "message": "Booking confirmed",
-            "redirect_url": reverse('booking_confirmation', kwargs={'booking_id': booking.id})
-        })
-
-    return JsonResponse({'error': 'Invalid request'}, status=400)
+    """
+    Book a paid order. Idempotent: the booking comes from the PaymentOrder
+    recorded at create_order, and a retry gets the same booking back.
+    """
+    if request.method != "POST":
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    try:
+        data = _json_object(request.body, "payment")
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    order_id, payment_id, signature = (data.get(key) or '' for key in ("order_id", "payment_id", "signature"))
+    if not all(isinstance(value, str) for value in (order_id, payment_id, signature)):
+        return JsonResponse({"error": "order_id, payment_id and signature must be strings"}, status=400)
+    if not order_id or not payment_id:
+        return JsonResponse({"error": "order_id and payment_id are required"}, status=400)
+
+    # A local HMAC check, before anything about the order is given away
+    if not get_gateway().verify_payment(order_id, payment_id, signature):
+        return JsonResponse({"error": "The payment could not be verified"}, status=400)
+
+    # A retry of a confirmed payment: one indexed lookup, no writes
+    booking_id = Booking.objects.filter(order_id=order_id).values_list('id', flat=True).first()
+    if booking_id:
+        return _confirmed(booking_id)
+    order = PaymentOrder.objects.filter(order_id=order_id).first()
+    if order is None:
+        return JsonResponse({"error": "Unknown order"}, status=404)
+    try:
+        booking, _ = fulfil(order, get_gateway().fetch_payment(payment_id))
+    except GatewayError as e:
+        return JsonResponse({"error": str(e)}, status=503)
+    except PaymentMismatch:
+        return JsonResponse({"error": "The payment does not match the order"}, status=400)
+    except SoldOut:
+        return JsonResponse({"error": "The held seats expired and the bus is now full"}, status=409)
+    return _confirmed(booking.id)
 
 
 
 
 from django.http import JsonResponse
 from django.shortcuts import render
+from django.utils import timezone
 from .models import Booking
 
 def my_bookings(request):
     if not request.user.is_authenticated:
         return render(request, 'booking_history.html', {'bookings': []})
 
-    bookings = Booking.objects.filter(user=request.user).order_by('-booking_time')
-    return render(request, 'booking_history.html', {'bookings': bookings})
+    # First page only; the page loads the rest from my_bookings_api as it is scrolled
+    bookings, next_cursor, has_more = history_page(request.user.id)
+    return render(request, 'booking_history.html', {
+        'bookings': bookings,
+        'next_cursor': next_cursor if has_more else None,
+        'stats': rider_stats(request.user.id),
+    })
+
+
+def my_bookings_api(request):
+    """Next page of the user's booking history after ?after=."""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Login required'}, status=401)
+    try:
+        limit = max(1, min(int(request.GET.get('limit', HISTORY_PAGE_SIZE)), 100))
+        bookings, next_cursor, has_more = history_page(request.user.id, request.GET.get('after'), limit)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor or limit'}, status=400)
+    return JsonResponse({
+        'bookings': [{**b, 'booking_time': timezone.localtime(b['booking_time']).strftime('%Y-%m-%d %H:%M')} for b in bookings],
+        'next': next_cursor if has_more else None,
+    })
 
 
 def get_recent_bookings(request):
@@ -410,3 +663,24 @@ def update_location(request):
             print("Error updating location:", e)
             return JsonResponse({"status": "error", "message": str(e)}, status=400)
     return JsonResponse({"status": "error", "message": "Invalid method"}, status=405)
+
+
+from .locations import parse_fixes, ingest_fixes
+
+@csrf_exempt
+def update_locations_bulk(request):
+    """Store many GPS fixes (JSON array or NDJSON) for any number of buses in one request."""
+    if request.method != 'POST':
+        return JsonResponse({"status": "error", "message": "Invalid method"}, status=405)
+
+    fixes = parse_fixes(request.body, request.content_type or '')
+    if not fixes:
+        return JsonResponse({"status": "error", "message": "No fixes in request"}, status=400)
+
+    created, errors = ingest_fixes(fixes)
+    return JsonResponse({
+        "status": "success" if not errors else "partial",
+        "received": len(fixes),
+        "created": len(created),
+        "errors": errors,
+    })